@@ -0,0 +1,545 @@
+"""
+Compact, schema-registered Protobuf encoding for the `trade` and `ohlcv` topics.
+
+JSON repeats every field name in every message. With `KAFKA_VALUE_ENCODING=protobuf`
+the values are Protobuf messages in the Confluent wire format instead:
+
+    0x00 | schema ID (4 bytes, big endian) | message index (0x00) | Protobuf message
+
+The schemas are registered in the schema registry of the Redpanda stack, so any
+Protobuf-aware consumer (or the Redpanda console) can read the topics. The codec does
+not need the protobuf package: our messages are one string (the product ID) followed by
+fixed-width numbers, so a whole message is one precompiled `struct` layout.
+
+Every service that reads or writes these topics installs this package (a path dependency
+in its pyproject), so the producers and the consumers always agree on the wire format.
+"""
+import struct
+import sys
+from itertools import repeat
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from confluent_kafka.schema_registry import Schema, SchemaRegistryClient
+from quixstreams.models.serializers import Deserializer, Serializer
+from quixstreams.utils.json import loads as json_loads
+
+# NumPy is optional: it decodes whole batches a lot faster, but we can live without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# the fields of the messages, in field number order, as (name, type)
+TRADE_FIELDS = [
+    ('product_id', 'string'),
+    ('quantity', 'double'),
+    ('price', 'double'),
+    ('timestamp_ms', 'int64'),
+    # the taker side: 1 for a buy, -1 for a sell, 0 if unknown (and in older messages)
+    ('side', 'int64'),
+    # the ID the exchange gave the trade, 0 if none (and in older messages)
+    ('trade_id', 'int64'),
+]
+CANDLE_FIELDS = [
+    ('product_id', 'string'),
+    ('timestamp_ms', 'int64'),
+    ('open', 'double'),
+    ('high', 'double'),
+    ('low', 'double'),
+    ('close', 'double'),
+    ('volume', 'double'),
+    ('vwap', 'double'),
+    ('trade_count', 'int64'),
+    ('buy_volume', 'double'),
+    ('sell_volume', 'double'),
+    # the sum of price * quantity of the trades
+    ('notional', 'double'),
+]
+# With fixed-point prices and quantities (see FixedPointDecimals) the same fields are
+# integers: the number of 10**-decimals units of the product. The VWAP is not a whole
+# number of units, and the notional (in price units times quantity units) can go past
+# int64, so they stay doubles.
+FIXED_POINT_TRADE_FIELDS = [
+    (name, 'int64' if name in ('quantity', 'price') else field_type) for name, field_type in TRADE_FIELDS
+]
+FIXED_POINT_CANDLE_FIELDS = [
+    (name, 'int64' if field_type == 'double' and name not in ('vwap', 'notional') else field_type)
+    for name, field_type in CANDLE_FIELDS
+]
+# the candle fields that are prices, quantities, and prices times quantities
+CANDLE_PRICE_FIELDS = ('open', 'high', 'low', 'close', 'vwap')
+CANDLE_QUANTITY_FIELDS = ('volume', 'buy_volume', 'sell_volume')
+CANDLE_NOTIONAL_FIELDS = ('notional',)
+
+# the Protobuf type and the struct format of each numeric field type. They are all
+# fixed-width (wire type 1), which is what makes the precompiled layouts possible.
+NUMERIC_TYPES = {
+    'double': ('double', 'd'),
+    'int64': ('sfixed64', 'q'),
+}
+WIRE_TYPE_VARINT = 0
+WIRE_TYPE_64BIT = 1
+WIRE_TYPE_LENGTH_DELIMITED = 2
+WIRE_TYPE_32BIT = 5
+
+# the first byte of a message in the Confluent wire format
+MAGIC_BYTE = 0
+# the length of the framing we write: magic byte, schema ID and message index
+HEADER_SIZE = 6
+
+
+def _decode_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """
+    Returns the varint at `pos` and the position right after it.
+    """
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class ProtobufRecordCodec:
+    """
+    Encodes flat records as Protobuf messages and back.
+
+    The first field is a string (the message key, e.g. the product ID) and the others
+    are numbers. The fields are numbered from 1 in the order they are given.
+
+    For each length of the string we compile one `struct` layout of the whole message,
+    tag bytes included, so encoding or decoding a message is one pack or unpack. The
+    `*_columns` methods do a whole batch at once, which is what makes Protobuf cheaper
+    than JSON in pure Python. Messages with any other layout (fields missing, reordered
+    or added by a newer schema) go through a slower generic decoder, so the schema can
+    still evolve by adding fields.
+    """
+
+    def __init__(self, message_name: str, fields: List[Tuple[str, str]]) -> None:
+        """
+        Args:
+            message_name (str): The name of the Protobuf message.
+            fields (List[Tuple[str, str]]): The (name, type) of each field. The first one
+                is a 'string' and the others 'double' or 'int64'.
+        """
+        if fields[0][1] != 'string' or any(kind not in NUMERIC_TYPES for _, kind in fields[1:]):
+            raise ValueError('The first field must be a string, and the others double or int64')
+        if len(fields) > 15:
+            raise ValueError('Only messages with up to 15 fields have one-byte tags')
+
+        self.message_name = message_name
+        self.fields = fields
+
+        self._string_name = fields[0][0]
+        self._string_tag = (1 << 3) | WIRE_TYPE_LENGTH_DELIMITED
+        self._numeric_names = tuple(name for name, _ in fields[1:])
+        self._numeric_tags = tuple(
+            (number << 3) | WIRE_TYPE_64BIT for number in range(2, len(fields) + 1)
+        )
+        self._numeric_format = ''.join('B' + NUMERIC_TYPES[kind][1] for _, kind in fields[1:])
+        self._numbers = struct.Struct('<' + self._numeric_format)
+
+        # the field name and type of each field number, for the generic decoder
+        self._by_number = {number: field for number, field in enumerate(fields, start=1)}
+        self._defaults = {name: {'string': '', 'double': 0.0, 'int64': 0}[kind] for name, kind in fields}
+
+        # the layouts of the whole message per string length, the encoded prefix (header
+        # and string) per header and string, and the decoded strings, which are mostly
+        # a handful of product IDs
+        self._layouts: Dict[Tuple[int, int], struct.Struct] = {}
+        self._prefixes: Dict[Tuple[bytes, str], bytes] = {}
+        self._strings: Dict[bytes, str] = {}
+
+    @property
+    def proto_schema(self) -> str:
+        """
+        Returns the schema of the message in the Protobuf language.
+        """
+        lines = [f'  string {self._string_name} = 1;'] + [
+            f'  {NUMERIC_TYPES[kind][0]} {name} = {number};'
+            for number, (name, kind) in enumerate(self.fields[1:], start=2)
+        ]
+        return 'syntax = "proto3";\n\nmessage ' + self.message_name + ' {\n' + '\n'.join(lines) + '\n}\n'
+
+    def _get_layout(self, header_size: int, string_length: int) -> struct.Struct:
+        """
+        Returns the layout of a message with the given header and string lengths.
+        """
+        layout = self._layouts.get((header_size, string_length))
+        if layout is None:
+            layout = struct.Struct(f'<{header_size}sBB{string_length}s{self._numeric_format}')
+            self._layouts[(header_size, string_length)] = layout
+        return layout
+
+    def _get_prefix(self, header: bytes, string: str) -> bytes:
+        """
+        Returns the encoded header and string field of a message.
+        """
+        prefix = self._prefixes.get((header, string))
+        if prefix is None:
+            encoded = string.encode()
+            if len(encoded) > 0x7F:
+                raise ValueError(f'{self._string_name} is too long: {string}')
+            prefix = header + bytes((self._string_tag, len(encoded))) + encoded
+            self._prefixes[(header, string)] = prefix
+        return prefix
+
+    def _get_string(self, encoded: bytes) -> str:
+        """
+        Returns the decoded (and interned) string.
+        """
+        string = self._strings.get(encoded)
+        if string is None:
+            string = sys.intern(encoded.decode())
+            self._strings[encoded] = string
+        return string
+
+    def encode(self, record: Mapping[str, Any], header: bytes = b'') -> bytes:
+        """
+        Returns the Protobuf encoding of the record.
+
+        Args:
+            record (Mapping[str, Any]): A record with (at least) all the fields.
+            header (bytes): The framing to put before the message.
+
+        Returns:
+            bytes: The message.
+        """
+        values = []
+        for tag, name in zip(self._numeric_tags, self._numeric_names):
+            values.append(tag)
+            values.append(record[name])
+        return self._get_prefix(header, record[self._string_name]) + self._numbers.pack(*values)
+
+    def encode_columns(self, columns: Mapping[str, Sequence], header: bytes = b'') -> List[bytes]:
+        """
+        Returns the Protobuf encoding of a batch of records, given one sequence per field.
+
+        Args:
+            columns (Mapping[str, Sequence]): The values of each field.
+            header (bytes): The framing to put before each message.
+
+        Returns:
+            List[bytes]: One message per record.
+        """
+        interleaved = []
+        for tag, name in zip(self._numeric_tags, self._numeric_names):
+            interleaved.append(repeat(tag))
+            interleaved.append(columns[name])
+
+        pack = self._numbers.pack
+        get_prefix = self._get_prefix
+        return [
+            get_prefix(header, string) + pack(*values)
+            for string, values in zip(columns[self._string_name], zip(*interleaved))
+        ]
+
+    def decode(self, data: bytes, pos: int = 0) -> Dict[str, Any]:
+        """
+        Returns the record in the Protobuf message that starts at `pos`.
+
+        Args:
+            data (bytes): The message.
+            pos (int): Where the Protobuf message starts (after any framing).
+
+        Returns:
+            Dict[str, Any]: The record. Missing fields get their Protobuf default.
+        """
+        if len(data) > pos + 1 and data[pos] == self._string_tag and data[pos + 1] <= 0x7F:
+            layout = self._get_layout(0, data[pos + 1])
+            if pos + layout.size == len(data):
+                values = layout.unpack_from(data, pos)
+                if values[4::2] == self._numeric_tags:
+                    record = {self._string_name: self._get_string(values[3])}
+                    record.update(zip(self._numeric_names, values[5::2]))
+                    return record
+
+        return self._decode_generic(data, pos)
+
+    def decode_columns(self, messages: List[bytes], header_size: int = 0) -> Dict[str, list]:
+        """
+        Decodes a batch of messages into one list per field.
+
+        When all the messages have the same layout (the usual case: one product, or
+        products with IDs of the same length) they are unpacked in one pass, with NumPy
+        if it is installed.
+
+        Args:
+            messages (List[bytes]): The messages.
+            header_size (int): The length of the framing before each message.
+
+        Returns:
+            Dict[str, list]: The values of each field, in the order of the messages.
+        """
+        if messages:
+            first = messages[0]
+            length = len(first)
+            if (
+                length > header_size + 1
+                and first[header_size] == self._string_tag
+                and self._get_layout(header_size, first[header_size + 1]).size == length
+                and all(len(message) == length for message in messages)
+            ):
+                unpack = self._unpack_with_numpy if np is not None else self._unpack_with_struct
+                decoded = unpack(b''.join(messages), header_size, first[header_size + 1])
+                if decoded is not None:
+                    return decoded
+
+        records = [self.decode(message, header_size) for message in messages]
+        return {name: [record[name] for record in records] for name, _ in self.fields}
+
+    def _unpack_with_struct(
+        self, buffer: bytes, header_size: int, string_length: int
+    ) -> Optional[Dict[str, list]]:
+        """
+        Unpacks a buffer of messages with the same layout, or returns None if some of
+        them do not have our layout after all.
+        """
+        columns = list(zip(*self._get_layout(header_size, string_length).iter_unpack(buffer)))
+        if set(columns[1]) != {self._string_tag} or set(columns[2]) != {string_length}:
+            return None
+        if any(set(column) != {tag} for column, tag in zip(columns[4::2], self._numeric_tags)):
+            return None
+
+        decoded = {self._string_name: [self._get_string(s) for s in columns[3]]}
+        for name, column in zip(self._numeric_names, columns[5::2]):
+            decoded[name] = list(column)
+        return decoded
+
+    def _unpack_with_numpy(
+        self, buffer: bytes, header_size: int, string_length: int
+    ) -> Optional[Dict[str, list]]:
+        """
+        Same as `_unpack_with_struct`, viewing the buffer as a NumPy structured array.
+        """
+        formats = [f'V{header_size}' if header_size else 'V0', 'u1', 'u1', f'S{string_length}']
+        for _, kind in self.fields[1:]:
+            formats += ['u1', '<f8' if kind == 'double' else '<i8']
+        names = [f'f{i}' for i in range(len(formats))]
+        array = np.frombuffer(buffer, dtype=np.dtype({'names': names, 'formats': formats}))
+
+        if not (array['f1'] == self._string_tag).all() or not (array['f2'] == string_length).all():
+            return None
+        for i, tag in enumerate(self._numeric_tags):
+            if not (array[f'f{4 + 2 * i}'] == tag).all():
+                return None
+
+        # decode each distinct string once
+        strings, inverse = np.unique(array['f3'], return_inverse=True)
+        strings = [self._get_string(s) for s in strings.tolist()]
+        decoded = {self._string_name: [strings[i] for i in inverse.tolist()]}
+        for i, name in enumerate(self._numeric_names):
+            decoded[name] = array[f'f{5 + 2 * i}'].tolist()
+        return decoded
+
+    def _decode_generic(self, data: bytes, pos: int) -> Dict[str, Any]:
+        """
+        Decodes any Protobuf message with the fields of the codec, skipping the unknown ones.
+        """
+        record = dict(self._defaults)
+        while pos < len(data):
+            key, pos = _decode_varint(data, pos)
+            number, wire_type = key >> 3, key & 0x07
+            name, kind = self._by_number.get(number, (None, None))
+
+            if wire_type == WIRE_TYPE_64BIT:
+                if kind in NUMERIC_TYPES:
+                    record[name] = struct.unpack_from('<' + NUMERIC_TYPES[kind][1], data, pos)[0]
+                pos += 8
+            elif wire_type == WIRE_TYPE_LENGTH_DELIMITED:
+                length, pos = _decode_varint(data, pos)
+                if kind == 'string':
+                    record[name] = self._get_string(data[pos:pos + length])
+                pos += length
+            elif wire_type == WIRE_TYPE_VARINT:
+                _, pos = _decode_varint(data, pos)
+            elif wire_type == WIRE_TYPE_32BIT:
+                pos += 4
+            else:
+                raise ValueError(f'Unsupported Protobuf wire type {wire_type} in {self.message_name}')
+        return record
+
+
+TRADE_CODEC = ProtobufRecordCodec('Trade', TRADE_FIELDS)
+CANDLE_CODEC = ProtobufRecordCodec('Candle', CANDLE_FIELDS)
+FIXED_POINT_TRADE_CODEC = ProtobufRecordCodec('FixedPointTrade', FIXED_POINT_TRADE_FIELDS)
+FIXED_POINT_CANDLE_CODEC = ProtobufRecordCodec('FixedPointCandle', FIXED_POINT_CANDLE_FIELDS)
+
+
+class FixedPointDecimals:
+    """
+    The number of decimals of the fixed-point prices and quantities of each product.
+
+    With fixed-point enabled, prices and quantities travel as integers: the price in
+    ticks of 10**-price_decimals and the quantity in lots of 10**-quantity_decimals.
+    The trades are converted once, in the producer, and from there on the sums and the
+    comparisons of the candles are exact integer arithmetic, until the consumers at the
+    end of the pipeline turn them back into floats. The decimals are set per product,
+    since e.g. BTC/EUR has 1 price decimal and XRP/EUR has 5.
+    """
+
+    def __init__(self, decimals: Mapping[str, Sequence[int]]) -> None:
+        """
+        Args:
+            decimals (Mapping[str, Sequence[int]]): The (price decimals, quantity decimals)
+                of each product, e.g. {'BTC/EUR': (1, 8)}.
+        """
+        self.decimals = {product_id: (int(p), int(q)) for product_id, (p, q) in decimals.items()}
+
+    def get(self, product_id: str) -> Tuple[int, int]:
+        """
+        Returns the (price decimals, quantity decimals) of a product.
+        """
+        try:
+            return self.decimals[product_id]
+        except KeyError:
+            raise ValueError(f'No fixed-point decimals configured for {product_id}') from None
+
+    def to_float_columns(
+        self,
+        columns: Dict[str, list],
+        price_fields: Sequence[str],
+        quantity_fields: Sequence[str],
+        notional_fields: Sequence[str] = (),
+    ) -> Dict[str, list]:
+        """
+        Returns the columns of a batch of records with the fixed-point fields turned back
+        into floats, e.g. before they go to the feature store. The notional fields are in
+        price units times quantity units.
+        """
+        # dividing by a power of 10 (rather than multiplying by its inverse) gives the
+        # float closest to the decimal value
+        scales = {
+            product_id: tuple(10 ** decimals for decimals in self.get(product_id))
+            for product_id in set(columns['product_id'])
+        }
+        rows = [scales[product_id] for product_id in columns['product_id']]
+        converted = dict(columns)
+        for name in price_fields:
+            converted[name] = [value / scale[0] for value, scale in zip(columns[name], rows)]
+        for name in quantity_fields:
+            converted[name] = [value / scale[1] for value, scale in zip(columns[name], rows)]
+        for name in notional_fields:
+            converted[name] = [value / (scale[0] * scale[1]) for value, scale in zip(columns[name], rows)]
+        return converted
+
+
+class SchemaRegistryProtobufSerializer(Serializer):
+    """
+    A quixstreams serializer that writes records as Protobuf messages in the Confluent
+    wire format. The schema is registered under `<topic>-value` the first time it is used.
+    """
+
+    def __init__(
+        self, codec: ProtobufRecordCodec, schema_registry_url: str, topic: str
+    ) -> None:
+        """
+        Args:
+            codec (ProtobufRecordCodec): The codec of the records.
+            schema_registry_url (str): The URL of the schema registry.
+            topic (str): The name of the topic the records go to.
+        """
+        super().__init__()
+        self.codec = codec
+        self.schema_registry_url = schema_registry_url
+        self.subject = f'{topic}-value'
+        self._header: Optional[bytes] = None
+
+    @property
+    def header(self) -> bytes:
+        """
+        Returns the framing of our messages, registering the schema if needed.
+        """
+        if self._header is None:
+            client = SchemaRegistryClient({'url': self.schema_registry_url})
+            # registering a schema that is already registered returns its ID
+            schema_id = client.register_schema(
+                self.subject, Schema(self.codec.proto_schema, schema_type='PROTOBUF')
+            )
+            # magic byte, schema ID and the index of the message in the schema (the first one)
+            self._header = bytes((MAGIC_BYTE,)) + schema_id.to_bytes(4, 'big') + b'\x00'
+        return self._header
+
+    def __call__(self, value: Mapping[str, Any], ctx=None) -> bytes:
+        return self.codec.encode(value, self.header)
+
+    def serialize_columns(self, columns: Mapping[str, Sequence]) -> List[bytes]:
+        """
+        Returns one message per record of a batch given one sequence per field.
+        """
+        return self.codec.encode_columns(columns, self.header)
+
+
+class AutoDeserializer(Deserializer):
+    """
+    A quixstreams deserializer that reads both the Protobuf messages written by
+    `SchemaRegistryProtobufSerializer` and plain JSON, looking at the first byte.
+
+    Consumers use it whatever the encoding of the producers, so a topic can switch from
+    JSON to Protobuf (or back) without reconfiguring them.
+    """
+
+    def __init__(self, codec: ProtobufRecordCodec) -> None:
+        """
+        Args:
+            codec (ProtobufRecordCodec): The codec of the Protobuf records.
+        """
+        super().__init__()
+        self.codec = codec
+
+    def __call__(self, value: bytes, ctx=None) -> Dict[str, Any]:
+        if value[0] != MAGIC_BYTE:
+            return json_loads(value)
+
+        # skip the schema ID and the message indexes (a count, then the indexes), which
+        # is a single 0 for the first message of the schema
+        if value[5] == 0:
+            return self.codec.decode(value, HEADER_SIZE)
+        n_indexes, pos = _decode_varint(value, 5)
+        for _ in range(n_indexes):
+            _, pos = _decode_varint(value, pos)
+        return self.codec.decode(value, pos)
+
+    def deserialize_columns(self, values: List[bytes]) -> Dict[str, list]:
+        """
+        Decodes a batch of messages into one list per field.
+        """
+        if values and all(value[0] == MAGIC_BYTE and value[5] == 0 for value in values):
+            return self.codec.decode_columns(values, HEADER_SIZE)
+
+        # JSON records keep all their fields, even the ones the schema does not have, and
+        # the fields of the schema they do not have (written before we added them) are None
+        records = [self(value) for value in values]
+        names = dict.fromkeys(name for name, _ in self.codec.fields)
+        names.update(dict.fromkeys(records[0] if records else ()))
+        return {name: [record.get(name) for record in records] for name in names}
+
+
+def get_value_serializer(
+    encoding: str,
+    codec: ProtobufRecordCodec,
+    schema_registry_url: Optional[str] = None,
+    topic: Optional[str] = None,
+) -> Union[str, Serializer]:
+    """
+    Returns the quixstreams value serializer for the given encoding.
+
+    Args:
+        encoding (str): 'json' or 'protobuf'.
+        codec (ProtobufRecordCodec): The codec of the records, for 'protobuf'.
+        schema_registry_url (Optional[str]): The URL of the schema registry, for 'protobuf'.
+        topic (Optional[str]): The name of the topic, for 'protobuf'.
+
+    Returns:
+        Union[str, Serializer]: 'json' or a `SchemaRegistryProtobufSerializer`.
+    """
+    if encoding == 'json':
+        return 'json'
+    if encoding == 'protobuf':
+        if not schema_registry_url:
+            raise ValueError('The protobuf encoding needs the URL of the schema registry')
+        return SchemaRegistryProtobufSerializer(codec, schema_registry_url, topic)
+
+    raise ValueError(f'Invalid value encoding: {encoding}')
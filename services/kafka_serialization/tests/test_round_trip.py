@@ -0,0 +1,160 @@
+"""
+The trades and the candles going through the services the way they encode and decode
+them: trade_producer encodes the trades, trade_to_ohlc decodes them and encodes the
+candles, and topic_to_feature_store decodes the candles for the feature store.
+"""
+from typing import Dict, List
+
+import pytest
+from quixstreams.utils.json import dumps
+
+import kafka_serialization
+from kafka_serialization import (
+    CANDLE_CODEC,
+    CANDLE_NOTIONAL_FIELDS,
+    CANDLE_PRICE_FIELDS,
+    CANDLE_QUANTITY_FIELDS,
+    FIXED_POINT_CANDLE_CODEC,
+    FIXED_POINT_TRADE_CODEC,
+    TRADE_CODEC,
+    AutoDeserializer,
+    FixedPointDecimals,
+    ProtobufRecordCodec,
+    get_value_serializer,
+)
+
+SCHEMA_REGISTRY_URL = 'http://localhost:18081'
+TRADES = [
+    {'product_id': 'BTC/EUR', 'quantity': 0.125, 'price': 60_000.5, 'timestamp_ms': 1_000, 'side': 1, 'trade_id': 7},
+    {'product_id': 'BTC/EUR', 'quantity': 0.375, 'price': 60_001.5, 'timestamp_ms': 1_500, 'side': -1, 'trade_id': 8},
+    {'product_id': 'XRP/EUR', 'quantity': 250.0, 'price': 0.51234, 'timestamp_ms': 1_750, 'side': 0, 'trade_id': 0},
+]
+DECIMALS = FixedPointDecimals({'BTC/EUR': (1, 8), 'XRP/EUR': (5, 8)})
+
+
+class FakeSchemaRegistryClient:
+    """
+    Gives each subject a schema ID, like the schema registry of the Redpanda stack.
+    """
+    schema_ids: Dict[str, int] = {}
+
+    def __init__(self, conf: dict) -> None:
+        pass
+
+    def register_schema(self, subject: str, schema) -> int:
+        return self.schema_ids.setdefault(subject, len(self.schema_ids) + 1)
+
+
+@pytest.fixture(autouse=True)
+def schema_registry(monkeypatch):
+    monkeypatch.setattr(kafka_serialization, 'SchemaRegistryClient', FakeSchemaRegistryClient)
+
+
+def produce_trades(trades: List[dict], encoding: str, codec: ProtobufRecordCodec) -> List[bytes]:
+    """
+    trade_producer: one batch of columns at a time with Protobuf, one record at a time
+    with JSON.
+    """
+    value_serializer = get_value_serializer(encoding, codec, SCHEMA_REGISTRY_URL, 'trade')
+    if encoding == 'json':
+        return [dumps(trade) for trade in trades]
+    return value_serializer.serialize_columns({name: [trade[name] for trade in trades] for name, _ in codec.fields})
+
+
+def trades_to_candle(values: List[bytes], encoding: str, trade_codec: ProtobufRecordCodec, candle_codec: ProtobufRecordCodec) -> bytes:
+    """
+    trade_to_ohlc: decodes the trades one message at a time, and writes the candle of the
+    trades of the first product.
+    """
+    deserializer = AutoDeserializer(trade_codec)
+    trades = [deserializer(value) for value in values]
+    trades = [trade for trade in trades if trade['product_id'] == trades[0]['product_id']]
+
+    volume = sum(trade['quantity'] for trade in trades)
+    notional = sum(trade['price'] * trade['quantity'] for trade in trades)
+    candle = {
+        'product_id': trades[0]['product_id'],
+        'timestamp_ms': 2_000,
+        'open': trades[0]['price'],
+        'high': max(trade['price'] for trade in trades),
+        'low': min(trade['price'] for trade in trades),
+        'close': trades[-1]['price'],
+        'volume': volume,
+        'vwap': notional / volume,
+        'trade_count': len(trades),
+        'buy_volume': sum(trade['quantity'] for trade in trades if trade['side'] == 1),
+        'sell_volume': sum(trade['quantity'] for trade in trades if trade['side'] == -1),
+        'notional': notional,
+    }
+    value_serializer = get_value_serializer(encoding, candle_codec, SCHEMA_REGISTRY_URL, 'ohlcv')
+    return dumps(candle) if encoding == 'json' else value_serializer(candle)
+
+
+@pytest.mark.parametrize('trade_encoding', ['json', 'protobuf'])
+@pytest.mark.parametrize('candle_encoding', ['json', 'protobuf'])
+def test_the_trades_reach_the_feature_store_as_candles(trade_encoding, candle_encoding):
+    candle = trades_to_candle(
+        produce_trades(TRADES, trade_encoding, TRADE_CODEC), candle_encoding, TRADE_CODEC, CANDLE_CODEC
+    )
+
+    # topic_to_feature_store: one batch at a time
+    columns = AutoDeserializer(CANDLE_CODEC).deserialize_columns([candle])
+
+    assert columns == {
+        'product_id': ['BTC/EUR'],
+        'timestamp_ms': [2_000],
+        'open': [60_000.5],
+        'high': [60_001.5],
+        'low': [60_000.5],
+        'close': [60_001.5],
+        'volume': [0.5],
+        'vwap': [(60_000.5 * 0.125 + 60_001.5 * 0.375) / 0.5],
+        'trade_count': [2],
+        'buy_volume': [0.125],
+        'sell_volume': [0.375],
+        'notional': [60_000.5 * 0.125 + 60_001.5 * 0.375],
+    }
+
+
+def test_the_fixed_point_trades_reach_the_feature_store_as_float_candles():
+    # trade_producer converts the prices and the quantities once
+    trades = []
+    for trade in TRADES:
+        price_decimals, quantity_decimals = DECIMALS.get(trade['product_id'])
+        trades.append({
+            **trade,
+            'price': round(trade['price'] * 10 ** price_decimals),
+            'quantity': round(trade['quantity'] * 10 ** quantity_decimals),
+        })
+    candle = trades_to_candle(
+        produce_trades(trades, 'protobuf', FIXED_POINT_TRADE_CODEC), 'protobuf', FIXED_POINT_TRADE_CODEC, FIXED_POINT_CANDLE_CODEC
+    )
+
+    columns = DECIMALS.to_float_columns(
+        AutoDeserializer(FIXED_POINT_CANDLE_CODEC).deserialize_columns([candle]),
+        CANDLE_PRICE_FIELDS,
+        CANDLE_QUANTITY_FIELDS,
+        CANDLE_NOTIONAL_FIELDS,
+    )
+
+    assert columns['open'] == [60_000.5]
+    assert columns['close'] == [60_001.5]
+    assert columns['volume'] == [0.5]
+    assert columns['buy_volume'] == [0.125]
+    assert columns['sell_volume'] == [0.375]
+    assert columns['trade_count'] == [2]
+    assert columns['vwap'] == [pytest.approx(60_001.25)]
+    assert columns['notional'] == [pytest.approx(60_000.5 * 0.125 + 60_001.5 * 0.375)]
+
+
+def test_the_candles_written_before_the_new_fields_have_them_as_null():
+    candle = {
+        'product_id': 'BTC/EUR', 'timestamp_ms': 2_000,
+        'open': 1.0, 'high': 2.0, 'low': 0.5, 'close': 1.5, 'volume': 3.0,
+    }
+
+    columns = AutoDeserializer(CANDLE_CODEC).deserialize_columns([dumps(candle)])
+
+    assert columns['close'] == [1.5]
+    for name in ('vwap', 'trade_count', 'buy_volume', 'sell_volume', 'notional'):
+        assert columns[name] == [None]
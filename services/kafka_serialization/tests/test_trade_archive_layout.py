@@ -0,0 +1,40 @@
+"""
+The trade archive the way the trade producer writes it and the batch mode of
+trade_to_ohlc reads it.
+"""
+import numpy as np
+
+from trade_archive_layout import COLUMNS, DAY_MS, day_starts, get_day_dir, read_day
+
+# 2024-10-06, midnight UTC
+DAY = 20_002 * DAY_MS
+
+
+def test_one_directory_per_product_and_utc_day(tmp_path):
+    assert get_day_dir(str(tmp_path), 'BTC/EUR', DAY + DAY_MS - 1) == tmp_path / 'BTC-EUR' / '2024-10-06'
+    assert get_day_dir(str(tmp_path), 'BTC/EUR', DAY + DAY_MS) == tmp_path / 'BTC-EUR' / '2024-10-07'
+
+
+def test_the_days_of_a_range():
+    assert list(day_starts(DAY + 5, DAY + 2 * DAY_MS + 1)) == [DAY, DAY + DAY_MS, DAY + 2 * DAY_MS]
+    # the end is excluded
+    assert list(day_starts(DAY, DAY + DAY_MS)) == [DAY]
+
+
+def test_a_day_without_trades_is_none(tmp_path):
+    assert read_day(str(tmp_path), 'BTC/EUR', DAY) is None
+
+
+def test_the_days_archived_before_the_side_and_the_trade_id_read_them_as_zeros(tmp_path):
+    day_dir = get_day_dir(str(tmp_path), 'BTC/EUR', DAY)
+    day_dir.mkdir(parents=True)
+    for name in ('timestamp_ms', 'price', 'quantity'):
+        np.save(day_dir / f'{name}.npy', np.arange(3, dtype=COLUMNS[name]))
+
+    day = read_day(str(tmp_path), 'BTC/EUR', DAY)
+
+    assert set(day) == set(COLUMNS)
+    assert day['side'].tolist() == [0, 0, 0] and day['side'].dtype == np.int8
+    assert day['trade_id'].tolist() == [0, 0, 0]
+    # the files are memory-mapped
+    assert isinstance(day['price'], np.memmap)
@@ -0,0 +1,89 @@
+"""
+The layout of the trade archive on disk.
+
+The trade producer archives the historical trades it fetches from the Kraken REST API
+(see its src.trade_data_source.trade_archive), and the batch mode of trade_to_ohlc reads
+them back. The layout is
+
+    <archive_dir>/<product>/manifest.json
+    <archive_dir>/<product>/<YYYY-MM-DD>/<column>.npy
+
+with one file per column of COLUMNS for each UTC day, sorted by timestamp, so reading a
+time range is a handful of large sequential scans (and the files can be memory-mapped).
+The manifest holds the `[from_ms, to_ms)` ranges the producer has fully fetched.
+
+Both services install this package (a path dependency in their pyproject, with the
+`archive` extra for NumPy), so the writer and the reader always agree on the layout.
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+# one day in milliseconds
+DAY_MS = 24 * 60 * 60 * 1000
+
+# the columns we store for each trade (the product_id is in the directory name)
+COLUMNS = {
+    'timestamp_ms': np.int64,
+    'price': np.float64,
+    'quantity': np.float64,
+    'side': np.int8,
+    'trade_id': np.int64,
+}
+
+# the columns the days archived before we kept them do not have (read as zeros)
+LATER_COLUMNS = ('side', 'trade_id')
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def day_starts(from_ms: int, to_ms: int) -> range:
+    """
+    Returns the starts of the UTC days that overlap `[from_ms, to_ms)`.
+    """
+    return range(from_ms - from_ms % DAY_MS, to_ms, DAY_MS)
+
+
+def get_product_dir(archive_dir: str, product_id: str) -> Path:
+    """
+    Returns the directory of the given product ('BTC/EUR' -> 'BTC-EUR').
+    """
+    return Path(archive_dir) / product_id.replace('/', '-')
+
+
+def get_day_dir(archive_dir: str, product_id: str, day_from_ms: int) -> Path:
+    """
+    Returns the directory of the given UTC day of the given product.
+    """
+    day = datetime.fromtimestamp(day_from_ms / 1000, tz=timezone.utc)
+    return get_product_dir(archive_dir, product_id) / day.strftime('%Y-%m-%d')
+
+
+def read_day(archive_dir: str, product_id: str, day_from_ms: int) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Returns the columns of the given day, memory-mapped read-only, or None if the
+    archive has no trades for it.
+
+    Args:
+        archive_dir (str): The directory of the archive.
+        product_id (str): The product ID.
+        day_from_ms (int): The start of the UTC day in milliseconds.
+
+    Returns:
+        Optional[Dict[str, np.ndarray]]: Every column of COLUMNS, sorted by timestamp.
+    """
+    day_dir = get_day_dir(archive_dir, product_id, day_from_ms)
+    if not (day_dir / 'timestamp_ms.npy').exists():
+        return None
+
+    day = {
+        name: np.load(day_dir / f'{name}.npy', mmap_mode='r')
+        for name in COLUMNS
+        if (day_dir / f'{name}.npy').exists()
+    }
+    for name in LATER_COLUMNS:
+        if name not in day:
+            day[name] = np.zeros(len(day['timestamp_ms']), dtype=COLUMNS[name])
+    return day
@@ -2,9 +2,14 @@ from pydantic_settings import BaseSettings
 
 class AppConfig(BaseSettings):
     feature_view_name: str
-    feature_view_version: int
+    # The candles with vwap, trade_count, buy_volume, sell_volume and notional are in
+    # version 2 of the feature group (topic_to_feature_store writes there), and a feature
+    # view reads a single version of the group, so both moved to 2 with that schema.
+    # The candles trade_to_ohlc produced before it computed these fields (e.g. still in the
+    # topic when the feature store is reset) have them as null.
+    feature_view_version: int = 2
     feature_group_name: str
-    feature_group_version: int
+    feature_group_version: int = 2
     ohlc_window_sec: int
     product_id: str
     last_n_days: int
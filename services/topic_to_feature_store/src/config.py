@@ -1,16 +1,22 @@
 from pydantic_settings import BaseSettings
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 class AppConfig(BaseSettings):
     kafka_broker_address: str
     kafka_input_topic: str
     kafka_consumer_group: str
     feature_group_name: str
+    # Version 2 has the vwap, trade_count, buy_volume, sell_volume and notional of the
+    # candles (the price predictor reads the same version). The candles trade_to_ohlc
+    # produced before it computed these fields decode with them as null.
     feature_group_version: int
     feature_group_primary_keys: List[str]
     feature_group_event_time: str
     start_offline_materialization: bool
     batch_size: Optional[int] = 1 # Here we set the default value to 1
+    # The (price, quantity) decimals of each product, e.g. {"BTC/EUR": [1, 8]}, if the candles
+    # have fixed-point integer prices and volumes (floats if None)
+    fixed_point_decimals: Optional[Dict[str, Tuple[int, int]]] = None
 
     class Config:
         env_file = ".env"
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List, Union
 import hopsworks
 from src.config import hop_config
 import pandas as pd
@@ -14,7 +14,7 @@ feature_store = project.get_feature_store()
 
 # Push the message to the feature store
 def push_value_to_feature_group( 
-    value: List[dict],
+    value: Union[List[dict], Dict[str, list]],
     feature_group_name: str,
     feature_group_version: int,
     feature_group_primary_keys: List[str],
@@ -25,7 +25,7 @@ def push_value_to_feature_group(
     Pushes a value to a feature_group_name in the Feature store.
 
     Args:
-        value List(dict): The value to push to the feature group.
+        value (Union[List[dict], Dict[str, list]]): The value to push to the feature group, as records or as one list per column.
         feature_group_name (str): The name of the feature group.
         feature_group_version (int): The version of the feature group.
         feature_group_primary_keys (List[str]): The primary key of the feature group.
@@ -1,9 +1,17 @@
 from quixstreams import Application
 from loguru import logger
 from src.config import config
-import json
+from kafka_serialization import (
+    CANDLE_CODEC,
+    CANDLE_NOTIONAL_FIELDS,
+    CANDLE_PRICE_FIELDS,
+    CANDLE_QUANTITY_FIELDS,
+    FIXED_POINT_CANDLE_CODEC,
+    AutoDeserializer,
+    FixedPointDecimals,
+)
 from src.hopsworks_api import push_value_to_feature_group
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 def topic_to_feature_store (
     kafka_broker_address: str,
@@ -14,7 +22,8 @@ def topic_to_feature_store (
     feature_group_primary_keys: List[str],
     feature_group_event_time: str,
     start_offline_materialization: bool,
-    batch_size: int
+    batch_size: int,
+    fixed_point_decimals: Optional[Dict[str, Tuple[int, int]]] = None,
     # we will probably need some feature store credentials here
 ):
     """
@@ -30,6 +39,8 @@ def topic_to_feature_store (
         feature_group_event_time (str): The event time of the feature group.
         start_offline_materialization (bool): Whether to start offline materialization; if True, the data will be materialized immediately.
         batch_size (int): The number of messages to consume in a batch to accumlate in memory before writing to the feature store.
+        fixed_point_decimals (Optional[Dict[str, Tuple[int, int]]]): The (price, quantity) decimals of each product,
+            if the candles are fixed-point integers. They are turned back into floats for the feature store.
         # feature store credentials
 
     Returns:
@@ -44,6 +55,10 @@ def topic_to_feature_store (
 
     batch = []
 
+    # The candles can be JSON or Protobuf; we decode each batch at once, when it is full
+    decimals = FixedPointDecimals(fixed_point_decimals) if fixed_point_decimals else None
+    deserializer = AutoDeserializer(FIXED_POINT_CANDLE_CODEC if decimals is not None else CANDLE_CODEC)
+
     # Create a consumer and start consuming messages
     with app.get_consumer() as consumer: # Checks when last message was consumed and commits offsets
         consumer.subscribe(topics=[kafka_input_topic])
@@ -57,13 +72,8 @@ def topic_to_feature_store (
                 logger.error(f"Consumer error: {msg.error()}")
                 continue
         
-            value=msg.value()
-
-            # Decode the message (bytes) to a string
-            value = json.loads(value.decode("utf-8"))
-
-            # Append the message to the batch
-            batch.append(value)
+            # Append the message (still bytes) to the batch
+            batch.append(msg.value())
 
             # If the batch is not full, continue
             if len(batch) < batch_size:
@@ -72,8 +82,13 @@ def topic_to_feature_store (
 
             # If the batch is full, push the batch to the feature store
             logger.debug(f"Batch has size {len(batch)} >= {batch_size:,}. Pushing to feature store...")
+            columns = deserializer.deserialize_columns(batch)
+            if decimals is not None:
+                columns = decimals.to_float_columns(
+                    columns, CANDLE_PRICE_FIELDS, CANDLE_QUANTITY_FIELDS, CANDLE_NOTIONAL_FIELDS
+                )
             push_value_to_feature_group(
-                batch,
+                columns,
                 feature_group_name,
                 feature_group_version,
                 feature_group_primary_keys,
@@ -101,4 +116,5 @@ if __name__ == "__main__":
         feature_group_event_time = config.feature_group_event_time,
         start_offline_materialization = config.start_offline_materialization,
         batch_size=config.batch_size,
+        fixed_point_decimals=config.fixed_point_decimals,
     )
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Compares the websocket frame decoding we used to have (substring check for heartbeats,
+json.loads and datetime.fromisoformat for every trade) with `KrakenTradeDecoder`.
+
+By default the frames are generated in the Kraken v2 wire format, with the mix of
+heartbeats and small trade updates we see on a busy feed. Pass a file with one recorded
+frame per line to run it on real data instead. Run it from the service directory with
+
+    PYTHONPATH=$(pwd) poetry run python benchmarks/decode_benchmark.py [frames.txt]
+"""
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from src.trade_data_source.kraken_decoder import KrakenTradeDecoder
+from src.trade_data_source.trade_batch import TradeBatch
+
+N_FRAMES = 20_000
+SYMBOLS = ['BTC/USD', 'BTC/EUR', 'ETH/USD', 'SOL/USD', 'XRP/USD']
+
+
+def legacy_decode(frame: str) -> TradeBatch:
+    """
+    The decoding as it was before the decoder layer.
+    """
+    if 'heartbeat' in frame:
+        return TradeBatch.empty()
+
+    message = json.loads(frame)
+    if message.get('channel') != 'trade':
+        return TradeBatch.empty()
+
+    trades = message['data']
+    return TradeBatch.from_columns(
+        product_id=[trade['symbol'] for trade in trades],
+        price=[trade['price'] for trade in trades],
+        quantity=[trade['qty'] for trade in trades],
+        timestamp_ms=[
+            int(
+                datetime.fromisoformat(trade['timestamp'][:-1])
+                .replace(tzinfo=timezone.utc)
+                .timestamp()
+                * 1000
+            )
+            for trade in trades
+        ],
+    )
+
+
+def make_frames(n_frames: int) -> List[str]:
+    """
+    Returns frames in the Kraken v2 format: one heartbeat per second and bursts of trade
+    updates with 1 to 20 trades each.
+    """
+    rng = random.Random(0)
+    now = datetime(2024, 10, 1, tzinfo=timezone.utc)
+    frames = [
+        json.dumps({
+            'channel': 'status',
+            'type': 'update',
+            'data': [{'version': '2.0.8', 'system': 'online', 'api_version': 'v2', 'connection_id': 1}],
+        }, separators=(',', ':')),
+    ]
+    trade_id = 0
+    while len(frames) < n_frames:
+        if rng.random() < 0.1:
+            frames.append('{"channel":"heartbeat"}')
+            continue
+
+        trades = []
+        for _ in range(rng.randint(1, 20)):
+            now += timedelta(microseconds=rng.randint(1, 50_000))
+            trade_id += 1
+            trades.append({
+                'symbol': rng.choice(SYMBOLS),
+                'side': rng.choice(['buy', 'sell']),
+                'price': round(60_000 + rng.gauss(0, 100), 1),
+                'qty': round(rng.expovariate(20), 8),
+                'ord_type': rng.choice(['market', 'limit']),
+                'trade_id': trade_id,
+                'timestamp': now.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            })
+        frames.append(json.dumps(
+            {'channel': 'trade', 'type': 'update', 'data': trades},
+            separators=(',', ':'),
+        ))
+    return frames
+
+
+def benchmark(name: str, decode, frames: List[str]) -> float:
+    """
+    Decodes all the frames and prints the frames/sec and trades/sec.
+    """
+    start = time.perf_counter()
+    n_trades = sum(len(decode(frame)) for frame in frames)
+    elapsed = time.perf_counter() - start
+
+    print(f'{name:<16} {len(frames) / elapsed:>10,.0f} frames/sec {n_trades / elapsed:>12,.0f} trades/sec')
+    return elapsed
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            frames = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        frames = make_frames(N_FRAMES)
+
+    # both decoders must agree before we compare their speed (on the fields the legacy
+    # one had, it did not keep the side and the ID of the trades)
+    legacy_fields = ('product_id', 'quantity', 'price', 'timestamp_ms')
+    for frame in frames:
+        assert [
+            {name: trade[name] for name in legacy_fields} for trade in KrakenTradeDecoder().decode(frame).to_dicts()
+        ] == [{name: trade[name] for name in legacy_fields} for trade in legacy_decode(frame).to_dicts()]
+
+    before = benchmark('before', legacy_decode, frames)
+    after_json = benchmark('after (json)', KrakenTradeDecoder(json_backend='json').decode, frames)
+    after = benchmark('after (auto)', KrakenTradeDecoder().decode, frames)
+
+    print(f'speedup          {before / after_json:>10.1f}x with json, {before / after:.1f}x with the fastest backend')
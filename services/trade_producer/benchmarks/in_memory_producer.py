@@ -0,0 +1,32 @@
+"""
+An in-memory stand-in for the quixstreams Producer, so the produce path can be
+benchmarked without a Kafka broker.
+"""
+from typing import List, Optional, Tuple
+
+
+class InMemoryProducer:
+    """
+    Stands in for the quixstreams Producer. Every message is delivered as soon as it is
+    produced, so `flush` always returns 0 (nothing left in the queue).
+
+    With `keep_messages=False` it only counts the messages and their bytes, so that the
+    memory it holds does not hide the allocations of the code under test.
+    """
+
+    def __init__(self, keep_messages: bool = True) -> None:
+        self.keep_messages = keep_messages
+        self.messages: List[Tuple[str, Optional[bytes], bytes]] = []
+        self.n_messages = 0
+        self.n_bytes = 0
+        self.n_flushes = 0
+
+    def produce(self, topic: str, value: bytes, key: Optional[bytes] = None) -> None:
+        self.n_messages += 1
+        self.n_bytes += len(value)
+        if self.keep_messages:
+            self.messages.append((topic, key, value))
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        self.n_flushes += 1
+        return 0
@@ -0,0 +1,80 @@
+"""
+Compares the messages/sec of the per-trade produce loop we used to have with the
+batched `produce_batch` path, against an in-memory stand-in for the Kafka producer.
+
+Run it from the service directory with
+
+    PYTHONPATH=$(pwd) poetry run python benchmarks/produce_benchmark.py
+"""
+import sys
+import time
+from typing import List
+
+import numpy as np
+from loguru import logger
+from quixstreams.models import Topic
+
+from benchmarks.in_memory_producer import InMemoryProducer
+from src.main import produce_batch
+from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
+
+N_BATCHES = 200
+BATCH_SIZE = 1_000
+
+
+def legacy_produce(producer: InMemoryProducer, topic: Topic, trades: List[Trade]) -> None:
+    """
+    The produce loop as it was before batching: one serialize, one produce and one
+    formatted log line per trade.
+    """
+    for trade in trades:
+        message = topic.serialize(key=trade.product_id, value=trade.model_dump())
+        producer.produce(topic=topic.name, value=message.value, key=message.key)
+        logger.debug(f"Pushed trade to Kafka: {trade}")
+
+
+def make_batch() -> TradeBatch:
+    """
+    Returns a batch of random BTC/EUR trades.
+    """
+    rng = np.random.default_rng(0)
+    return TradeBatch.for_product(
+        product_id='BTC/EUR',
+        price=60_000 + rng.normal(0, 50, BATCH_SIZE).cumsum(),
+        quantity=rng.exponential(0.05, BATCH_SIZE),
+        timestamp_ms=1_700_000_000_000 + np.arange(BATCH_SIZE) * 10,
+    )
+
+
+def benchmark(name: str, produce) -> float:
+    """
+    Runs `produce` N_BATCHES times and prints the messages/sec.
+    """
+    start = time.perf_counter()
+    for _ in range(N_BATCHES):
+        produce()
+    elapsed = time.perf_counter() - start
+
+    messages_per_sec = N_BATCHES * BATCH_SIZE / elapsed
+    print(f'{name:<10} {messages_per_sec:>12,.0f} messages/sec')
+    return messages_per_sec
+
+
+if __name__ == '__main__':
+    # like in production, debug logs are off
+    logger.remove()
+    logger.add(sys.stderr, level='INFO')
+
+    topic = Topic(name='trade', value_serializer='json')
+    batch = make_batch()
+
+    producer = InMemoryProducer()
+    before = benchmark(
+        'before', lambda: legacy_produce(producer, topic, batch.to_trades())
+    )
+
+    producer = InMemoryProducer()
+    after = benchmark('after', lambda: produce_batch(producer, topic, batch))
+
+    print(f'speedup    {after / before:>12.1f}x')
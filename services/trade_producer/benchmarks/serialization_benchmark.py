@@ -0,0 +1,138 @@
+"""
+Compares the JSON values we used to write to the `trade` and `ohlcv` topics with the
+schema-registered Protobuf values: bytes per message (raw, and zlib-compressed per
+batch as a stand-in for the producer compression), and encode and decode rates, one
+message at a time (the quixstreams path) and one batch at a time (the producer and the
+feature store path).
+
+Run it from the service directory with
+
+    PYTHONPATH=$(pwd) poetry run python benchmarks/serialization_benchmark.py
+"""
+import time
+import zlib
+from typing import Callable, Dict, List
+
+import numpy as np
+from quixstreams.utils.json import dumps, loads
+
+from kafka_serialization import (
+    CANDLE_CODEC,
+    TRADE_CODEC,
+    AutoDeserializer,
+    ProtobufRecordCodec,
+    SchemaRegistryProtobufSerializer,
+)
+
+N_MESSAGES = 100_000
+# the batch the producer compresses at once (batch.num.messages)
+COMPRESSION_BATCH = 10_000
+
+
+def make_trades(n: int) -> List[Dict]:
+    """
+    Returns `n` random BTC/EUR trades.
+    """
+    rng = np.random.default_rng(0)
+    price = 60_000 + rng.normal(0, 5, n).cumsum()
+    quantity = rng.lognormal(-4, 1.5, n)
+    timestamp_ms = 1_700_000_000_000 + np.sort(rng.integers(0, n * 100, n))
+    side = rng.choice([1, -1], n)
+    return [
+        {'product_id': 'BTC/EUR', 'quantity': q, 'price': p, 'timestamp_ms': t, 'side': s, 'trade_id': 80_000_000 + i}
+        for i, (q, p, t, s) in enumerate(zip(quantity.tolist(), price.tolist(), timestamp_ms.tolist(), side.tolist()))
+    ]
+
+
+def make_candles(n: int) -> List[Dict]:
+    """
+    Returns `n` random BTC/EUR one-minute candles.
+    """
+    rng = np.random.default_rng(0)
+    close = 60_000 + rng.normal(0, 50, n).cumsum()
+    return [
+        {
+            'product_id': 'BTC/EUR',
+            'timestamp_ms': 1_700_000_000_000 + i * 60_000,
+            'open': c - 10.0,
+            'high': c + 25.0,
+            'low': c - 30.0,
+            'close': c,
+            'volume': v,
+            'vwap': c - 2.5,
+            'trade_count': k,
+            'buy_volume': v * 0.6,
+            'sell_volume': v * 0.4,
+            'notional': (c - 2.5) * v,
+        }
+        for i, (c, v, k) in enumerate(
+            zip(close.tolist(), rng.lognormal(0, 1, n).tolist(), rng.integers(1, 500, n).tolist())
+        )
+    ]
+
+
+def rate(func: Callable[[], object], n_messages: int) -> float:
+    """
+    Returns the messages/sec of `func`, which processes `n_messages` messages.
+    """
+    start = time.perf_counter()
+    func()
+    return n_messages / (time.perf_counter() - start)
+
+
+def compressed_bytes_per_message(messages: List[bytes]) -> float:
+    """
+    Returns the bytes per message after compressing them in producer-sized batches.
+    """
+    total = 0
+    for i in range(0, len(messages), COMPRESSION_BATCH):
+        total += len(zlib.compress(b''.join(messages[i:i + COMPRESSION_BATCH]), 1))
+    return total / len(messages)
+
+
+def compare(name: str, codec: ProtobufRecordCodec, records: List[Dict]) -> None:
+    """
+    Prints the size and the encode and decode rates of JSON and Protobuf for `records`.
+    """
+    serializer = SchemaRegistryProtobufSerializer(codec, 'http://unused', name)
+    # a made-up schema ID, so we do not need a schema registry
+    serializer._header = b'\x00\x00\x00\x00\x01\x00'
+    deserializer = AutoDeserializer(codec)
+    columns = {field: [record[field] for record in records] for field, _ in codec.fields}
+    n = len(records)
+
+    json_messages = [dumps(record) for record in records]
+    protobuf_messages = serializer.serialize_columns(columns)
+    assert deserializer.deserialize_columns(protobuf_messages) == columns
+
+    results = {
+        'json': {
+            'bytes': sum(map(len, json_messages)) / n,
+            'compressed': compressed_bytes_per_message(json_messages),
+            'encode': rate(lambda: [dumps(record) for record in records], n),
+            'encode batch': rate(lambda: [dumps(record) for record in records], n),
+            'decode': rate(lambda: [loads(message) for message in json_messages], n),
+            'decode batch': rate(lambda: deserializer.deserialize_columns(json_messages), n),
+        },
+        'protobuf': {
+            'bytes': sum(map(len, protobuf_messages)) / n,
+            'compressed': compressed_bytes_per_message(protobuf_messages),
+            'encode': rate(lambda: [serializer(record) for record in records], n),
+            'encode batch': rate(lambda: serializer.serialize_columns(columns), n),
+            'decode': rate(lambda: [deserializer(message) for message in protobuf_messages], n),
+            'decode batch': rate(lambda: deserializer.deserialize_columns(protobuf_messages), n),
+        },
+    }
+
+    print(f'\n{name} ({n:,} messages, rates in messages/sec)')
+    print(f"{'':<10} {'bytes':>7} {'zlib':>7} {'encode':>11} {'enc batch':>11} {'decode':>11} {'dec batch':>11}")
+    for encoding, r in results.items():
+        print(
+            f"{encoding:<10} {r['bytes']:>7.1f} {r['compressed']:>7.1f} {r['encode']:>11,.0f} "
+            f"{r['encode batch']:>11,.0f} {r['decode']:>11,.0f} {r['decode batch']:>11,.0f}"
+        )
+
+
+if __name__ == '__main__':
+    compare('trade', TRADE_CODEC, make_trades(N_MESSAGES))
+    compare('ohlcv', CANDLE_CODEC, make_candles(N_MESSAGES))
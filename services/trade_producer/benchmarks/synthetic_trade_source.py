@@ -0,0 +1,116 @@
+"""
+A TradeSource that generates realistic, bursty streams of synthetic trades, so the
+producer can be benchmarked without the Kraken API.
+"""
+from typing import List, Union
+
+import numpy as np
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class SyntheticTradeSource(TradeSource):
+    """
+    Generates `n_batches` batches of synthetic trades, one per `poll_interval_ms` of
+    market time, like the websocket source returns whatever arrived since the last poll.
+
+    The market switches between a quiet and a bursty regime (a two-state Markov chain),
+    so most polls return a handful of trades and a few return hundreds, the way real
+    order flow clusters around news and liquidations. Within a poll the number of trades
+    is Poisson, prices follow a geometric random walk per product and quantities are
+    log-normal, with a heavy right tail.
+
+    All the batches are generated up front with a fixed seed, so the benchmark measures
+    the produce path and not the generator, and two runs see the same data.
+    """
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        n_batches: int,
+        quiet_trades_per_poll: float = 5.0,
+        burst_trades_per_poll: float = 500.0,
+        p_enter_burst: float = 0.02,
+        p_leave_burst: float = 0.2,
+        poll_interval_ms: int = 100,
+        as_trades: bool = False,
+        seed: int = 0,
+    ) -> None:
+        """
+        Args:
+            product_ids (List[str]): The products to generate trades for.
+            n_batches (int): The number of batches to return before we are done.
+            quiet_trades_per_poll (float): The mean number of trades per poll in the quiet regime.
+            burst_trades_per_poll (float): The mean number of trades per poll in a burst.
+            p_enter_burst (float): The probability of going from quiet to bursty at each poll.
+            p_leave_burst (float): The probability of going from bursty to quiet at each poll.
+            poll_interval_ms (int): The market time between two polls.
+            as_trades (bool): Return lists of pydantic `Trade` objects instead of
+                `TradeBatch`es, like the sources we had before batching.
+            seed (int): The seed of the random generator.
+        """
+        self.product_ids = product_ids
+        rng = np.random.default_rng(seed)
+
+        # the regime of each poll, from the two-state Markov chain
+        bursty = np.zeros(n_batches, dtype=bool)
+        switch = rng.random(n_batches)
+        for i in range(1, n_batches):
+            bursty[i] = switch[i] >= p_leave_burst if bursty[i - 1] else switch[i] < p_enter_burst
+
+        trades_per_poll = np.where(bursty, burst_trades_per_poll, quiet_trades_per_poll)
+        n_trades = rng.poisson(trades_per_poll)
+
+        # each product gets a share of the flow, the first one being the most traded
+        product_weights = 1 / np.arange(1, len(product_ids) + 1)
+        product_weights /= product_weights.sum()
+        prices = {product_id: 60_000.0 / (i + 1) for i, product_id in enumerate(product_ids)}
+
+        self._batches: List[Union[TradeBatch, List[Trade]]] = []
+        start_ms = 1_700_000_000_000
+        for i, n in enumerate(n_trades):
+            poll_from_ms = start_ms + i * poll_interval_ms
+            product_index = rng.choice(len(product_ids), size=n, p=product_weights)
+            timestamp_ms = np.sort(rng.integers(poll_from_ms, poll_from_ms + poll_interval_ms, n))
+            quantity = rng.lognormal(mean=-4, sigma=1.5, size=n)
+
+            # a geometric random walk per product, more volatile during bursts
+            volatility = 5e-4 if bursty[i] else 1e-4
+            price = np.empty(n)
+            for j, product_id in enumerate(product_ids):
+                in_product = product_index == j
+                steps = rng.normal(0, volatility, int(in_product.sum()))
+                walk = prices[product_id] * np.exp(np.cumsum(steps))
+                price[in_product] = walk
+                if len(walk):
+                    prices[product_id] = walk[-1]
+
+            batch = TradeBatch.from_columns(
+                product_id=[product_ids[j] for j in product_index],
+                price=price,
+                quantity=quantity,
+                timestamp_ms=timestamp_ms,
+            )
+            self._batches.append(batch.to_trades() if as_trades else batch)
+
+        self.n_trades = int(n_trades.sum())
+        self._position = 0
+
+    def get_trades(self) -> Union[TradeBatch, List[Trade]]:
+        """
+        Returns the next pre-generated batch of trades.
+        """
+        batch = self._batches[self._position]
+        self._position += 1
+        return batch
+
+    def is_done(self) -> bool:
+        return self._position >= len(self._batches)
+
+    def rewind(self) -> None:
+        """
+        Starts again from the first batch.
+        """
+        self._position = 0
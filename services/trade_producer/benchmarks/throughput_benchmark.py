@@ -0,0 +1,324 @@
+"""
+Measures how many trades/sec the produce loop (`produce_from_source`) can sustain, with
+synthetic bursty trade streams and an in-memory stand-in for the Kafka producer.
+
+For each scenario it reports
+- the trades/sec over the whole run (the fastest of N_REPEATS runs),
+- the p50 and p99 latency of one batch, from `get_trades()` returning to the batch
+  being flushed and committed,
+- the peak bytes allocated per trade while a batch is produced (with tracemalloc, in a
+  separate run because tracing slows everything down).
+
+Absolute trades/sec depend on the machine (and on whatever else a CI runner is doing),
+so the gate never compares them across runs. Right before each timed run we time a
+calibration loop that encodes a fixed trade, and the scenario is measured relative to
+it: the throughput as a multiple of the calibration rate (the median over the runs),
+and the p99 latency as a number of calibration loops. Only these ratios are stored in `benchmarks/baseline.json`,
+and the run fails if a scenario got slower than the tolerance relative to them.
+
+Some scenarios are also compared with another scenario of the same run (see
+`SAME_RUN_BASELINES`): the async produce loop must keep up with the synchronous one,
+and the batches with the pydantic trades they replaced.
+
+The `_stream` scenarios run the async produce loop (`produce_from_stream`) that
+`produce_trades` uses with a queue of batches, the others its synchronous wrapper with
+one batch at a time. Run it from the service directory with
+
+    PYTHONPATH=$(pwd) poetry run python benchmarks/throughput_benchmark.py
+
+and add `--save-baseline` to store the results as the new baseline.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+import numpy as np
+from loguru import logger
+from quixstreams.models import Topic
+from quixstreams.utils.json import dumps
+
+from benchmarks.in_memory_producer import InMemoryProducer
+from benchmarks.synthetic_trade_source import SyntheticTradeSource
+from src.main import produce_from_source, produce_from_stream
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
+
+BASELINE_PATH = Path(__file__).parent / 'baseline.json'
+
+# a scenario regresses when its relative throughput drops by more than TOLERANCE, or its
+# relative p99 latency grows by more than LATENCY_TOLERANCE (the tail is noisier than the mean)
+TOLERANCE = 0.2
+LATENCY_TOLERANCE = 0.5
+
+# the number of timed runs of each scenario
+N_REPEATS = 5
+
+# the calibration loop encodes this trade CALIBRATION_LOOPS times
+CALIBRATION_TRADE = {
+    'product_id': 'BTC/EUR',
+    'quantity': 0.125,
+    'price': 60_000.5,
+    'timestamp_ms': 1_700_000_000_000,
+    'side': 1,
+    'trade_id': 7,
+}
+CALIBRATION_LOOPS = 200_000
+
+# the metrics of a scenario that do not depend on the speed of the machine, which are the
+# ones we store in the baseline
+BASELINE_METRICS = (
+    'relative_throughput',
+    'relative_p99_batch_latency',
+    'bytes_per_message',
+    'peak_bytes_allocated_per_trade',
+)
+
+# the scenarios we measure, as the arguments of SyntheticTradeSource
+SCENARIOS: Dict[str, Dict] = {
+    # the websocket source in a single product market
+    'live_single_product': dict(product_ids=['BTC/EUR'], n_batches=5_000),
+    # the websocket source with several products in the same batches
+    'live_multi_product': dict(
+        product_ids=['BTC/EUR', 'ETH/EUR', 'SOL/EUR', 'XRP/EUR'], n_batches=5_000
+    ),
+    # the historical source, which returns large batches at once
+    'historical': dict(
+        product_ids=['BTC/EUR'],
+        n_batches=20,
+        quiet_trades_per_poll=20_000,
+        burst_trades_per_poll=50_000,
+        p_enter_burst=0.3,
+    ),
+    # lists of pydantic trades, the way the sources returned them before batching
+    'live_pydantic_trades': dict(product_ids=['BTC/EUR'], n_batches=5_000, as_trades=True),
+    # the same as live_single_product and historical, through the async produce loop
+    'live_single_product_stream': dict(product_ids=['BTC/EUR'], n_batches=5_000, stream=True),
+    'historical_stream': dict(
+        product_ids=['BTC/EUR'],
+        n_batches=20,
+        quiet_trades_per_poll=20_000,
+        burst_trades_per_poll=50_000,
+        p_enter_burst=0.3,
+        stream=True,
+    ),
+}
+
+# scenario -> the scenario of the same run it must not be slower than (by more than
+# TOLERANCE), whatever the machine
+SAME_RUN_BASELINES: Dict[str, str] = {
+    # the batches must keep up with the pydantic trades they replaced
+    'live_single_product': 'live_pydantic_trades',
+    # and the async produce loop with the synchronous one
+    'live_single_product_stream': 'live_single_product',
+    'historical_stream': 'historical',
+}
+
+
+class InstrumentedTradeSource(TradeSource):
+    """
+    Wraps a TradeSource and measures each batch, from `get_trades()` returning to the
+    produce loop calling `commit()` once the batch is flushed.
+    """
+
+    def __init__(self, source: TradeSource, trace_memory: bool = False) -> None:
+        """
+        Args:
+            source (TradeSource): The source to measure.
+            trace_memory (bool): Whether to measure the peak memory allocated per batch
+                (tracemalloc must be running).
+        """
+        self.source = source
+        self.trace_memory = trace_memory
+        self.latencies_sec: List[float] = []
+        self.peak_bytes_per_trade: List[float] = []
+
+        self._n_trades = 0
+        self._started_at = 0.0
+        self._memory_at_start = 0
+
+    def get_trades(self) -> Union[List[Trade], TradeBatch]:
+        trades = self.source.get_trades()
+        self._n_trades = len(trades)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self._memory_at_start = tracemalloc.get_traced_memory()[0]
+        self._started_at = time.perf_counter()
+        return trades
+
+    def is_done(self) -> bool:
+        return self.source.is_done()
+
+    def position(self) -> Any:
+        return self.source.position()
+
+    def commit(self, position: Any) -> None:
+        self.latencies_sec.append(time.perf_counter() - self._started_at)
+        if self.trace_memory and self._n_trades > 0:
+            peak = tracemalloc.get_traced_memory()[1]
+            self.peak_bytes_per_trade.append((peak - self._memory_at_start) / self._n_trades)
+        self.source.commit(position)
+
+
+def calibrate() -> float:
+    """
+    Returns how many times per second this machine runs the calibration loop, the unit
+    the scenarios are measured in.
+    """
+    start = time.perf_counter()
+    for _ in range(CALIBRATION_LOOPS):
+        dumps({**CALIBRATION_TRADE})
+    return CALIBRATION_LOOPS / (time.perf_counter() - start)
+
+
+def run_scenario(topic: Topic, stream: bool = False, **source_kwargs) -> Dict[str, float]:
+    """
+    Runs one scenario: N_REPEATS timed runs, each after a calibration run, and then a
+    run under tracemalloc.
+
+    Args:
+        topic (Topic): The topic the messages go to.
+        stream (bool): Whether to run the async produce loop instead of the synchronous one.
+    Returns:
+        Dict[str, float]: The metrics of the scenario.
+    """
+    trade_source = SyntheticTradeSource(**source_kwargs)
+
+    def produce(producer: InMemoryProducer, source: TradeSource) -> int:
+        if stream:
+            return asyncio.run(produce_from_stream(producer, topic, source))
+        return produce_from_source(producer, topic, source)
+
+    # warm up the caches (e.g. the serialized keys) with a first pass
+    produce(InMemoryProducer(keep_messages=False), trade_source)
+
+    # each timed run right after a calibration run, so both see the same load on the
+    # machine, and we keep the median of their ratios
+    relative_throughputs, calibrations_per_sec = [], []
+    best_elapsed = float('inf')
+    for _ in range(N_REPEATS):
+        calibrations_per_sec.append(calibrate())
+        trade_source.rewind()
+        source = InstrumentedTradeSource(trade_source)
+        producer = InMemoryProducer(keep_messages=False)
+        start = time.perf_counter()
+        n_trades = produce(producer, source)
+        elapsed = time.perf_counter() - start
+        relative_throughputs.append(n_trades / elapsed / calibrations_per_sec[-1])
+        if elapsed < best_elapsed:
+            best_elapsed, best_source, best_producer = elapsed, source, producer
+
+    # the allocations run
+    trade_source.rewind()
+    traced_source = InstrumentedTradeSource(trade_source, trace_memory=True)
+    tracemalloc.start()
+    try:
+        produce(InMemoryProducer(keep_messages=False), traced_source)
+    finally:
+        tracemalloc.stop()
+
+    latencies_ms = np.array(best_source.latencies_sec) * 1000
+    trades_per_sec = n_trades / best_elapsed
+    p99_batch_latency_ms = float(np.percentile(latencies_ms, 99))
+    return {
+        'n_trades': n_trades,
+        'n_batches': len(latencies_ms),
+        'trades_per_sec': trades_per_sec,
+        'bytes_per_message': best_producer.n_bytes / max(best_producer.n_messages, 1),
+        'p50_batch_latency_ms': float(np.percentile(latencies_ms, 50)),
+        'p99_batch_latency_ms': p99_batch_latency_ms,
+        'peak_bytes_allocated_per_trade': float(np.mean(traced_source.peak_bytes_per_trade)),
+        # trades per calibration loop, and the p99 latency in calibration loops
+        'relative_throughput': float(np.median(relative_throughputs)),
+        'relative_p99_batch_latency': p99_batch_latency_ms / 1000 * float(np.median(calibrations_per_sec)),
+    }
+
+
+def find_regressions(results: Dict[str, Dict], baseline: Dict[str, Dict]) -> List[str]:
+    """
+    Returns a description of each scenario that is slower than its baseline, or than the
+    scenario of the same run it is compared with.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        reference = SAME_RUN_BASELINES.get(name)
+        if reference in results:
+            ratio = metrics['relative_throughput'] / results[reference]['relative_throughput']
+            if ratio < 1 - TOLERANCE:
+                regressions.append(f'{name}: {ratio:.0%} of the throughput of {reference} in the same run')
+
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if metrics['relative_throughput'] < before['relative_throughput'] * (1 - TOLERANCE):
+            regressions.append(
+                f"{name}: {metrics['relative_throughput']:.2f} trades per calibration loop, "
+                f"the baseline is {before['relative_throughput']:.2f}"
+            )
+        if metrics['relative_p99_batch_latency'] > before['relative_p99_batch_latency'] * (1 + LATENCY_TOLERANCE):
+            regressions.append(
+                f"{name}: p99 batch latency of {metrics['relative_p99_batch_latency']:,.0f} calibration loops, "
+                f"the baseline is {before['relative_p99_batch_latency']:,.0f}"
+            )
+    return regressions
+
+
+def print_results(results: Dict[str, Dict], baseline: Dict[str, Dict]) -> None:
+    """
+    Prints one row per scenario, with the change in relative throughput against the
+    baseline. The absolute numbers are only there to read, they are never compared.
+    """
+    print(
+        f"{'scenario':<28} {'trades':>9} {'trades/sec':>12} {'relative':>9} {'vs base':>8} "
+        f"{'p50 ms':>8} {'p99 ms':>8} {'B/trade':>8}"
+    )
+    for name, metrics in results.items():
+        if name in baseline:
+            change = f"{metrics['relative_throughput'] / baseline[name]['relative_throughput'] - 1:+.0%}"
+        else:
+            change = 'new'
+        print(
+            f"{name:<28} {metrics['n_trades']:>9,} {metrics['trades_per_sec']:>12,.0f} "
+            f"{metrics['relative_throughput']:>9.2f} {change:>8} "
+            f"{metrics['p50_batch_latency_ms']:>8.3f} {metrics['p99_batch_latency_ms']:>8.3f} "
+            f"{metrics['peak_bytes_allocated_per_trade']:>8.0f}"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        '--save-baseline', action='store_true', help='store the results as the new baseline'
+    )
+    parser.add_argument(
+        '--scenario', action='append', choices=list(SCENARIOS), help='only run these scenarios'
+    )
+    args = parser.parse_args()
+
+    # like in production, debug logs are off
+    logger.remove()
+    logger.add(sys.stderr, level='INFO')
+
+    topic = Topic(name='trade', value_serializer='json')
+    results = {
+        name: run_scenario(topic, **SCENARIOS[name]) for name in (args.scenario or SCENARIOS)
+    }
+
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        saved = {name: {metric: metrics[metric] for metric in BASELINE_METRICS} for name, metrics in results.items()}
+        BASELINE_PATH.write_text(json.dumps({**baseline, **saved}, indent=2) + '\n')
+        print(f'Saved the baseline to {BASELINE_PATH}')
+        sys.exit(0)
+
+    regressions = find_regressions(results, baseline)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    sys.exit(1 if regressions else 0)
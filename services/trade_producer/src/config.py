@@ -1,12 +1,59 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 class AppConfig(BaseSettings):
     kafka_broker_address: str
     kafka_topic: str
-    product_id: str
+    # Producer batching and compression, left to the librdkafka defaults if None
+    kafka_linger_ms: Optional[int] = None
+    kafka_batch_size: Optional[int] = None
+    kafka_compression_type: Optional[str] = None
+    # The number of trade batches the source can read ahead of the producer before it has to wait
+    kafka_max_queued_batches: int = 8
+    # 'json', or 'protobuf' for compact schema-registered messages (needs schema_registry_url)
+    kafka_value_encoding: str = 'json'
+    schema_registry_url: Optional[str] = None
+    # How far back in trade time we drop duplicate trades before producing them (off if None)
+    dedup_window_seconds: Optional[int] = None
+    # The memory ceiling of the deduplication, in trades
+    dedup_max_trades: int = 1_000_000
+    # The (price, quantity) decimals of each product, e.g. {"BTC/EUR": [1, 8]}, to produce the
+    # prices and quantities as fixed-point integers in those units (floats if None)
+    fixed_point_decimals: Optional[Dict[str, Tuple[int, int]]] = None
+    product_ids: List[str]
+    # 'live', 'historical', 'replay' to replay the trade archive, or 'book' for order book snapshots
     live_or_historical: Optional[str] = None
     last_n_days: Optional[int] = None
+    # The number of websocket connections the product_ids are sharded over (live only)
+    websocket_n_sockets: int = 1
+    # The JSON backend of the websocket frame decoder: 'auto', 'orjson' or 'json' (live only)
+    websocket_json_backend: str = 'auto'
+    # The number of raw frames we hold before we stop reading from the websockets (live only)
+    websocket_max_queued_frames: int = 10_000
+    # The number of day shards fetched concurrently from the Kraken REST API (historical only)
+    backfill_n_workers: int = 1
+    # The rate budget shared by all the backfill workers
+    backfill_requests_per_second: float = 1.0
+    # The number of requests the backfill can burst before the rate budget kicks in
+    backfill_rate_limit_burst: float = 1.0
+    # How many pages each backfill worker requests ahead of the page it is parsing
+    backfill_prefetch_pages: int = 2
+    # The directory of the day-partitioned trade archive (historical only, no archive if None)
+    trade_archive_dir: Optional[str] = None
+    # The directory where the backfill checkpoints how far it got (historical only, no checkpoints if None)
+    backfill_checkpoint_dir: Optional[str] = None
+    # Whether to resume the backfill from the last trade we find in the Kafka topic
+    backfill_reconcile_with_kafka: bool = False
+    # The replay speed: empty for maximum speed, 1.0 for real time, N for N times real time (replay only)
+    replay_speed: Optional[float] = None
+    # The maximum number of trades per batch (replay only)
+    replay_batch_size: int = 1_000
+    # The number of order book levels per side we subscribe to: 10, 25, 100, 500 or 1000 (book only)
+    book_depth: int = 10
+    # The number of levels per side in each order book snapshot (book only)
+    book_snapshot_levels: int = 10
+    # How often we produce a snapshot of each order book (book only)
+    book_snapshot_interval_ms: int = 1000
 
     # This is the first time Paulo has used this construct to load the environment variables
     # He usually uses the model_config to load the environment variables
@@ -14,4 +61,4 @@ class AppConfig(BaseSettings):
     class Config:
         env_file = '.env'
 
-config = AppConfig()
\ No newline at end of file
+config = AppConfig()
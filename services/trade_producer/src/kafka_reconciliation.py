@@ -0,0 +1,84 @@
+from typing import Dict, Optional
+
+from confluent_kafka import TopicPartition
+from kafka_serialization import TRADE_CODEC, AutoDeserializer
+from loguru import logger
+from quixstreams.kafka import Consumer
+
+
+def get_last_produced_timestamp_ms(
+    kafka_broker_address: str,
+    kafka_topic: str,
+    product_id: str,
+    tail_messages: int = 1_000,
+    timeout_sec: float = 10.0,
+) -> Optional[int]:
+    """
+    Returns the largest `timestamp_ms` of the trades of `product_id` at the end of the
+    Kafka topic, or None if there are none.
+
+    Several products can share a partition, so we read the last `tail_messages`
+    messages of every partition instead of only the last one.
+
+    Args:
+        kafka_broker_address (str): The address of the Kafka broker.
+        kafka_topic (str): The name of the Kafka topic with the trades.
+        product_id (str): The product ID we are looking for (the message key).
+        tail_messages (int): How many messages we read at the end of each partition.
+        timeout_sec (float): How long we wait for the broker.
+
+    Returns:
+        Optional[int]: The timestamp in milliseconds of the last trade we produced.
+    """
+    consumer = Consumer(
+        broker_address=kafka_broker_address,
+        consumer_group=f'{kafka_topic}_reconciliation',
+        auto_offset_reset='earliest',
+        auto_commit_enable=False,
+    )
+
+    last_trade_ms = None
+    with consumer:
+        topic_metadata = consumer.list_topics(topic=kafka_topic, timeout=timeout_sec).topics.get(kafka_topic)
+        if topic_metadata is None or topic_metadata.error is not None:
+            logger.info(f'Topic {kafka_topic} does not exist yet, nothing to reconcile')
+            return None
+
+        # the offset of the last message of each partition that has messages
+        last_offsets: Dict[int, int] = {}
+        partitions = []
+        for partition in topic_metadata.partitions:
+            low, high = consumer.get_watermark_offsets(
+                TopicPartition(kafka_topic, partition), timeout=timeout_sec
+            )
+            if high > low:
+                last_offsets[partition] = high - 1
+                partitions.append(
+                    TopicPartition(kafka_topic, partition, max(low, high - tail_messages))
+                )
+
+        if not partitions:
+            return None
+
+        consumer.incremental_assign(partitions)
+        key = product_id.encode()
+        # the topic can hold JSON or Protobuf trades
+        deserialize = AutoDeserializer(TRADE_CODEC)
+        while last_offsets:
+            msg = consumer.poll(timeout_sec)
+            if msg is None:
+                logger.warning(f'Timed out reading the end of {kafka_topic}')
+                break
+            if msg.error():
+                logger.error(f'Consumer error: {msg.error()}')
+                continue
+
+            if msg.key() == key:
+                timestamp_ms = deserialize(msg.value())['timestamp_ms']
+                last_trade_ms = max(last_trade_ms or timestamp_ms, timestamp_ms)
+
+            if msg.offset() >= last_offsets.get(msg.partition(), -1):
+                last_offsets.pop(msg.partition(), None)
+
+    logger.info(f'Last trade of {product_id} in {kafka_topic}: timestamp_ms={last_trade_ms}')
+    return last_trade_ms
@@ -1,69 +1,538 @@
-from typing import List
+import asyncio
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
 from quixstreams import Application
+from quixstreams.kafka import Producer
+from quixstreams.models import Topic
+# The same JSON encoder quixstreams uses for value_serializer='json'
+from quixstreams.utils.json import dumps
 from loguru import logger
-from src.config import config
+from kafka_serialization import (
+    FIXED_POINT_TRADE_CODEC,
+    TRADE_CODEC,
+    FixedPointDecimals,
+    SchemaRegistryProtobufSerializer,
+    get_value_serializer,
+)
+from src.trade_deduplicator import TradeDeduplicator
 from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
 from src.trade_data_source.base import TradeSource
+from src.trade_data_source.kraken_book_websocket_api import KrakenBookWebsocketAPI
 
 
 def produce_trades(
     kafka_broker_address: str,
     kafka_topic: str,
     trade_data_source: TradeSource,
+    kafka_linger_ms: Optional[int] = None,
+    kafka_batch_size: Optional[int] = None,
+    kafka_compression_type: Optional[str] = None,
+    kafka_value_encoding: str = 'json',
+    schema_registry_url: Optional[str] = None,
+    dedup_window_seconds: Optional[int] = None,
+    dedup_max_trades: int = 1_000_000,
+    fixed_point_decimals: Optional[Dict[str, Tuple[int, int]]] = None,
+    max_queued_batches: int = 8,
+    log_every_n_trades: int = 10_000,
 ):
     """
     Reads trades from the Kraken WEbsocket API and produces them to a Kafka topic.
+
+    The producer batches messages for up to `kafka_linger_ms` and up to `kafka_batch_size`
+    messages, compresses the batches, and is flushed at the boundary of every batch we get
+    from the source. The source is read asynchronously, with at most `max_queued_batches`
+    batches waiting for the producer (see `produce_from_stream`).
+
     Args:
         kafka_broker_address (str): The address of the Kafka broker.
         kafka_topic (str): The name of the Kafka topic to save the trades.
         trade_data_source (TradeSource): The source of the trade data.
+        kafka_linger_ms (Optional[int]): How long the producer waits to fill a batch (librdkafka default if None).
+        kafka_batch_size (Optional[int]): The maximum number of messages in a batch (librdkafka default if None).
+        kafka_compression_type (Optional[str]): One of 'none', 'gzip', 'snappy', 'lz4' or 'zstd' (no compression if None).
+        kafka_value_encoding (str): 'json', or 'protobuf' for schema-registered Protobuf messages.
+        schema_registry_url (Optional[str]): The URL of the schema registry (protobuf only).
+        dedup_window_seconds (Optional[int]): How far back in trade time we drop duplicate trades (no deduplication if None).
+        dedup_max_trades (int): The maximum number of trades the deduplication remembers.
+        fixed_point_decimals (Optional[Dict[str, Tuple[int, int]]]): The (price, quantity) decimals of
+            each product, to produce fixed-point integer prices and quantities (floats if None).
+        max_queued_batches (int): The number of batches the source can read ahead of the producer.
+        log_every_n_trades (int): We log one trade out of every `log_every_n_trades`.
     Returns:
         None
     """
+    # Only the settings we were given, everything else is left to librdkafka
+    producer_extra_config = {
+        key: value
+        for key, value in {
+            'linger.ms': kafka_linger_ms,
+            'batch.num.messages': kafka_batch_size,
+            'compression.type': kafka_compression_type,
+        }.items()
+        if value is not None
+    }
 
     # Create an application with Kafka configuration
-    app = Application(broker_address=kafka_broker_address)
-    # Define the Kafka topic with JSON serialization
-    topic = app.topic(name=kafka_topic, value_serializer='json')
+    app = Application(
+        broker_address=kafka_broker_address,
+        producer_extra_config=producer_extra_config,
+    )
+    # Prices and quantities are floats, or integers in the units of each product
+    decimals = FixedPointDecimals(fixed_point_decimals) if fixed_point_decimals else None
+
+    # Define the Kafka topic with JSON (or Protobuf) serialization
+    value_serializer = get_value_serializer(
+        kafka_value_encoding,
+        FIXED_POINT_TRADE_CODEC if decimals is not None else TRADE_CODEC,
+        schema_registry_url,
+        kafka_topic,
+    )
+    topic = app.topic(name=kafka_topic, value_serializer=value_serializer)
+
+    # Drop the trades the source hands us twice (page overlaps, websocket reconnects)
+    deduplicator = None
+    if dedup_window_seconds:
+        deduplicator = TradeDeduplicator(
+            window_ms=dedup_window_seconds * 1000, max_trades=dedup_max_trades
+        )
 
     # Create a producer (helps save data to the topic)
     with app.get_producer() as producer:
-        while not trade_data_source.is_done():
-        # while trade_data_source.is_done() is False:
+        asyncio.run(
+            produce_from_stream(
+                producer,
+                topic,
+                trade_data_source,
+                max_queued_batches,
+                log_every_n_trades,
+                value_serializer=value_serializer if kafka_value_encoding == 'protobuf' else None,
+                deduplicator=deduplicator,
+                fixed_point_decimals=decimals,
+            )
+        )
+
+    if deduplicator is not None:
+        deduplicator.log_stats()
+
+
+def produce_from_source(
+    producer: Producer,
+    topic: Topic,
+    trade_data_source: TradeSource,
+    log_every_n_trades: int = 10_000,
+    value_serializer: Optional[SchemaRegistryProtobufSerializer] = None,
+    deduplicator: Optional[TradeDeduplicator] = None,
+    fixed_point_decimals: Optional[FixedPointDecimals] = None,
+) -> int:
+    """
+    Produces all the trades of `trade_data_source` to the given topic, one batch at a time.
+
+    The synchronous version of `produce_from_stream`, with one batch at a time between
+    the source and the producer, for the callers without an event loop (see the benchmarks).
+
+    Args:
+        producer (Producer): The producer to send the messages with.
+        topic (Topic): The topic the messages go to.
+        trade_data_source (TradeSource): The source of the trade data.
+        log_every_n_trades (int): We log one trade out of every `log_every_n_trades`.
+        value_serializer (Optional[SchemaRegistryProtobufSerializer]): Encodes the values as Protobuf (JSON if None).
+        deduplicator (Optional[TradeDeduplicator]): Drops the trades we have already produced.
+        fixed_point_decimals (Optional[FixedPointDecimals]): Turns the prices and quantities into fixed-point integers.
+    Returns:
+        int: The number of trades produced.
+    """
+    return asyncio.run(
+        produce_from_stream(
+            producer,
+            topic,
+            trade_data_source,
+            max_queued_batches=1,
+            log_every_n_trades=log_every_n_trades,
+            value_serializer=value_serializer,
+            deduplicator=deduplicator,
+            fixed_point_decimals=fixed_point_decimals,
+        )
+    )
+
+
+async def produce_from_stream(
+    producer: Producer,
+    topic: Topic,
+    trade_data_source: TradeSource,
+    max_queued_batches: int = 8,
+    log_every_n_trades: int = 10_000,
+    value_serializer: Optional[SchemaRegistryProtobufSerializer] = None,
+    deduplicator: Optional[TradeDeduplicator] = None,
+    fixed_point_decimals: Optional[FixedPointDecimals] = None,
+) -> int:
+    """
+    Produces all the trades of `trade_data_source` to the given topic, reading the source
+    as an async iterator while the producer works.
+
+    The source and the producer are decoupled by a queue of at most `max_queued_batches`
+    batches. The batches are produced and flushed in a worker thread, so the event loop
+    keeps reading the source in the meantime. When Kafka slows down, the queue fills up
+    and the source is not asked for more batches until there is room again: the
+    backpressure reaches the source (and, for the websocket, the socket) instead of our
+    memory growing or trades being dropped.
+
+    Each batch is queued with the position of the source right after it, and once the
+    batch is in Kafka the source commits that position: the source is usually further
+    along, with batches still in the queue, and a checkpoint of its current position
+    would skip them after a restart. If a batch is not all delivered, we stop committing
+    for the rest of the run, so the checkpoint never moves past the lost trades and a
+    restart produces them again.
+
+    Args:
+        producer (Producer): The producer to send the messages with.
+        topic (Topic): The topic the messages go to.
+        trade_data_source (TradeSource): The source of the trade data.
+        max_queued_batches (int): The number of batches the source can read ahead of the producer.
+        log_every_n_trades (int): We log one trade out of every `log_every_n_trades`.
+        value_serializer (Optional[SchemaRegistryProtobufSerializer]): Encodes the values as Protobuf (JSON if None).
+        deduplicator (Optional[TradeDeduplicator]): Drops the trades we have already produced.
+        fixed_point_decimals (Optional[FixedPointDecimals]): Turns the prices and quantities into fixed-point integers.
+    Returns:
+        int: The number of trades produced.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued_batches)
+
+    async def read_source():
+        # None marks the end of the source, and an exception is handed over to be raised.
+        # The source does not move on until we ask for the next batch, so its position
+        # is the one right after the batch it has just returned.
+        try:
+            async for trades in trade_data_source:
+                await queue.put((trades, trade_data_source.position()))
+        except Exception as error:
+            await queue.put(error)
+        else:
+            await queue.put(None)
+
+    reader = asyncio.create_task(read_source())
+    n_trades = 0
+    # False once a batch was not all delivered
+    committing = True
+    try:
+        while (item := await queue.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            trades, position = item
+
+            if deduplicator is not None:
+                trades = deduplicator.filter(trades)
+
+            if fixed_point_decimals is not None:
+                trades = to_fixed_point(trades, fixed_point_decimals)
+
+            n_produced, n_undelivered = await loop.run_in_executor(
+                None, produce_and_flush, producer, topic, trades, value_serializer
+            )
+            # Once the batch is all in Kafka let the source checkpoint the position after it
+            if n_undelivered > 0 and committing:
+                logger.error(
+                    f"{n_undelivered:,} messages were not delivered to Kafka, we stop checkpointing the source"
+                )
+                committing = False
+            if committing:
+                trade_data_source.commit(position)
+
+            # Logging is sampled, so it costs nothing per trade
+            if (n_trades + n_produced) // log_every_n_trades > n_trades // log_every_n_trades:
+                logger.debug(f"Pushed {n_trades + n_produced:,} trades to Kafka so far")
+                if deduplicator is not None:
+                    deduplicator.log_stats()
+            n_trades += n_produced
+    finally:
+        reader.cancel()
+
+    return n_trades
+
+
+def produce_and_flush(
+    producer: Producer,
+    topic: Topic,
+    trades: Union[List[Trade], TradeBatch],
+    value_serializer: Optional[SchemaRegistryProtobufSerializer] = None,
+) -> Tuple[int, int]:
+    """
+    Produces a batch of trades and flushes the producer.
+
+    Returns:
+        Tuple[int, int]: The number of trades produced, and the number of messages still
+            not delivered after the flush.
+    """
+    n_produced = produce_batch(producer, topic, trades, value_serializer)
+    return n_produced, producer.flush()
+
+
+def to_fixed_point(
+    trades: Union[List[Trade], TradeBatch],
+    fixed_point_decimals: FixedPointDecimals,
+) -> TradeBatch:
+    """
+    Returns the trades with their prices and quantities as fixed-point integers, in the
+    units of each product.
+
+    A float that was parsed from a decimal string with at most that many decimals is
+    rounded back to that exact decimal, so nothing is lost on the way.
+
+    Args:
+        trades (Union[List[Trade], TradeBatch]): The trades, with float prices and quantities.
+        fixed_point_decimals (FixedPointDecimals): The decimals of each product.
+    Returns:
+        TradeBatch: The same trades, with int64 prices and quantities.
+    """
+    if not isinstance(trades, TradeBatch):
+        trades = TradeBatch.from_trades(trades)
+    if trades.is_fixed_point or len(trades) == 0:
+        return trades
+
+    product_ids = trades.product_id
+    if (product_ids == product_ids[0]).all():
+        # Most batches have a single product, so the scales are plain numbers
+        price_decimals, quantity_decimals = fixed_point_decimals.get(product_ids[0])
+        price_scale, quantity_scale = 10.0 ** price_decimals, 10.0 ** quantity_decimals
+    else:
+        price_scale, quantity_scale = np.empty(len(trades)), np.empty(len(trades))
+        for product_id in set(product_ids.tolist()):
+            in_product = product_ids == product_id
+            price_decimals, quantity_decimals = fixed_point_decimals.get(product_id)
+            price_scale[in_product] = 10.0 ** price_decimals
+            quantity_scale[in_product] = 10.0 ** quantity_decimals
+
+    return TradeBatch(
+        product_id=product_ids,
+        price=np.rint(trades.price * price_scale).astype(np.int64),
+        quantity=np.rint(trades.quantity * quantity_scale).astype(np.int64),
+        timestamp_ms=trades.timestamp_ms,
+        side=trades.side,
+        trade_id=trades.trade_id,
+    )
+
+
+def produce_batch(
+    producer: Producer,
+    topic: Topic,
+    trades: Union[List[Trade], TradeBatch],
+    value_serializer: Optional[SchemaRegistryProtobufSerializer] = None,
+) -> int:
+    """
+    Serializes a batch of trades and produces them to the given topic.
+
+    The serialization is amortized over the batch: the key is serialized once per
+    product, and the values are encoded straight from the columns of a `TradeBatch`.
+
+    Args:
+        producer (Producer): The producer to send the messages with.
+        topic (Topic): The topic the messages go to.
+        trades (Union[List[Trade], TradeBatch]): The trades to produce.
+        value_serializer (Optional[SchemaRegistryProtobufSerializer]): Encodes the values as Protobuf (JSON if None).
+    Returns:
+        int: The number of trades produced.
+    """
+    # The point of the key is to make sure that all trades of the same product go to the same partition
+    # This way, the order of the trades is preserved and we can get data in parallel
+    # We get horizontal scalability
+    keys = {}
 
-            trades: List[Trade] = trade_data_source.get_trades()
+    if value_serializer is not None:
+        # Protobuf messages are packed a whole batch at a time, from one list per field
+        if isinstance(trades, TradeBatch):
+            columns = {name: getattr(trades, name).tolist() for name, _ in TRADE_CODEC.fields}
+        else:
+            columns = {name: [getattr(trade, name) for trade in trades] for name, _ in TRADE_CODEC.fields}
 
-            # Serialize the event using the defined topic
-            # Transform the event into a sequence of bytes
-            for trade in trades:
-                # The point of the key is to make sure that all trades of the same product go to the same partition
-                # This way, the order of the trades is preserved and we can get data in parallel
-                # We get horizontal scalability
-                # trade.model_dump() is a method that serializes the trade object into a dictionary
-                message = topic.serialize(key=trade.product_id, value=trade.model_dump())
-                # Produce a message to the topic
-                producer.produce(topic=topic.name, value=message.value, key=message.key)
+        values = value_serializer.serialize_columns(columns)
+        for product_id, value in zip(columns['product_id'], values):
+            if product_id not in keys:
+                keys[product_id] = topic.serialize(key=product_id).key
+            producer.produce(topic=topic.name, value=value, key=keys[product_id])
+        return len(values)
 
-                logger.debug(f"Pushed trade to Kafka: {trade}") 
+    if isinstance(trades, TradeBatch):
+        # The fast path: one dictionary per trade straight from the columns
+        trades = trades.to_dicts()
+    else:
+        # trade.model_dump() is a method that serializes the trade object into a dictionary
+        trades = [trade.model_dump() for trade in trades]
+
+    # Serialize the event using the defined topic
+    # Transform the event into a sequence of bytes
+    for trade in trades:
+        product_id = trade['product_id']
+        if product_id not in keys:
+            keys[product_id] = topic.serialize(key=product_id).key
+
+        # Produce a message to the topic
+        producer.produce(topic=topic.name, value=dumps(trade), key=keys[product_id])
+
+    return len(trades)
+
+
+def produce_book_snapshots(
+    kafka_broker_address: str,
+    kafka_topic: str,
+    book_data_source: KrakenBookWebsocketAPI,
+    kafka_linger_ms: Optional[int] = None,
+    kafka_compression_type: Optional[str] = None,
+):
+    """
+    Reads order book snapshots from the Kraken Websocket API and produces them to a Kafka topic.
+
+    Args:
+        kafka_broker_address (str): The address of the Kafka broker.
+        kafka_topic (str): The name of the Kafka topic to save the snapshots.
+        book_data_source (KrakenBookWebsocketAPI): The source of the order book snapshots.
+        kafka_linger_ms (Optional[int]): How long the producer waits to fill a batch (librdkafka default if None).
+        kafka_compression_type (Optional[str]): One of 'none', 'gzip', 'snappy', 'lz4' or 'zstd' (no compression if None).
+    Returns:
+        None
+    """
+    producer_extra_config = {
+        key: value
+        for key, value in {
+            'linger.ms': kafka_linger_ms,
+            'compression.type': kafka_compression_type,
+        }.items()
+        if value is not None
+    }
+    app = Application(
+        broker_address=kafka_broker_address,
+        producer_extra_config=producer_extra_config,
+    )
+    topic = app.topic(name=kafka_topic, value_serializer='json')
+
+    with app.get_producer() as producer:
+        keys = {}
+        while not book_data_source.is_done():
+            snapshots = book_data_source.get_snapshots()
+
+            for snapshot in snapshots:
+                # Same as the trades, all the snapshots of a product go to the same partition
+                if snapshot.product_id not in keys:
+                    keys[snapshot.product_id] = topic.serialize(key=snapshot.product_id).key
+                producer.produce(
+                    topic=topic.name,
+                    value=dumps(snapshot.model_dump()),
+                    key=keys[snapshot.product_id],
+                )
+
+            producer.flush()
+            if snapshots:
+                logger.debug(f"Pushed {len(snapshots)} order book snapshots to Kafka")
 
 
 if __name__ == '__main__':
+    from src.config import config
 
     if config.live_or_historical == 'live':
         from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
-        kraken_api = KrakenWebsocketAPI(product_id=config.product_id)
+        kraken_api = KrakenWebsocketAPI(
+            product_ids=config.product_ids,
+            n_sockets=config.websocket_n_sockets,
+            json_backend=config.websocket_json_backend,
+            max_queued_frames=config.websocket_max_queued_frames,
+            )
+        produce_trades(
+            kafka_broker_address = config.kafka_broker_address,
+            kafka_topic = config.kafka_topic,
+            trade_data_source = kraken_api,
+            kafka_linger_ms = config.kafka_linger_ms,
+            kafka_batch_size = config.kafka_batch_size,
+            kafka_compression_type = config.kafka_compression_type,
+            kafka_value_encoding = config.kafka_value_encoding,
+            schema_registry_url = config.schema_registry_url,
+            dedup_window_seconds = config.dedup_window_seconds,
+            dedup_max_trades = config.dedup_max_trades,
+            fixed_point_decimals = config.fixed_point_decimals,
+            max_queued_batches = config.kafka_max_queued_batches,
+        )
     elif config.live_or_historical == 'historical':
         from src.trade_data_source.kraken_rest_api import KrakenRestAPI
-        kraken_api = KrakenRestAPI(
-            product_id=config.product_id,
-            last_n_days=config.last_n_days,
+        # The REST API serves one product per request, so we backfill one product after another
+        for product_id in config.product_ids:
+            resume_from_ms = None
+            if config.backfill_reconcile_with_kafka:
+                # Only fetch what is not in the topic yet
+                from src.kafka_reconciliation import get_last_produced_timestamp_ms
+                resume_from_ms = get_last_produced_timestamp_ms(
+                    kafka_broker_address=config.kafka_broker_address,
+                    kafka_topic=config.kafka_topic,
+                    product_id=product_id,
+                )
+
+            kraken_api = KrakenRestAPI(
+                product_id=product_id,
+                last_n_days=config.last_n_days,
+                archive_dir=config.trade_archive_dir,
+                n_workers=config.backfill_n_workers,
+                requests_per_second=config.backfill_requests_per_second,
+                rate_limit_burst=config.backfill_rate_limit_burst,
+                prefetch_pages=config.backfill_prefetch_pages,
+                checkpoint_dir=config.backfill_checkpoint_dir,
+                resume_from_ms=resume_from_ms,
+                )
+            produce_trades(
+                kafka_broker_address = config.kafka_broker_address,
+                kafka_topic = config.kafka_topic,
+                trade_data_source = kraken_api,
+                kafka_linger_ms = config.kafka_linger_ms,
+                kafka_batch_size = config.kafka_batch_size,
+                kafka_compression_type = config.kafka_compression_type,
+                kafka_value_encoding = config.kafka_value_encoding,
+                schema_registry_url = config.schema_registry_url,
+                dedup_window_seconds = config.dedup_window_seconds,
+                dedup_max_trades = config.dedup_max_trades,
+                fixed_point_decimals = config.fixed_point_decimals,
+                max_queued_batches = config.kafka_max_queued_batches,
             )
+    elif config.live_or_historical == 'replay':
+        if config.trade_archive_dir is None:
+            raise ValueError('The replay needs TRADE_ARCHIVE_DIR, the trade archive to replay')
+        from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+        from src.trade_data_source.replay_trade_source import ReplayTradeSource
+        # Replays the same days the historical backfill archived
+        from_ms, to_ms = KrakenRestAPI._init_from_to_ms(config.last_n_days)
+        replay = ReplayTradeSource(
+            archive_dir=config.trade_archive_dir,
+            product_ids=config.product_ids,
+            from_ms=from_ms,
+            to_ms=to_ms,
+            batch_size=config.replay_batch_size,
+            speed=config.replay_speed,
+            )
+        produce_trades(
+            kafka_broker_address = config.kafka_broker_address,
+            kafka_topic = config.kafka_topic,
+            trade_data_source = replay,
+            kafka_linger_ms = config.kafka_linger_ms,
+            kafka_batch_size = config.kafka_batch_size,
+            kafka_compression_type = config.kafka_compression_type,
+            kafka_value_encoding = config.kafka_value_encoding,
+            schema_registry_url = config.schema_registry_url,
+            dedup_window_seconds = config.dedup_window_seconds,
+            dedup_max_trades = config.dedup_max_trades,
+            fixed_point_decimals = config.fixed_point_decimals,
+            max_queued_batches = config.kafka_max_queued_batches,
+        )
+    elif config.live_or_historical == 'book':
+        kraken_api = KrakenBookWebsocketAPI(
+            product_ids=config.product_ids,
+            depth=config.book_depth,
+            snapshot_levels=config.book_snapshot_levels,
+            snapshot_interval_ms=config.book_snapshot_interval_ms,
+            json_backend=config.websocket_json_backend,
+            )
+        produce_book_snapshots(
+            kafka_broker_address = config.kafka_broker_address,
+            kafka_topic = config.kafka_topic,
+            book_data_source = kraken_api,
+            kafka_linger_ms = config.kafka_linger_ms,
+            kafka_compression_type = config.kafka_compression_type,
+        )
     else:
         raise ValueError("Invalid value for live_or_historical")
 
-    produce_trades(
-        kafka_broker_address = config.kafka_broker_address,
-        kafka_topic = config.kafka_topic,
-        trade_data_source = kraken_api,
-    )
-
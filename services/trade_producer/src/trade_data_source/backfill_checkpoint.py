@@ -0,0 +1,55 @@
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+
+class BackfillCheckpoint:
+    """
+    Durably stores, per product, the timestamp up to which the historical trades have
+    been produced to Kafka, so a restarted backfill resumes from there instead of
+    producing every trade again.
+    """
+
+    def __init__(self, checkpoint_dir: str, product_id: str) -> None:
+        """
+        Args:
+            checkpoint_dir (str): The directory where we store the checkpoints.
+            product_id (str): The product ID this checkpoint belongs to.
+        """
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.product_id = product_id
+
+        if not self.checkpoint_dir.exists():
+            # create the checkpoint directory if it does not exist
+            self.checkpoint_dir.mkdir(parents=True)
+
+        # one file per product ('BTC/EUR' -> 'BTC-EUR.json')
+        self._file_path = self.checkpoint_dir / f'{product_id.replace("/", "-")}.json'
+
+    def load(self) -> Optional[int]:
+        """
+        Returns the checkpointed `last_trade_ms`, or None if there is no checkpoint yet.
+        """
+        if not self._file_path.exists():
+            return None
+
+        with open(self._file_path) as f:
+            last_trade_ms = json.load(f)['last_trade_ms']
+
+        logger.info(f'Loaded checkpoint for {self.product_id}: last_trade_ms={last_trade_ms}')
+        return last_trade_ms
+
+    def save(self, last_trade_ms: int) -> None:
+        """
+        Saves `last_trade_ms`. The file is replaced atomically, so a crash while saving
+        leaves the previous checkpoint in place.
+        """
+        tmp_path = self._file_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'product_id': self.product_id, 'last_trade_ms': last_trade_ms}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._file_path)
@@ -1,14 +1,19 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Any, AsyncIterator, List, Union
 
 # Observe how we use absolute import here
 from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
 
 class TradeSource(ABC):
     @abstractmethod
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> Union[List[Trade], TradeBatch]:
         """"
         Get a list of trades from whatever source you connect to.
+
+        Sources on the hot path should return a `TradeBatch`, which skips the
+        per-trade pydantic models.
         """
         pass
 
@@ -17,4 +22,37 @@ class TradeSource(ABC):
         """
         Check if the source has no more trades to return True; False otherwise.
         """
-        pass
\ No newline at end of file
+        pass
+
+    def position(self) -> Any:
+        """
+        Returns the position of the source right after the last batch it returned, for
+        `commit`. Sources that cannot resume after a restart have none.
+        """
+        return None
+
+    def commit(self, position: Any) -> None:
+        """
+        Called once all the trades up to `position` (as returned by `position()` after
+        their batch) are in Kafka. The source can be further along by then, since it reads
+        ahead of the producer, so sources that can resume after a restart checkpoint the
+        given position rather than their current one.
+        """
+        pass
+
+    async def stream(self) -> AsyncIterator[Union[List[Trade], TradeBatch]]:
+        """
+        Yields the batches of trades until the source is done, the async-iterator
+        version of the get_trades() / is_done() loop.
+
+        The next batch is only fetched when the consumer asks for it, so a slow consumer
+        slows the source down instead of batches piling up. By default the blocking
+        get_trades() runs in a worker thread, so the event loop is free in the meantime;
+        sources with their own async I/O override this.
+        """
+        loop = asyncio.get_running_loop()
+        while not self.is_done():
+            yield await loop.run_in_executor(None, self.get_trades)
+
+    def __aiter__(self) -> AsyncIterator[Union[List[Trade], TradeBatch]]:
+        return self.stream()
@@ -0,0 +1,20 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class BookSnapshot(BaseModel):
+    """
+    A compact snapshot of the L2 order book of one product.
+    """
+    product_id: str
+    timestamp_ms: int
+    # the best levels per side, best first
+    bid_prices: List[float]
+    bid_quantities: List[float]
+    ask_prices: List[float]
+    ask_quantities: List[float]
+    spread: float
+    mid_price: float
+    microprice: float
+    imbalance: float
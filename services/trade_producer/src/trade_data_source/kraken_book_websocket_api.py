@@ -0,0 +1,193 @@
+import json
+import time
+from typing import Dict, List
+
+from loguru import logger
+from websocket import WebSocketTimeoutException, create_connection
+
+from src.trade_data_source.book_snapshot import BookSnapshot
+from src.trade_data_source.kraken_decoder import classify_frame, get_json_loads
+from src.trade_data_source.order_book import OrderBook
+
+# The depths Kraken accepts for a book subscription
+KRAKEN_BOOK_DEPTHS = (10, 25, 100, 500, 1000)
+
+
+class KrakenBookWebsocketAPI:
+    """
+    Class for reading the L2 order book from the `book` channel of the Kraken Websocket API
+
+    We keep one OrderBook per product up to date with the book deltas, verify it against
+    the checksum Kraken sends with every message, and hand out a compact snapshot of each
+    book every `snapshot_interval_ms`, so what we produce to Kafka is bounded by the number
+    of products and not by how busy the books are.
+    """
+    URL = 'wss://ws.kraken.com/v2'
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        depth: int = 10,
+        snapshot_levels: int = 10,
+        snapshot_interval_ms: int = 1000,
+        json_backend: str = 'auto',
+    ):
+        """
+        Initializes the KrakenBookWebsocketAPI instance
+
+        Args:
+            product_ids (List[str]): The product ids to get the order books from
+            depth (int): The number of levels per side we subscribe to (10, 25, 100, 500 or 1000)
+            snapshot_levels (int): The number of levels per side in each snapshot
+            snapshot_interval_ms (int): How often we take a snapshot of the books
+            json_backend (str): The JSON backend of the frame decoder ('auto', 'orjson' or 'json')
+        """
+        if depth not in KRAKEN_BOOK_DEPTHS:
+            raise ValueError(f'Invalid book depth {depth}, Kraken accepts {KRAKEN_BOOK_DEPTHS}')
+
+        self.product_ids = product_ids
+        self.depth = depth
+        self.snapshot_levels = min(snapshot_levels, depth)
+        self.snapshot_interval_ms = snapshot_interval_ms
+        self._loads = get_json_loads(json_backend)
+
+        # Establish connection to the Kraken Websocket API
+        self._ws = create_connection(self.URL)
+        logger.debug(f"Connection Established")
+
+        # The checksum depends on how many decimals each product has, so we need those
+        # before we can verify any book
+        precisions = self._get_precisions(product_ids)
+        self._books: Dict[str, OrderBook] = {
+            product_id: OrderBook(product_id, depth, *precisions[product_id])
+            for product_id in product_ids
+        }
+        # The books we got a snapshot for, and that passed their last checksum
+        self._in_sync = set()
+        self.n_resyncs = 0
+
+        self._subscribe(product_ids)
+        self._next_snapshot_ms = self._now_ms() + snapshot_interval_ms
+
+    def get_snapshots(self) -> List[BookSnapshot]:
+        """
+        Applies the book messages until the next snapshot is due, and then returns a
+        snapshot of every book that is in sync.
+
+        Args:
+            None
+        Returns:
+            List[BookSnapshot]: One snapshot per product (fewer while books are resyncing)
+        """
+        while (now_ms := self._now_ms()) < self._next_snapshot_ms:
+            # Do not block on the socket past the time of the next snapshot
+            self._ws.settimeout((self._next_snapshot_ms - now_ms) / 1000)
+            try:
+                frame = self._ws.recv()
+            except WebSocketTimeoutException:
+                break
+            self._handle_frame(frame)
+
+        # The snapshots stay on a fixed grid, and we skip the ones we are too late for
+        now_ms = max(self._now_ms(), self._next_snapshot_ms)
+        missed = (now_ms - self._next_snapshot_ms) // self.snapshot_interval_ms
+        self._next_snapshot_ms += (missed + 1) * self.snapshot_interval_ms
+
+        snapshots = []
+        for product_id in self.product_ids:
+            if product_id not in self._in_sync:
+                continue
+            snapshot = self._books[product_id].snapshot(now_ms, self.snapshot_levels)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def is_done(self) -> bool:
+        """
+        Returns True if the Kraken Websocket API connection is closed
+        """
+        # We are streaming from a websocket, so we are never done
+        return False
+
+    def _handle_frame(self, frame: str) -> None:
+        """
+        Applies one raw frame to the books. Heartbeats, status messages and method
+        responses are skipped without a full JSON decode.
+        """
+        if classify_frame(frame, self._loads) != 'book':
+            return
+
+        message = self._loads(frame)
+        for data in message['data']:
+            product_id = data['symbol']
+            book = self._books.get(product_id)
+            if book is None:
+                continue
+
+            if message['type'] == 'snapshot':
+                book.clear()
+                self._in_sync.add(product_id)
+            elif product_id not in self._in_sync:
+                # Updates in flight from before the resubscription
+                continue
+
+            book.apply(data.get('bids', []), data.get('asks', []))
+
+            if book.checksum() != data['checksum']:
+                logger.warning(f'The checksum of the {product_id} book does not match, resubscribing')
+                self._resync(product_id)
+
+    def _resync(self, product_id: str) -> None:
+        """
+        Drops the book of `product_id` and subscribes again, to get a fresh snapshot.
+        """
+        self._in_sync.discard(product_id)
+        self._books[product_id].clear()
+        self.n_resyncs += 1
+        self._send('unsubscribe', [product_id])
+        self._send('subscribe', [product_id])
+
+    def _get_precisions(self, product_ids: List[str]) -> Dict[str, tuple]:
+        """
+        Returns the (price_precision, qty_precision) of each product, from the snapshot of
+        the `instrument` channel.
+        """
+        self._ws.send(json.dumps({'method': 'subscribe', 'params': {'channel': 'instrument'}}))
+        while True:
+            frame = self._ws.recv()
+            if classify_frame(frame, self._loads) != 'instrument':
+                continue
+            message = self._loads(frame)
+            if message.get('type') == 'snapshot':
+                break
+        self._ws.send(json.dumps({'method': 'unsubscribe', 'params': {'channel': 'instrument'}}))
+
+        pairs = {pair['symbol']: pair for pair in message['data']['pairs']}
+        missing = [product_id for product_id in product_ids if product_id not in pairs]
+        if missing:
+            raise ValueError(f'Kraken does not list the products {missing}')
+        return {
+            product_id: (pairs[product_id]['price_precision'], pairs[product_id]['qty_precision'])
+            for product_id in product_ids
+        }
+
+    def _subscribe(self, product_ids: List[str]):
+        """
+        Subscribes to the order books of the given product_ids
+        """
+        logger.info(f'Subscribing to the order books for {product_ids}')
+        self._send('subscribe', product_ids)
+        logger.info(f'Subscrition worked')
+
+    def _send(self, method: str, product_ids: List[str]) -> None:
+        """
+        Sends a book subscription request ('subscribe' or 'unsubscribe').
+        """
+        params = {'channel': 'book', 'symbol': product_ids, 'depth': self.depth}
+        if method == 'subscribe':
+            params['snapshot'] = True
+        self._ws.send(json.dumps({'method': method, 'params': params}))
+
+    @staticmethod
+    def _now_ms() -> int:
+        return int(time.time() * 1000)
@@ -0,0 +1,182 @@
+import json
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+from src.trade_data_source.trade_batch import TradeBatch
+
+# orjson is optional: it is a lot faster than the standard library, but we can live without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Kraken v2 channel messages start with this prefix, e.g. '{"channel":"heartbeat"}'
+CHANNEL_PREFIX = '{"channel":"'
+# and method responses (e.g. subscription confirmations) start with this one
+METHOD_PREFIX = '{"method":'
+
+# The taker side of a trade as we store it (see Trade.side)
+SIDES = {'buy': 1, 'sell': -1}
+
+
+def get_json_loads(backend: str = 'auto') -> Callable[[str], Any]:
+    """
+    Returns the function we use to decode JSON.
+
+    Args:
+        backend (str): 'orjson', 'json' (standard library), or 'auto' to use orjson if it
+            is installed and the standard library otherwise.
+
+    Returns:
+        Callable[[str], Any]: The JSON decoding function.
+    """
+    if backend == 'auto':
+        backend = 'orjson' if orjson is not None else 'json'
+
+    if backend == 'orjson':
+        if orjson is None:
+            raise ValueError('The orjson JSON backend was requested but orjson is not installed')
+        return orjson.loads
+    if backend == 'json':
+        return json.loads
+
+    raise ValueError(f'Invalid JSON backend: {backend}')
+
+
+def classify_frame(frame: str, loads: Callable[[str], Any] = json.loads) -> str:
+    """
+    Returns the channel of a raw Kraken v2 frame ('trade', 'heartbeat', 'status', ...) or
+    'method' for method responses, without decoding the whole frame.
+
+    Kraken puts the channel first, so we only look at the prefix. Frames with any other
+    layout are decoded to be safe.
+
+    Args:
+        frame (str): The raw frame we got from the websocket.
+        loads (Callable[[str], Any]): The JSON decoding function for the slow path.
+
+    Returns:
+        str: The channel of the frame.
+    """
+    if frame.startswith(CHANNEL_PREFIX):
+        return frame[len(CHANNEL_PREFIX):frame.find('"', len(CHANNEL_PREFIX))]
+    if frame.startswith(METHOD_PREFIX):
+        return 'method'
+
+    message = loads(frame)
+    if 'channel' in message:
+        return message['channel']
+    return 'method' if 'method' in message else 'unknown'
+
+
+def _date_to_ms(date: str) -> int:
+    """
+    Returns the Unix timestamp in milliseconds of midnight UTC of a 'YYYY-MM-DD' date.
+    """
+    year, month, day = int(date[0:4]), int(date[5:7]), int(date[8:10])
+
+    # days since 1970-01-01 in the proleptic Gregorian calendar (H. Hinnant's days_from_civil)
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    days = era * 146097 + day_of_era - 719468
+
+    return days * 86_400_000
+
+
+@lru_cache(maxsize=4096)
+def _second_to_ms(second: str) -> Optional[int]:
+    """
+    Returns the Unix timestamp in milliseconds of a 'YYYY-MM-DDTHH:MM:SS' UTC time, or
+    None if the string does not have this exact layout.
+
+    Trades come in timestamp order and many of them share the same second, so the cache
+    turns most calls into one dictionary lookup.
+    """
+    if not (
+        second[4] == '-'
+        and second[7] == '-'
+        and second[10] == 'T'
+        and second[13] == ':'
+        and second[16] == ':'
+    ):
+        return None
+
+    return (
+        _date_to_ms(second[:10])
+        + int(second[11:13]) * 3_600_000
+        + int(second[14:16]) * 60_000
+        + int(second[17:19]) * 1_000
+    )
+
+
+def rfc3339_to_ms(timestamp: str) -> int:
+    """
+    Converts a Kraken timestamp like '2024-10-01T12:00:00.123456Z' to a Unix timestamp in
+    milliseconds.
+
+    Kraken always sends this fixed format, so we slice the fields instead of parsing the
+    string with datetime. Anything else falls back to datetime.fromisoformat.
+
+    Args:
+        timestamp (str): The timestamp to convert.
+
+    Returns:
+        int: The Unix timestamp in milliseconds.
+    """
+    if len(timestamp) >= 20 and timestamp[-1] == 'Z':
+        ms = _second_to_ms(timestamp[:19])
+        if ms is not None:
+            if timestamp[19] == '.':
+                # keep the first 3 digits of the fraction, padding '.1Z' to 100 ms
+                ms += int(timestamp[20:23] if len(timestamp) >= 24 else timestamp[20:-1].ljust(3, '0'))
+            return ms
+
+    parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+class KrakenTradeDecoder:
+    """
+    Turns raw Kraken v2 websocket frames into trade batches.
+
+    Frames that are not trades (heartbeats, status messages, subscription confirmations)
+    are recognised from their prefix and skipped without being decoded.
+    """
+
+    def __init__(self, json_backend: str = 'auto') -> None:
+        """
+        Args:
+            json_backend (str): The JSON backend, see `get_json_loads`.
+        """
+        self._loads = get_json_loads(json_backend)
+
+    def decode(self, frame: str) -> TradeBatch:
+        """
+        Decodes one raw frame into a batch of trades.
+
+        Args:
+            frame (str): The raw frame we got from the websocket.
+
+        Returns:
+            TradeBatch: A batch of trades (empty if the frame has no trades).
+        """
+        if classify_frame(frame, self._loads) != 'trade':
+            return TradeBatch.empty()
+
+        trades = self._loads(frame)['data']
+
+        # The whole batch is validated at once, instead of one pydantic Trade per trade
+        return TradeBatch.from_columns(
+            product_id=[trade['symbol'] for trade in trades],
+            price=[trade['price'] for trade in trades],
+            quantity=[trade['qty'] for trade in trades],
+            timestamp_ms=[rfc3339_to_ms(trade['timestamp']) for trade in trades],
+            side=[SIDES.get(trade.get('side'), 0) for trade in trades],
+            trade_id=[trade.get('trade_id', 0) for trade in trades],
+        )
@@ -1,29 +1,69 @@
-from typing import List, Optional, Tuple
+import asyncio
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Full, Queue
+from threading import Event, Thread
+from typing import AsyncIterator, Deque, Iterator, List, Optional, Tuple
+import numpy as np
 from loguru import logger
-from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
 from src.trade_data_source.base import TradeSource
+from src.trade_data_source.backfill_checkpoint import BackfillCheckpoint
+from src.trade_data_source.trade_archive import DAY_MS, TradeArchive
+from src.trade_data_source.rate_limiter import (
+    ExponentialBackoff,
+    RetryableError,
+    TokenBucket,
+)
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from time import sleep
-import pandas as pd
-from pathlib import Path
 
-class KrakenRestAPI:
+# errors the Kraken REST API returns when we go over the API counter
+RATE_LIMIT_ERRORS = {'EGeneral:Too many requests', 'EAPI:Rate limit exceeded'}
+# errors that usually go away if we try again a bit later
+TRANSIENT_ERRORS = {'EService:Unavailable', 'EService:Busy', 'EGeneral:Temporary lockout'}
+# we give up on a request (and retry it) if Kraken does not answer within this time
+REQUEST_TIMEOUT_SEC = 30
+
+class KrakenRestAPI(TradeSource):
     URL = 'https://api.kraken.com/0/public/Trades?pair={product_id}&since={since_sec}'
 
     def __init__(
         self,
         product_id: str,
         last_n_days: int, # The number of days from which we want to get historical data.
-        cache_dir: Optional[str] = None,
+        archive_dir: Optional[str] = None,
+        n_workers: int = 1,
+        requests_per_second: float = 1.0,
+        rate_limit_burst: float = 1.0,
+        prefetch_pages: int = 2,
+        checkpoint_dir: Optional[str] = None,
+        resume_from_ms: Optional[int] = None,
     ) -> None:
         """
         Basic initialization of the Kraken Rest API.
 
+        The time range `[from_ms, to_ms)` is split into day shards. The shards are
+        fetched concurrently by a pool of `n_workers` threads that share one global
+        rate budget of `requests_per_second`, and they are returned by `get_trades`
+        one shard at a time, in order, so trades come out in timestamp order.
+
         Args:
             product_id (str): One product ID for which we want to get the trades.
             last_n_days (int): The number of days from which we want to get historical data.
-            cache_dir (Optional[str]): The directory where we will store the historical data to
+            archive_dir (Optional[str]): The directory of the day-partitioned trade archive we
+                read from before calling the API, and write the fetched trades to.
+            n_workers (int): The number of day shards we fetch concurrently.
+            requests_per_second (float): The rate budget shared by all the workers.
+            rate_limit_burst (float): The number of requests we can make back to back before
+                the rate budget kicks in (the maximum of the Kraken API counter).
+            prefetch_pages (int): How many pages each worker requests ahead of the page it
+                is parsing.
+            checkpoint_dir (Optional[str]): The directory where we checkpoint how far the
+                backfill got, so a restart resumes from there.
+            resume_from_ms (Optional[int]): Skip the trades before this timestamp, e.g. the
+                last trade we find in the Kafka topic.
 
         Returns:
             None
@@ -35,21 +75,52 @@ class KrakenRestAPI:
             f'Initializing KrakenRestAPI: from_ms={ts_to_date(self.from_ms)}, to_ms={ts_to_date(self.to_ms)}'
         )
 
-        # the timestamp from which we want to fetch historical data
-        # this will be updated after each batch of trades is fetched from the API
-        # self.since_ms = from_ms
-        self.last_trade_ms = self.from_ms
-
-        # are we done fetching historical data?
-        # Yes, if the last batch of trades has a data['result'][product_id]['last'] >= self.to_ms
-        # self._is_done = False
-
-        # cache_dir is the directory where we will store the historical data to speed up
-        # service restarts
-        self.use_cache = False
-        if cache_dir is not None:
-            self.cache = CachedTradeData(cache_dir)
-            self.use_cache = True
+        # checkpoint_dir is where we store how far we got, so that a restart does not
+        # produce again the trades that are already in Kafka
+        self.checkpoint: Optional[BackfillCheckpoint] = None
+        if checkpoint_dir is not None:
+            self.checkpoint = BackfillCheckpoint(checkpoint_dir, product_id)
+
+        # the timestamp up to which we have returned historical data
+        # this will be updated after each shard of trades is returned by get_trades()
+        checkpoint_ms = self.checkpoint.load() if self.checkpoint is not None else None
+        self.last_trade_ms = max(
+            ms for ms in [self.from_ms, checkpoint_ms, resume_from_ms] if ms is not None
+        )
+        if self.last_trade_ms > self.from_ms:
+            logger.info(f'Resuming the backfill of {product_id} from {ts_to_date(self.last_trade_ms)}')
+
+        # archive_dir is the directory where we store the historical data to speed up
+        # service restarts; only the time ranges missing in the archive are fetched
+        self.archive: Optional[TradeArchive] = None
+        if archive_dir is not None:
+            self.archive = TradeArchive(archive_dir)
+
+        # the day shards we still have to submit to the worker pool
+        self._shards: Deque[Tuple[int, int]] = deque(
+            self._split_into_day_shards(self.last_trade_ms, self.to_ms)
+        )
+        # the shards submitted to the worker pool, in the order we have to return them
+        self._pending: Deque[Tuple[Tuple[int, int], Future]] = deque()
+        self._n_workers = max(1, n_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self._n_workers)
+
+        # one rate budget shared by all the workers, modelled after the Kraken API counter,
+        # and the retry policy for the requests that fail anyway
+        self._rate_limiter = TokenBucket(rate=requests_per_second, capacity=rate_limit_burst)
+        self._backoff = ExponentialBackoff()
+
+        # a pool of keep-alive HTTP sessions, one per worker, so the requests reuse the
+        # connections to the Kraken REST API instead of opening a new one each time
+        self._sessions: Queue = Queue()
+        for _ in range(self._n_workers):
+            session = requests.Session()
+            session.headers.update({'Accept': 'application/json'})
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._sessions.put(session)
+
+        # how many pages each worker requests ahead of the page it is parsing
+        self._prefetch_depth = max(1, prefetch_pages)
 
     @staticmethod
     def _init_from_to_ms(last_n_days: int) -> Tuple[int, int]:
@@ -78,178 +149,315 @@ class KrakenRestAPI:
 
         return from_ms, to_ms
 
-    def get_trades(self) -> List[Trade]:
+    @staticmethod
+    def _split_into_day_shards(from_ms: int, to_ms: int) -> List[Tuple[int, int]]:
+        """
+        Splits the time range `[from_ms, to_ms)` into shards that end at UTC midnight.
+
+        Args:
+            from_ms (int): The start of the time range in milliseconds.
+            to_ms (int): The end of the time range in milliseconds.
+
+        Returns:
+            List[Tuple[int, int]]: The `[shard_from_ms, shard_to_ms)` pairs, in order.
+        """
+        shards = []
+        shard_from_ms = from_ms
+        while shard_from_ms < to_ms:
+            next_midnight_ms = (shard_from_ms // DAY_MS + 1) * DAY_MS
+            shard_to_ms = min(next_midnight_ms, to_ms)
+            shards.append((shard_from_ms, shard_to_ms))
+            shard_from_ms = shard_to_ms
+        return shards
+
+    def get_trades(self) -> TradeBatch:
         """
-        Fetches a batch of trades from the Kraken Rest API and returns them as a list
-        of dictionaries.
+        Returns the trades of the next day shard, in timestamp order.
 
         Args:
             None
 
         Returns:
-            List[Trade]: A list of dictionaries, where each dictionary contains the trade data.
+            TradeBatch: The trades of the shard.
         """
-        # Replace the placeholders in the URL with the actual values for
-        # - product_id
-        # - since_ns
-        since_ns = self.last_trade_ms * 1_000_000
-        payload = {}
-        headers = {'Accept': 'application/json'}
-        url = self.URL.format(product_id=self.product_id, since_sec=since_ns)
-        logger.debug(f'{url=}')
+        shard, future = self._next_shard()
+        return self._finish_shard(shard, future.result())
 
-        if self.use_cache and self.cache.has(url):
-            # read the data from the cache (we save data locally to speed up service restarts)
-            trades = self.cache.read(url)
-            logger.debug(
-                f'Loaded {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the cache'
-            )
-        else:
-            # make the request to the Kraken REST API
-            response = requests.request('GET', url, headers=headers, data=payload)
+    async def stream(self) -> AsyncIterator[TradeBatch]:
+        """
+        Yields the trades of one day shard after another, like get_trades(), but awaits
+        the worker threads instead of blocking on them.
 
-            # parse string into dictionary
-            data = json.loads(response.text)
+        The workers only fetch the shards we are about to yield, so when the consumer is
+        slow the fetching (and the requests to Kraken) slows down with it.
+        """
+        while not self.is_done():
+            shard, future = self._next_shard()
+            yield self._finish_shard(shard, await asyncio.wrap_future(future))
 
-            # TODO: Error handling
-            # It can happen that we get an error response from KrakenRESTAP like the following:
-            # data = {'error': ['EGeneral:Too many requests']}
-            # To solve this have several options
-            #
-            # Option 1. Check if the `error` key is present in the `data` and has
-            # a non-empty list value. If so, we could raise an exception, or even better, implment
-            # a retry mechanism, using a library like `retry` https://github.com/invl/retry
-            #
-            # Option 2. Simply slow down the rate at which we are making requests to the Kraken API,
-            # and cross your fingers.
-            #
-            # Option 3. Implement both Option 1 and Option 2, so you don't need to cross your fingers.
-            #
-            # Here is an example of how you could implement Option 2
-            if ('error' in data) and ('EGeneral:Too many requests' in data['error']):
-                # slow down the rate at which we are making requests to the Kraken API
-                logger.info('Too many requests. Sleeping for 30 seconds')
-                sleep(30)
-
-            # Python trick
-            # Instead of initializing an empty list and appending to it, like this
-            #
-            # trades = []
-            # for trade in data['result'][self.product_ids[0]]:
-            #     trades.append({
-            #         'price': float(trade[0]),
-            #         'volume': float(trade[1]),
-            #         'time': int(trade[2]),
-            #     })
-            #
-            # You can use a list comprehension to do the same thing
-            trades = [
-                Trade(
-                    price=float(trade[0]),
-                    quantity=float(trade[1]),
-                    timestamp_ms=int(trade[2] * 1000),
-                    product_id=self.product_id,
-                )
-                for trade in data['result'][self.product_id]
-            ]
-
-            logger.debug(
-                f'Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API'
+    def _next_shard(self) -> Tuple[Tuple[int, int], Future]:
+        """
+        Returns the next day shard and the future of its trades.
+        """
+        # keep the worker pool busy, without fetching the whole time range into memory
+        while self._shards and len(self._pending) < 2 * self._n_workers:
+            shard = self._shards.popleft()
+            self._pending.append(
+                (shard, self._executor.submit(self._fetch_shard, *shard))
             )
 
-            if self.use_cache:
-                # write the data to the cache
-                self.cache.write(url, trades)
-                logger.debug(
-                    f'Wrote to cache for {self.product_id}, since={ns_to_date(since_ns)}'
-                )
-
-            # slow down the rate at which we are making requests to the Kraken API
-            sleep(1)
-
-        if trades[-1].timestamp_ms == self.last_trade_ms:
-            # if the last trade timestamp in the batch is the same as self.last_trade_ms,
-            # then we need to increment it by 1 to avoid repeating the exact same API request,
-            # which would result in an infinite loop
-            self.last_trade_ms = trades[-1].timestamp_ms + 1
-        else:
-            # otherwise, update self.last_trade_ms to the timestamp of the last trade
-            # in the batch
-            self.last_trade_ms = trades[-1].timestamp_ms
-        
-        # filter out trades that are after the end timestamp
-        trades = [trade for trade in trades if trade.timestamp_ms <= self.to_ms]
-
-        # if ns_to_date(since_ns) == '2024-04-30 18:33:41':
-        #     # self.cache._get_file_path(url)
-        #     breakpoint()
+        return self._pending.popleft()
+
+    def _finish_shard(self, shard: Tuple[int, int], trades: TradeBatch) -> TradeBatch:
+        """
+        Moves our position past the given shard, once we have its trades.
+        """
+        shard_from_ms, shard_to_ms = shard
+        logger.debug(
+            f'Got {len(trades)} trades for {self.product_id} between {ts_to_date(shard_from_ms)} and {ts_to_date(shard_to_ms)}'
+        )
+
+        self.last_trade_ms = shard_to_ms
+
+        if self.is_done():
+            self._executor.shutdown()
 
         return trades
 
-    def is_done(self) -> bool:
-        # return self._is_done
-        return self.last_trade_ms >= self.to_ms
+    def _fetch_shard(self, from_ms: int, to_ms: int) -> TradeBatch:
+        """
+        Returns all the trades in `[from_ms, to_ms)`, from the archive if we have it, and
+        from the Kraken REST API otherwise.
 
+        Args:
+            from_ms (int): The start of the shard in milliseconds.
+            to_ms (int): The end of the shard in milliseconds.
 
-class CachedTradeData:
-    """
-    A class to handle the caching of trade data fetched from the Kraken REST API.
-    """
+        Returns:
+            TradeBatch: The trades in the shard, in timestamp order.
+        """
+        if self.archive is None:
+            return self._fetch_range(from_ms, to_ms)
 
-    def __init__(self, cache_dir: str) -> None:
-        self.cache_dir = Path(cache_dir)
+        # only fetch the parts of the shard we do not have yet, and archive them
+        for missing_from_ms, missing_to_ms in self.archive.missing_ranges(
+            self.product_id, from_ms, to_ms
+        ):
+            trades = self._fetch_range(missing_from_ms, missing_to_ms)
+            self.archive.write(self.product_id, trades, missing_from_ms, missing_to_ms)
 
-        if not self.cache_dir.exists():
-            # create the cache directory if it does not exist
-            self.cache_dir.mkdir(parents=True)
+        trades = self.archive.read(self.product_id, from_ms, to_ms)
+        logger.debug(
+            f'Loaded {len(trades)} trades for {self.product_id}, since={ts_to_date(from_ms)} from the archive'
+        )
+        return trades
 
-    def read(self, url: str) -> List[Trade]:
+    def _fetch_range(self, from_ms: int, to_ms: int) -> TradeBatch:
         """
-        Reads from the cache the trade data for the given url
+        Pages through the Kraken REST API until we have all the trades in `[from_ms, to_ms)`.
+
+        Args:
+            from_ms (int): The start of the time range in milliseconds.
+            to_ms (int): The end of the time range in milliseconds.
+
+        Returns:
+            TradeBatch: The trades in the time range, in timestamp order.
         """
-        file_path = self._get_file_path(url)
+        pages = []
+        for rows in self._prefetch_pages(from_ms, to_ms):
+            trades = self._parse_page(rows)
 
-        if file_path.exists():
-            # read the data from the parquet file
-            import pandas as pd
+            # keep only the trades inside this time range; the next one takes care of the rest
+            pages.append(
+                trades[(trades.timestamp_ms >= from_ms) & (trades.timestamp_ms < to_ms)]
+            )
+
+        return TradeBatch.concat(pages)
 
-            data = pd.read_parquet(file_path)
-            # transform the data to a list of Trade objects
-            return [Trade(**trade) for trade in data.to_dict(orient='records')]
+    def _prefetch_pages(self, from_ms: int, to_ms: int) -> Iterator[list]:
+        """
+        Yields the raw pages of trades in `[from_ms, to_ms)`, in order.
 
-        return []
+        The requests run in a background thread that stays up to `prefetch_pages` pages
+        ahead, so page N+1 is already on its way while the caller parses page N. The
+        thread stops when the caller stops iterating (e.g. it failed or was closed),
+        instead of waiting forever for room in the queue.
 
-    def write(self, url: str, trades: List[Trade]) -> None:
+        Args:
+            from_ms (int): The start of the time range in milliseconds.
+            to_ms (int): The end of the time range in milliseconds.
+
+        Returns:
+            Iterator[list]: The raw trades of each page, as returned by the Kraken REST API.
         """
-        Saves the given trades to a parquet file in the cache directory.
+        pages: Queue = Queue(maxsize=self._prefetch_depth)
+        # set when the caller stops iterating
+        stopped = Event()
+
+        def put(item) -> bool:
+            # returns False if the caller stopped before there was room for the item
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def fetch_pages():
+            try:
+                since_ns = from_ms * 1_000_000
+                while since_ns < to_ms * 1_000_000:
+                    rows = self._fetch_page(since_ns)
+                    if not rows:
+                        # nothing else to fetch after since_ns
+                        break
+                    if not put(rows):
+                        return
+
+                    # the time of the last trade is all we need to request the next page. It
+                    # has to keep its sub-millisecond part: Kraken returns the trades after
+                    # `since`, so truncating it to the millisecond would return the trades of
+                    # that millisecond again on the next page. Kraken times have microseconds.
+                    last_trade_ns = round(float(rows[-1][2]) * 1_000_000) * 1_000
+                    if last_trade_ns <= since_ns:
+                        # if the last trade timestamp in the batch is the same as since_ns,
+                        # then we need to increment it by 1 to avoid repeating the exact same API request,
+                        # which would result in an infinite loop
+                        since_ns += 1
+                    else:
+                        # otherwise, continue from the timestamp of the last trade in the batch
+                        since_ns = last_trade_ns
+            except Exception as e:
+                # hand the error over to the caller, which raises it
+                put(e)
+            finally:
+                put(None)
+
+        Thread(target=fetch_pages, name=f'prefetch-{self.product_id}', daemon=True).start()
+
+        try:
+            while (rows := pages.get()) is not None:
+                if isinstance(rows, Exception):
+                    raise rows
+                yield rows
+        finally:
+            stopped.set()
+
+    def _fetch_page(self, since_ns: int) -> list:
+        """
+        Fetches one page of trades since `since_ns` from the Kraken REST API.
+
+        Args:
+            since_ns (int): The timestamp in nanoseconds after which we want the trades.
+
+        Returns:
+            list: The raw trades in the page, in timestamp order.
         """
-        if not trades:
-            return
+        # Replace the placeholders in the URL with the actual values for
+        # - product_id
+        # - since_ns
+        url = self.URL.format(product_id=self.product_id, since_sec=since_ns)
+        logger.debug(f'{url=}')
+
+        # make the request to the Kraken REST API, within the rate budget and with retries
+        data = self._backoff.run(lambda: self._request(url))
+        rows = data['result'][self.product_id]
 
-        # transform the trades to a pandas DataFrame
-        data = pd.DataFrame([trade.model_dump() for trade in trades])
+        logger.debug(
+            f'Fetched {len(rows)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API'
+        )
 
-        # write the DataFrame to a parquet file
-        file_path = self._get_file_path(url)
-        data.to_parquet(file_path)
+        return rows
 
-    def has(self, url: str) -> bool:
+    def _parse_page(self, rows: list) -> TradeBatch:
         """
-        Returns True if the cache has the trade data for the given url, False otherwise.
+        Turns the raw trades of one page into a batch of trades.
+
+        Args:
+            rows (list): The raw trades, as returned by the Kraken REST API.
+
+        Returns:
+            TradeBatch: The trades in the page, in timestamp order.
         """
-        file_path = self._get_file_path(url)
-        return file_path.exists()
+        # Each trade is a list [price, volume, time, buy/sell, market/limit, miscellaneous, trade_id]
+        # where price and volume are decimal strings and time is in seconds.
+        # We transpose the page into columns and convert each column with one NumPy call,
+        # instead of building one pydantic Trade per row.
+        if not rows:
+            return TradeBatch.empty()
+
+        columns = list(zip(*rows))
+        prices, quantities, times, sides = columns[:4]
+        sides = np.array(sides)
+        return TradeBatch.for_product(
+            product_id=self.product_id,
+            price=np.array(prices, dtype=np.float64),
+            quantity=np.array(quantities, dtype=np.float64),
+            timestamp_ms=(np.array(times, dtype=np.float64) * 1000).astype(np.int64),
+            # 'b' for a buy and 's' for a sell
+            side=(sides == 'b').astype(np.int8) - (sides == 's').astype(np.int8),
+            trade_id=np.array(columns[6], dtype=np.int64) if len(columns) > 6 else None,
+        )
 
-    def _get_file_path(self, url: str) -> str:
+    def _request(self, url: str) -> dict:
         """
-        Returns the file path where the trade data for the given url is (or will be) stored.
+        Makes one request to the Kraken REST API, after taking a token from the rate limiter.
+
+        Args:
+            url (str): The URL to request.
+
+        Returns:
+            dict: The parsed response.
+
+        Raises:
+            RetryableError: If the request failed in a way that is worth retrying.
+            ValueError: If the Kraken REST API returned any other error.
         """
-        # use the given url to generate a unique file name in a deterministic way
-        import hashlib
+        self._rate_limiter.acquire()
 
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return self.cache_dir / f'{url_hash}.parquet'
-        # return self.cache_dir / f'{product_id.replace ("/","-")}_{from_ms}.parquet'
+        # requests.Session is not thread-safe, so we borrow one from the pool
+        session = self._sessions.get()
+        try:
+            response = session.get(url, timeout=REQUEST_TIMEOUT_SEC)
+            # parse string into dictionary
+            data = json.loads(response.text)
+        except (requests.RequestException, ValueError) as e:
+            raise RetryableError(f'Request to {url} failed: {e}')
+        finally:
+            self._sessions.put(session)
+
+        # It can happen that we get an error response from the Kraken REST API like the following:
+        # data = {'error': ['EGeneral:Too many requests']}
+        errors = data.get('error') or []
+        if any(error in RATE_LIMIT_ERRORS for error in errors):
+            # the Kraken counter is full, so we slow down before retrying
+            self._rate_limiter.on_rate_limited()
+            raise RetryableError(f'Rate limited by the Kraken REST API: {errors}')
+        if any(error in TRANSIENT_ERRORS for error in errors):
+            raise RetryableError(f'Kraken REST API is unavailable: {errors}')
+        if errors:
+            raise ValueError(f'Kraken REST API returned an error: {errors}')
+
+        self._rate_limiter.on_success()
+        return data
+
+    def is_done(self) -> bool:
+        return self.last_trade_ms >= self.to_ms
+
+    def position(self) -> int:
+        """
+        Returns `last_trade_ms`: the trades of the shards returned so far are before it.
+        """
+        return self.last_trade_ms
+
+    def commit(self, position: int) -> None:
+        """
+        Checkpoints `position`, now that all the trades before it are in Kafka. The shards
+        still queued for the producer are after it, and are fetched again after a restart.
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.save(position)
 
 
 def ts_to_date(ts: int) -> str:
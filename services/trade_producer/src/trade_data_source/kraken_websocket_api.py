@@ -1,9 +1,11 @@
-from typing import List
-from datetime import datetime, timezone
-from websocket import create_connection
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
+from websocket import create_connection, WebSocket
 from loguru import logger
 import json
-from src.trade_data_source.trade import Trade
+from src.trade_data_source.kraken_decoder import KrakenTradeDecoder, rfc3339_to_ms
+from src.trade_data_source.trade_batch import TradeBatch
 from src.trade_data_source.base import TradeSource
 
 
@@ -19,66 +21,149 @@ from src.trade_data_source.base import TradeSource
 class KrakenWebsocketAPI(TradeSource):
     """
     Class for reading data from Kraken Websocket API
+
+    The product_ids are sharded over `n_sockets` websocket connections, and the frames
+    of all the sockets are merged (fan-in) through one asyncio event loop, so a single
+    process can stream trades for many products.
     """
     URL = 'wss://ws.kraken.com/v2'
 
-    def __init__(self, product_id: str):
+    def __init__(
+        self,
+        product_ids: List[str],
+        n_sockets: int = 1,
+        json_backend: str = 'auto',
+        max_queued_frames: int = 10_000,
+    ):
         """"
         Initializes the KrakenWebsocketAPI instange
         
         Args:
-            product_id (str): The product id to get the trades from
+            product_ids (List[str]): The product ids to get the trades from
+            n_sockets (int): The number of websocket connections the product ids are sharded over
+            json_backend (str): The JSON backend of the frame decoder ('auto', 'orjson' or 'json')
+            max_queued_frames (int): How many raw frames we hold before we stop reading from the sockets
         """
+        self.product_ids = product_ids
+        # Turns the raw frames into batches of trades
+        self._decoder = KrakenTradeDecoder(json_backend=json_backend)
+        # No point in opening more sockets than we have products
+        self.n_sockets = max(1, min(n_sockets, len(product_ids)))
+
+        # The event loop get_trades() runs while it waits for data, so a synchronous
+        # caller does not need one. stream() uses the caller's event loop instead.
+        self._loop = asyncio.new_event_loop()
+        # Raw frames from all the sockets end up in this queue. It is bounded: when we
+        # are not consumed fast enough the readers stop calling recv(), the socket
+        # buffers fill up, and TCP slows Kraken down, instead of our memory growing.
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued_frames)
+        # websocket-client is a blocking library, so each socket gets one thread to
+        # block on recv() while the event loop awaits it
+        self._executor = ThreadPoolExecutor(max_workers=self.n_sockets)
 
-        self.product_id = product_id
+        self._sockets: List[WebSocket] = []
+        for shard in self._shard_product_ids(product_ids, self.n_sockets):
+            # Establish connection to the Kraken Websocket API
+            ws = create_connection(self.URL)
+            logger.debug(f"Connection Established")
 
-        # Establish connection to the Kraken Websocket API
-        self._ws = create_connection(self.URL)
-        logger.debug(f"Connection Established")
+            # Subscribe to the given trades for the given product_ids in this shard
+            self._subscribe(ws, shard)
+            self._sockets.append(ws)
 
-        # Subscribe to the given trades for the given product_id(S)
-        self._subscribe(product_id)
+        # One reader task per socket, all of them feeding the same queue. They start on
+        # the event loop of the first get_trades() or stream().
+        self._readers: Optional[List[asyncio.Task]] = None
 
-    def get_trades(self)->List[Trade]:
+    def get_trades(self)->TradeBatch:
         """
         Returns the latest batch of trades from the Kraken Websocket API
 
         Args:
             None
         Returns:
-            List[Trade]: A list of trades
+            TradeBatch: A batch of trades
         """
-        # Get the data from the websocket
-        message = self._ws.recv()
-        
-        if 'heartbeat' in message:
-            # When we receive a heartbeat, we return an empty list
-            # message that communicates connection is still alive
-            logger.debug('Received heartbeat')
-            return []
-        
-        # Parse the message as dictionary
-        message = json.loads(message)
-        
-        # Extract the data from the message
-        trades = []
-        for trade in message['data']:
-            # EXTRACT THE FOLLOWING FIELDS FROM THE TRADE
-            # -product_id
-            # -quantity
-            # -price
-            # -timestamp_ms
-
-            # We use pydandtic to validate the data
-            trades.append(
-                Trade(
-                    product_id=trade['symbol'],
-                    price=trade['price'],
-                    quantity=trade['qty'],
-                    timestamp_ms=self.to_ms(trade['timestamp']),
-                )
-            )
-        return trades 
+        self._start_readers(self._loop)
+        return self._loop.run_until_complete(self._get_trades())
+
+    async def stream(self) -> AsyncIterator[TradeBatch]:
+        """
+        Yields the batches of trades as they arrive, on the caller's event loop.
+
+        Args:
+            None
+        Returns:
+            AsyncIterator[TradeBatch]: The batches of trades
+        """
+        self._start_readers(asyncio.get_running_loop())
+        while True:
+            yield await self._get_trades()
+
+    def _start_readers(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Starts one reader task per socket on the given event loop, the first time only.
+        """
+        if self._readers is None:
+            self._readers = [loop.create_task(self._read_frames(ws)) for ws in self._sockets]
+
+    async def _get_trades(self) -> TradeBatch:
+        """
+        Waits for at least one frame from any of the sockets, and then drains all the
+        frames that are already queued, so one call returns one batch of trades.
+
+        A reader only stops when its socket fails (e.g. recv() raised because the
+        connection was closed). Its products would then silently stop streaming, so once
+        the frames it queued are returned, we re-raise its exception.
+        """
+        if self._queue.empty():
+            get = asyncio.ensure_future(self._queue.get())
+            await asyncio.wait([get, *self._readers], return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                self._raise_reader_error()
+            messages = [get.result()]
+        else:
+            messages = [self._queue.get_nowait()]
+        while not self._queue.empty():
+            messages.append(self._queue.get_nowait())
+
+        return TradeBatch.concat(
+            [self._parse_trades(message) for message in messages]
+        )
+
+    def _raise_reader_error(self) -> None:
+        """
+        Raises the exception of the first reader that has stopped.
+        """
+        for reader in self._readers:
+            if reader.done():
+                logger.error(f'A websocket reader stopped: {reader.exception()!r}')
+                raise reader.exception() or RuntimeError('A websocket reader stopped')
+
+    async def _read_frames(self, ws: WebSocket):
+        """
+        Reads frames from the given socket forever and puts them in the shared queue.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(self._executor, ws.recv)
+            # Waits while the queue is full, which is what holds the socket back
+            await self._queue.put(message)
+
+    def _parse_trades(self, message: str) -> TradeBatch:
+        """
+        Parses one raw frame into a batch of trades.
+
+        Heartbeats, status messages and subscription confirmations are recognised by
+        the decoder without a full JSON decode, and give an empty batch.
+
+        Args:
+            message (str): The raw frame we got from the websocket
+        Returns:
+            TradeBatch: A batch of trades (empty if the frame has no trades)
+        """
+        return self._decoder.decode(message)
 
     def is_done(self)->bool:
         """
@@ -86,34 +171,45 @@ class KrakenWebsocketAPI(TradeSource):
         """
         # False because we are streaming from a websocket; but if we were doing batches
         # of trades, we would return True when we are done with last batch
-        False
+        return False
     
-    def _subscribe(self, product_id: str):
+    def _subscribe(self, ws: WebSocket, product_ids: List[str]):
         # Everything is public in python; but it is good practice to use _ for private methods; this is not
         # supposed to be called from someone else outside of the class
         """
-        Subscribes to the given product_ids
+        Subscribes the given socket to the trades of the given product_ids
         """
-        logger.info(f'Subscribing to the trades for {product_id}')
+        logger.info(f'Subscribing to the trades for {product_ids}')
         
         # Subscribe to the given product_ids
         msg =  {
             "method": "subscribe",
             "params": {
-                "symbol": [product_id],
+                "symbol": product_ids,
                 "channel": "trade",
                 "snapshot": False,
             },
         }
-        self._ws.send(json.dumps(msg))
+        ws.send(json.dumps(msg))
         logger.info(f'Subscrition worked')
 
-        # For each product_id we dump
-        # the first 2 messages we got from the websocket because they contain
-        # no trade data, just confirmation of subscription
-        for product_id in [product_id]:
-            _ = self._ws.recv()
-            _ = self._ws.recv()
+        # We do not drop a fixed number of frames here. The status message and the
+        # subscription confirmations (one per product_id) are skipped in _parse_trades()
+        # because their channel is not 'trade'.
+
+    @staticmethod
+    def _shard_product_ids(product_ids: List[str], n_shards: int) -> List[List[str]]:
+        """
+        Splits the product_ids into n_shards round-robin, so every shard gets a similar
+        number of products.
+
+        Args:
+            product_ids (List[str]): The product ids to shard
+            n_shards (int): The number of shards
+        Returns:
+            List[List[str]]: One list of product ids per shard
+        """
+        return [product_ids[i::n_shards] for i in range(n_shards)]
     
     # Static method because it does not depend on the instance of the class
     # Decorators are used to modify the behavior of functions or methods
@@ -128,5 +224,4 @@ class KrakenWebsocketAPI(TradeSource):
         """
 
         # Convert the timestamp to Unix timestamp in milliseconds
-        timestamp = datetime.fromisoformat(timestamp[:-1]).replace(tzinfo=timezone.utc)
-        return int(timestamp.timestamp() * 1000)
+        return rfc3339_to_ms(timestamp)
@@ -0,0 +1,172 @@
+import random
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Optional, TypeVar
+
+from loguru import logger
+
+T = TypeVar('T')
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket that follows Kraken's API-counter semantics.
+
+    Kraken keeps a counter per client: every call adds to it, the counter decays at a
+    fixed rate, and calls are rejected once it goes over its maximum. That is a token
+    bucket where `capacity` is the counter maximum and `rate` is the decay rate.
+
+    The bucket is adaptive (AIMD): when Kraken says we are going too fast anyway, the
+    rate is multiplied by `decrease_factor`, and every successful call adds
+    `increase_step` back until we are at `max_rate` again.
+
+    `clock` and `sleep` can be replaced, so the bucket can be driven by a fake clock.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        min_rate: Optional[float] = None,
+        decrease_factor: float = 0.5,
+        increase_step: float = 0.05,
+        clock: Callable[[], float] = monotonic,
+        sleep: Callable[[float], None] = sleep,
+    ) -> None:
+        """
+        Args:
+            rate (float): The number of tokens (requests) added per second.
+            capacity (float): The maximum number of tokens, i.e. the allowed burst.
+            min_rate (Optional[float]): The rate never goes below this value. Defaults to rate / 10.
+            decrease_factor (float): The rate is multiplied by this value when we get rate limited.
+            increase_step (float): The rate grows by this value after each successful call.
+            clock (Callable[[], float]): Returns the current time in seconds.
+            sleep (Callable[[float], None]): Sleeps for the given number of seconds.
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.capacity = capacity
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self._clock = clock
+        self._sleep = sleep
+
+        # the bucket starts full, like a fresh Kraken counter
+        self._tokens = capacity
+        self._last_refill = clock()
+        self._lock = Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        Takes `tokens` from the bucket, sleeping until they are available.
+
+        The tokens are reserved under the lock and the sleep happens outside of it, so
+        concurrent callers queue up one `1 / rate` apart instead of all waking up at once.
+
+        Args:
+            tokens (float): The cost of the call.
+
+        Returns:
+            float: The number of seconds we waited.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            wait_sec = max(0.0, -self._tokens / self.rate)
+
+        if wait_sec > 0:
+            self._sleep(wait_sec)
+        return wait_sec
+
+    def on_success(self) -> None:
+        """
+        Additive increase: moves the rate back towards `max_rate`.
+        """
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_rate_limited(self) -> None:
+        """
+        Multiplicative decrease: the server counter is full, so we empty the bucket and
+        slow down.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0)
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        logger.info(f'Rate limited by the server. Slowing down to {self.rate:.2f} requests/sec')
+
+    def _refill(self) -> None:
+        """
+        Adds the tokens accumulated since the last refill. Must be called under the lock.
+        """
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+class RetryableError(Exception):
+    """
+    Raised by a call that failed in a way that is worth retrying.
+    """
+
+
+class ExponentialBackoff:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time between 0
+    and `min(max_delay_sec, base_delay_sec * 2**n)`, so concurrent workers that failed
+    together do not retry together.
+    """
+
+    def __init__(
+        self,
+        base_delay_sec: float = 1.0,
+        max_delay_sec: float = 60.0,
+        max_retries: int = 8,
+        random: Callable[[], float] = random.random,
+        sleep: Callable[[float], None] = sleep,
+    ) -> None:
+        """
+        Args:
+            base_delay_sec (float): The maximum delay of the first retry.
+            max_delay_sec (float): The maximum delay of any retry.
+            max_retries (int): The number of retries before we give up.
+            random (Callable[[], float]): Returns a random number in [0, 1).
+            sleep (Callable[[float], None]): Sleeps for the given number of seconds.
+        """
+        self.base_delay_sec = base_delay_sec
+        self.max_delay_sec = max_delay_sec
+        self.max_retries = max_retries
+        self._random = random
+        self._sleep = sleep
+
+    def delay(self, attempt: int) -> float:
+        """
+        Returns the number of seconds to wait before the given retry (0-based).
+        """
+        return self._random() * min(self.max_delay_sec, self.base_delay_sec * 2**attempt)
+
+    def run(self, func: Callable[[], T]) -> T:
+        """
+        Calls `func` until it does not raise a `RetryableError`, waiting between attempts.
+
+        Args:
+            func (Callable[[], T]): The call to retry.
+
+        Returns:
+            T: Whatever `func` returns.
+
+        Raises:
+            RetryableError: If `func` still fails after `max_retries` retries.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return func()
+            except RetryableError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay_sec = self.delay(attempt)
+                logger.info(f'{e}. Retrying in {delay_sec:.2f} seconds')
+                self._sleep(delay_sec)
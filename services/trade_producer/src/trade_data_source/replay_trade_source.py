@@ -0,0 +1,130 @@
+from time import monotonic, sleep
+from typing import Callable, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade_archive import DAY_MS, TradeArchive
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class ReplayTradeSource(TradeSource):
+    """
+    Replays the trades in the trade archive, so load tests and debugging sessions do not
+    need the Kraken API.
+
+    The archive is read one UTC day at a time from memory-mapped columns, the trades of
+    all the products are merged in timestamp order, and they are returned in batches of
+    up to `batch_size` trades, either as fast as possible or paced at `speed` times the
+    speed at which they originally happened.
+    """
+
+    def __init__(
+        self,
+        archive_dir: str,
+        product_ids: List[str],
+        from_ms: int,
+        to_ms: int,
+        batch_size: int = 1_000,
+        speed: Optional[float] = None,
+        clock: Callable[[], float] = monotonic,
+        sleep: Callable[[float], None] = sleep,
+    ) -> None:
+        """
+        Args:
+            archive_dir (str): The directory of the trade archive.
+            product_ids (List[str]): The products to replay.
+            from_ms (int): Replay the trades from this timestamp (inclusive).
+            to_ms (int): up to this timestamp (exclusive).
+            batch_size (int): The maximum number of trades returned by get_trades().
+            speed (Optional[float]): None replays at maximum speed, 1.0 in real time and
+                N at N times real time.
+            clock (Callable[[], float]): Returns the current time in seconds.
+            sleep (Callable[[float], None]): Sleeps for the given number of seconds.
+        """
+        self.archive = TradeArchive(archive_dir)
+        self.product_ids = product_ids
+        self.from_ms = from_ms
+        self.to_ms = to_ms
+        self.batch_size = batch_size
+        self.speed = speed
+        self._clock = clock
+        self._sleep = sleep
+
+        # the day we read next from the archive, and what is left of the current one
+        self._next_day_ms = from_ms
+        self._day = TradeBatch.empty()
+        self._position = 0
+
+        # the wall clock time and the trade time the replay started at (for pacing)
+        self._started_at: Optional[float] = None
+        self._first_trade_ms: Optional[int] = None
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next batch of archived trades, in timestamp order.
+
+        Args:
+            None
+
+        Returns:
+            TradeBatch: Up to `batch_size` trades.
+        """
+        if self._position >= len(self._day):
+            self._load_next_day()
+            if len(self._day) == 0:
+                return self._day
+
+        end = min(self._position + self.batch_size, len(self._day))
+
+        if self.speed is not None:
+            end = self._wait_for_replay_time(end)
+
+        trades = self._day[self._position:end]
+        self._position = end
+        return trades
+
+    def is_done(self) -> bool:
+        return self._next_day_ms >= self.to_ms and self._position >= len(self._day)
+
+    def _wait_for_replay_time(self, end: int) -> int:
+        """
+        Sleeps until the next trade is due, and returns where the batch must end so that
+        it only has the trades that are due by now (at most `end`).
+        """
+        timestamps = self._day.timestamp_ms
+        if self._started_at is None:
+            self._started_at = self._clock()
+            self._first_trade_ms = int(timestamps[self._position])
+
+        # sleep until the first trade of the batch is due
+        due_at = self._started_at + (int(timestamps[self._position]) - self._first_trade_ms) / 1000 / self.speed
+        if due_at > self._clock():
+            self._sleep(due_at - self._clock())
+
+        # and return all the trades that are due by now, in one batch, like a burst
+        replay_now_ms = self._first_trade_ms + (self._clock() - self._started_at) * 1000 * self.speed
+        return self._position + max(
+            1, int(np.searchsorted(timestamps[self._position:end], replay_now_ms, side='right'))
+        )
+
+    def _load_next_day(self) -> None:
+        """
+        Reads the next UTC day of trades of all the products and merges them in timestamp
+        order.
+        """
+        day_from_ms = self._next_day_ms
+        day_to_ms = min((day_from_ms // DAY_MS + 1) * DAY_MS, self.to_ms)
+        self._next_day_ms = day_to_ms
+
+        day = TradeBatch.concat([
+            self.archive.read(product_id, day_from_ms, day_to_ms)
+            for product_id in self.product_ids
+        ])
+        if len(self.product_ids) > 1:
+            day = day[np.argsort(day.timestamp_ms, kind='stable')]
+
+        logger.debug(f'Replaying {len(day)} trades from {day_from_ms} to {day_to_ms}')
+        self._day = day
+        self._position = 0
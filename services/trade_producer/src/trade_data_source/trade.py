@@ -4,4 +4,8 @@ class Trade(BaseModel):
     product_id: str
     quantity: float
     price: float
-    timestamp_ms: int
\ No newline at end of file
+    timestamp_ms: int
+    # The taker side: 1 for a buy, -1 for a sell, 0 if we do not know it
+    side: int = 0
+    # The ID the exchange gave the trade, 0 if the source has none
+    trade_id: int = 0
\ No newline at end of file
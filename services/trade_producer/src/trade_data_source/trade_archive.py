@@ -0,0 +1,225 @@
+import json
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Tuple
+
+import numpy as np
+from loguru import logger
+from trade_archive_layout import (
+    COLUMNS,
+    DAY_MS,
+    MANIFEST_NAME,
+    day_starts,
+    get_day_dir,
+    get_product_dir,
+    read_day,
+)
+
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class TradeArchive:
+    """
+    A per-product archive of historical trades, partitioned by UTC day.
+
+    The layout on disk (one file per column and per day, and a manifest per product) is
+    shared with the batch mode of trade_to_ohlc, see `trade_archive_layout`. The manifest
+    holds the `[from_ms, to_ms)` ranges we have fully fetched, so the caller only has to
+    fetch the ranges that are missing, no matter when the service is restarted.
+    """
+
+    def __init__(self, archive_dir: str) -> None:
+        self.archive_dir = Path(archive_dir)
+
+        if not self.archive_dir.exists():
+            # create the archive directory if it does not exist
+            self.archive_dir.mkdir(parents=True)
+
+        # several workers can write to the archive of the same product at the same time
+        self._lock = Lock()
+
+    def missing_ranges(
+        self, product_id: str, from_ms: int, to_ms: int
+    ) -> List[Tuple[int, int]]:
+        """
+        Returns the parts of `[from_ms, to_ms)` that are not in the archive yet.
+
+        Args:
+            product_id (str): The product ID.
+            from_ms (int): The start of the time range in milliseconds.
+            to_ms (int): The end of the time range in milliseconds.
+
+        Returns:
+            List[Tuple[int, int]]: The missing `[from_ms, to_ms)` ranges, in order.
+        """
+        missing = []
+        cursor_ms = from_ms
+        for covered_from_ms, covered_to_ms in self._read_manifest(product_id):
+            if covered_to_ms <= cursor_ms:
+                continue
+            if covered_from_ms >= to_ms:
+                break
+            if covered_from_ms > cursor_ms:
+                missing.append((cursor_ms, covered_from_ms))
+            cursor_ms = max(cursor_ms, covered_to_ms)
+
+        if cursor_ms < to_ms:
+            missing.append((cursor_ms, to_ms))
+
+        return missing
+
+    def read(self, product_id: str, from_ms: int, to_ms: int) -> TradeBatch:
+        """
+        Reads from the archive the trades in `[from_ms, to_ms)`.
+
+        Args:
+            product_id (str): The product ID.
+            from_ms (int): The start of the time range in milliseconds.
+            to_ms (int): The end of the time range in milliseconds.
+
+        Returns:
+            TradeBatch: The trades in the time range, in timestamp order.
+        """
+        chunks: Dict[str, List[np.ndarray]] = {name: [] for name in COLUMNS}
+
+        for day_from_ms in day_starts(from_ms, to_ms):
+            day = self._read_day(product_id, day_from_ms)
+            if day is None:
+                continue
+
+            # the days are sorted by timestamp, so we can binary search the range
+            start, end = np.searchsorted(day['timestamp_ms'], [from_ms, to_ms])
+            for name in COLUMNS:
+                chunks[name].append(day[name][start:end])
+
+        columns = {
+            name: self._concatenate(chunks[name], dtype) for name, dtype in COLUMNS.items()
+        }
+        return TradeBatch.for_product(product_id, **columns)
+
+    @staticmethod
+    def _concatenate(chunks: List[np.ndarray], dtype) -> np.ndarray:
+        """
+        Concatenates the chunks of one column. A range inside one day stays a view of the
+        memory-mapped file, without a copy.
+        """
+        if not chunks:
+            return np.empty(0, dtype)
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks)
+
+    def write(
+        self, product_id: str, trades: TradeBatch, from_ms: int, to_ms: int
+    ) -> None:
+        """
+        Saves the given trades to the archive and marks `[from_ms, to_ms)` as covered.
+
+        The trades must be all the trades in `[from_ms, to_ms)`, because the next time
+        we need this range we will not ask the Kraken REST API for it.
+
+        Args:
+            product_id (str): The product ID.
+            trades (TradeBatch): All the trades in the time range.
+            from_ms (int): The start of the time range in milliseconds.
+            to_ms (int): The end of the time range in milliseconds.
+        """
+        columns = {name: getattr(trades, name) for name in COLUMNS}
+        order = np.argsort(columns['timestamp_ms'], kind='stable')
+        columns = {name: column[order] for name, column in columns.items()}
+
+        with self._lock:
+            for day_from_ms in day_starts(from_ms, to_ms):
+                start, end = np.searchsorted(
+                    columns['timestamp_ms'], [day_from_ms, day_from_ms + DAY_MS]
+                )
+                if start == end:
+                    continue
+                self._append_to_day(
+                    product_id,
+                    day_from_ms,
+                    {name: column[start:end] for name, column in columns.items()},
+                )
+
+            # only now that the data is on disk we mark the range as covered
+            self._add_to_manifest(product_id, from_ms, to_ms)
+
+        logger.debug(
+            f'Archived {len(trades)} trades for {product_id} between {from_ms} and {to_ms}'
+        )
+
+    def _append_to_day(
+        self, product_id: str, day_from_ms: int, columns: Dict[str, np.ndarray]
+    ) -> None:
+        """
+        Merges the given columns into the files of the given day, keeping them sorted by
+        timestamp. Must be called under the lock.
+        """
+        day = self._read_day(product_id, day_from_ms)
+        if day is not None:
+            # load the existing data into memory, because we overwrite the files below
+            columns = {
+                name: np.concatenate([np.asarray(day[name]), columns[name]])
+                for name in COLUMNS
+            }
+            order = np.argsort(columns['timestamp_ms'], kind='stable')
+            columns = {name: column[order] for name, column in columns.items()}
+
+        day_dir = self._get_day_dir(product_id, day_from_ms)
+        day_dir.mkdir(parents=True, exist_ok=True)
+        for name, dtype in COLUMNS.items():
+            # write to a temporary file and rename it, so readers never see half a file
+            tmp_path = day_dir / f'{name}.tmp.npy'
+            np.save(tmp_path, columns[name].astype(dtype, copy=False))
+            os.replace(tmp_path, day_dir / f'{name}.npy')
+
+    def _read_day(self, product_id: str, day_from_ms: int):
+        """
+        Returns the memory-mapped columns of the given day, or None if we have no data.
+        """
+        return read_day(self.archive_dir, product_id, day_from_ms)
+
+    def _read_manifest(self, product_id: str) -> List[Tuple[int, int]]:
+        """
+        Returns the sorted, non-overlapping `[from_ms, to_ms)` ranges in the archive.
+        """
+        manifest_path = self._get_product_dir(product_id) / MANIFEST_NAME
+        if not manifest_path.exists():
+            return []
+
+        with open(manifest_path) as f:
+            return [tuple(covered) for covered in json.load(f)['covered_ranges']]
+
+    def _add_to_manifest(self, product_id: str, from_ms: int, to_ms: int) -> None:
+        """
+        Adds `[from_ms, to_ms)` to the covered ranges, merging the ranges that touch.
+        Must be called under the lock.
+        """
+        ranges = sorted(self._read_manifest(product_id) + [(from_ms, to_ms)])
+
+        merged = [list(ranges[0])]
+        for covered_from_ms, covered_to_ms in ranges[1:]:
+            if covered_from_ms <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], covered_to_ms)
+            else:
+                merged.append([covered_from_ms, covered_to_ms])
+
+        product_dir = self._get_product_dir(product_id)
+        product_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = product_dir / f'{MANIFEST_NAME}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'covered_ranges': merged}, f)
+        os.replace(tmp_path, product_dir / MANIFEST_NAME)
+
+    def _get_product_dir(self, product_id: str) -> Path:
+        """
+        Returns the directory of the given product ('BTC/EUR' -> 'BTC-EUR').
+        """
+        return get_product_dir(self.archive_dir, product_id)
+
+    def _get_day_dir(self, product_id: str, day_from_ms: int) -> Path:
+        """
+        Returns the directory of the given UTC day of the given product.
+        """
+        return get_day_dir(self.archive_dir, product_id, day_from_ms)
@@ -0,0 +1,268 @@
+import sys
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from src.trade_data_source.trade import Trade
+
+
+class TradeBatch:
+    """
+    An array-backed batch of trades.
+
+    Instead of one pydantic `Trade` per trade, a batch keeps one NumPy array per field,
+    and it is validated once for the whole batch. The product_ids are interned, so a
+    batch of trades of the same product holds many references to one string.
+    """
+
+    __slots__ = ('product_id', 'price', 'quantity', 'timestamp_ms', 'side', 'trade_id')
+
+    def __init__(
+        self,
+        product_id: np.ndarray,
+        price: np.ndarray,
+        quantity: np.ndarray,
+        timestamp_ms: np.ndarray,
+        side: Optional[np.ndarray] = None,
+        trade_id: Optional[np.ndarray] = None,
+        validate: bool = True,
+    ) -> None:
+        """
+        Args:
+            product_id (np.ndarray): The product ID of each trade (object array of str).
+            price (np.ndarray): The price of each trade.
+            quantity (np.ndarray): The quantity of each trade.
+            timestamp_ms (np.ndarray): The Unix timestamp of each trade in milliseconds.
+            side (Optional[np.ndarray]): The taker side of each trade (1 buy, -1 sell, 0
+                unknown). Unknown for all the trades if None.
+            trade_id (Optional[np.ndarray]): The exchange ID of each trade (0 if it has
+                none). None for all the trades if None.
+            validate (bool): Whether to validate the batch. Only skip it for data that
+                comes from a validated batch (e.g. a slice of one).
+        """
+        self.product_id = product_id
+        # integer prices and quantities are fixed-point (see FixedPointDecimals) and stay integers
+        self.price = self._as_number_column(price)
+        self.quantity = self._as_number_column(quantity)
+        self.timestamp_ms = np.asarray(timestamp_ms, dtype=np.int64)
+        self.side = (
+            np.zeros(len(self.timestamp_ms), dtype=np.int8) if side is None else np.asarray(side, dtype=np.int8)
+        )
+        self.trade_id = (
+            np.zeros(len(self.timestamp_ms), dtype=np.int64) if trade_id is None else np.asarray(trade_id, dtype=np.int64)
+        )
+
+        if validate:
+            self.validate()
+
+    @staticmethod
+    def _as_number_column(values: Union[np.ndarray, Sequence]) -> np.ndarray:
+        """
+        Returns the values as a float64 array, unless they already are an int64 array.
+
+        Only int64 arrays are taken as fixed-point: a list of numbers that happen to be
+        whole (e.g. decoded from JSON) is still a list of floats.
+        """
+        if isinstance(values, np.ndarray) and values.dtype == np.int64:
+            return values
+        return np.asarray(values, dtype=np.float64)
+
+    @property
+    def is_fixed_point(self) -> bool:
+        """
+        True if the prices and quantities are fixed-point integers.
+        """
+        return self.price.dtype.kind == 'i'
+
+    @classmethod
+    def for_product(
+        cls,
+        product_id: str,
+        price: Union[np.ndarray, Sequence],
+        quantity: Union[np.ndarray, Sequence],
+        timestamp_ms: Union[np.ndarray, Sequence],
+        side: Optional[Union[np.ndarray, Sequence]] = None,
+        trade_id: Optional[Union[np.ndarray, Sequence]] = None,
+    ) -> 'TradeBatch':
+        """
+        Returns a batch of trades that all belong to the given product.
+        """
+        return cls(
+            product_id=np.full(len(timestamp_ms), sys.intern(product_id), dtype=object),
+            price=price,
+            quantity=quantity,
+            timestamp_ms=timestamp_ms,
+            side=side,
+            trade_id=trade_id,
+        )
+
+    @classmethod
+    def from_columns(
+        cls,
+        product_id: Sequence[str],
+        price: Sequence,
+        quantity: Sequence,
+        timestamp_ms: Sequence,
+        side: Optional[Sequence] = None,
+        trade_id: Optional[Sequence] = None,
+    ) -> 'TradeBatch':
+        """
+        Returns a batch of trades from plain Python lists, one per field.
+        """
+        product_ids = np.empty(len(product_id), dtype=object)
+        product_ids[:] = [sys.intern(p) for p in product_id]
+        return cls(
+            product_id=product_ids,
+            price=price,
+            quantity=quantity,
+            timestamp_ms=timestamp_ms,
+            side=side,
+            trade_id=trade_id,
+        )
+
+    @classmethod
+    def from_trades(cls, trades: List[Trade]) -> 'TradeBatch':
+        """
+        Returns a batch with the given pydantic trades.
+        """
+        return cls.from_columns(
+            product_id=[trade.product_id for trade in trades],
+            price=[trade.price for trade in trades],
+            quantity=[trade.quantity for trade in trades],
+            timestamp_ms=[trade.timestamp_ms for trade in trades],
+            side=[trade.side for trade in trades],
+            trade_id=[trade.trade_id for trade in trades],
+        )
+
+    @classmethod
+    def empty(cls) -> 'TradeBatch':
+        """
+        Returns a batch with no trades.
+        """
+        return cls(
+            product_id=np.empty(0, dtype=object),
+            price=np.empty(0),
+            quantity=np.empty(0),
+            timestamp_ms=np.empty(0, dtype=np.int64),
+            side=np.empty(0, dtype=np.int8),
+            trade_id=np.empty(0, dtype=np.int64),
+            validate=False,
+        )
+
+    @classmethod
+    def concat(cls, batches: List['TradeBatch']) -> 'TradeBatch':
+        """
+        Returns one batch with the trades of all the given batches, in order.
+        """
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+
+        return cls(
+            product_id=np.concatenate([b.product_id for b in batches]),
+            price=np.concatenate([b.price for b in batches]),
+            quantity=np.concatenate([b.quantity for b in batches]),
+            timestamp_ms=np.concatenate([b.timestamp_ms for b in batches]),
+            side=np.concatenate([b.side for b in batches]),
+            trade_id=np.concatenate([b.trade_id for b in batches]),
+            validate=False,
+        )
+
+    def validate(self) -> None:
+        """
+        Checks the whole batch at once, the vectorized version of the pydantic validation.
+
+        Raises:
+            ValueError: If the columns have different lengths, the trades of a product
+                are not in timestamp order, or some trades have a non-finite or
+                non-positive price, a non-finite or negative quantity, a non-positive
+                timestamp, an invalid side or a negative trade ID.
+        """
+        n_trades = len(self.timestamp_ms)
+        if not (
+            len(self.product_id) == len(self.price) == len(self.quantity) == len(self.side) == len(self.trade_id) == n_trades
+        ):
+            raise ValueError('All the columns of a TradeBatch must have the same length')
+
+        invalid = (
+            ~np.isfinite(self.price)
+            | (self.price <= 0)
+            | ~np.isfinite(self.quantity)
+            | (self.quantity < 0)
+            | (self.timestamp_ms <= 0)
+            | (np.abs(self.side) > 1)
+            | (self.trade_id < 0)
+        )
+        if invalid.any():
+            first = int(np.argmax(invalid))
+            raise ValueError(
+                f'{int(invalid.sum())} invalid trades in the batch, the first one is {self[first:first + 1].to_dicts()[0]}'
+            )
+
+        if not self._is_sorted_by_product():
+            raise ValueError('The trades of each product in a TradeBatch must be in timestamp order')
+
+    def _is_sorted_by_product(self) -> bool:
+        """
+        True if the trades of each product are in timestamp order.
+
+        The trades of different products may interleave in any order (e.g. when several
+        websockets are fanned in), so we only sort by product when the batch is not
+        already in timestamp order as a whole, which is the common case.
+        """
+        if len(self.timestamp_ms) < 2 or (np.diff(self.timestamp_ms) >= 0).all():
+            return True
+
+        order = np.argsort(self.product_id, kind='stable')
+        same_product = self.product_id[order][1:] == self.product_id[order][:-1]
+        return bool((np.diff(self.timestamp_ms[order])[same_product] >= 0).all())
+
+    def to_dicts(self) -> List[Dict]:
+        """
+        Returns the trades as plain dictionaries, with the same fields as `Trade.model_dump()`.
+        """
+        return [
+            {
+                'product_id': product_id,
+                'quantity': quantity,
+                'price': price,
+                'timestamp_ms': timestamp_ms,
+                'side': side,
+                'trade_id': trade_id,
+            }
+            for product_id, quantity, price, timestamp_ms, side, trade_id in zip(
+                self.product_id.tolist(),
+                self.quantity.tolist(),
+                self.price.tolist(),
+                self.timestamp_ms.tolist(),
+                self.side.tolist(),
+                self.trade_id.tolist(),
+            )
+        ]
+
+    def to_trades(self) -> List[Trade]:
+        """
+        Returns the trades as pydantic `Trade` objects.
+        """
+        return [Trade(**trade) for trade in self.to_dicts()]
+
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+    def __getitem__(self, index: Union[slice, np.ndarray]) -> 'TradeBatch':
+        """
+        Returns the trades selected by a slice or a boolean mask, as a new batch.
+        """
+        return TradeBatch(
+            product_id=self.product_id[index],
+            price=self.price[index],
+            quantity=self.quantity[index],
+            timestamp_ms=self.timestamp_ms[index],
+            side=self.side[index],
+            trade_id=self.trade_id[index],
+            validate=False,
+        )
+
+    def __repr__(self) -> str:
+        return f'TradeBatch(n_trades={len(self)})'
@@ -0,0 +1,147 @@
+from typing import List, Set, Union
+
+import numpy as np
+from loguru import logger
+
+from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class TradeDeduplicator:
+    """
+    Drops the trades we have already seen, in bounded memory.
+
+    A trade is identified by its fingerprint, the hash of (product_id, trade_id). The
+    sources without trade IDs (trade_id 0) fall back to the hash of (product_id,
+    timestamp_ms, price, quantity). The fingerprints are kept in a ring
+    of `n_buckets` buckets of `window_ms / n_buckets` milliseconds of trade time each.
+    A duplicate has the same timestamp as the original, so it lands in the same bucket,
+    and checking a trade is one set lookup. When trade time moves past the window, the
+    oldest bucket is cleared and reused.
+
+    The memory is capped: each bucket keeps at most `max_trades / n_buckets`
+    fingerprints (roughly 70 bytes each). The trades that do not fit, and the trades
+    older than the window, are let through unchecked and counted.
+
+    Without trade IDs, two genuine trades with the same timestamp, price and quantity (a
+    market order sweeping the book, say) are indistinguishable from a duplicate, and the
+    second one is dropped. Both Kraken sources have trade IDs, the fallback is for the
+    other sources (e.g. the days archived before we kept the IDs).
+    """
+
+    def __init__(self, window_ms: int, max_trades: int = 1_000_000, n_buckets: int = 60) -> None:
+        """
+        Args:
+            window_ms (int): How far back in trade time we look for duplicates.
+            max_trades (int): The maximum number of fingerprints we keep.
+            n_buckets (int): The number of buckets in the ring.
+        """
+        self.window_ms = window_ms
+        self.n_buckets = n_buckets
+        self.bucket_ms = max(1, -(-window_ms // n_buckets))
+        self.max_per_bucket = max(1, max_trades // n_buckets)
+
+        # the fingerprints of each bucket and the epoch (timestamp_ms // bucket_ms) they belong to
+        self._buckets: List[Set[int]] = [set() for _ in range(n_buckets)]
+        self._epochs: List[int] = [-1] * n_buckets
+        self._latest_epoch = -1
+
+        # the counters we report
+        self.n_trades = 0
+        self.n_duplicates = 0
+        self.n_unchecked = 0
+
+    def filter(self, trades: Union[List[Trade], TradeBatch]) -> Union[List[Trade], TradeBatch]:
+        """
+        Returns the trades we have not seen before, in their original order.
+
+        Args:
+            trades (Union[List[Trade], TradeBatch]): The trades to check.
+
+        Returns:
+            Union[List[Trade], TradeBatch]: The same type, without the duplicates.
+        """
+        if isinstance(trades, TradeBatch):
+            keep = self._check(
+                trades.product_id.tolist(),
+                trades.timestamp_ms.tolist(),
+                trades.price.tolist(),
+                trades.quantity.tolist(),
+                trades.trade_id.tolist(),
+            )
+            return trades if all(keep) else trades[np.array(keep, dtype=bool)]
+
+        keep = self._check(
+            [trade.product_id for trade in trades],
+            [trade.timestamp_ms for trade in trades],
+            [trade.price for trade in trades],
+            [trade.quantity for trade in trades],
+            [trade.trade_id for trade in trades],
+        )
+        return [trade for trade, new in zip(trades, keep) if new]
+
+    def _check(
+        self,
+        product_ids: List[str],
+        timestamps_ms: List[int],
+        prices: List[float],
+        quantities: List[float],
+        trade_ids: List[int],
+    ) -> List[bool]:
+        """
+        Returns, for each trade, whether it is new, and remembers the new ones.
+        """
+        keep = []
+        buckets, epochs = self._buckets, self._epochs
+        for product_id, timestamp_ms, price, quantity, trade_id in zip(
+            product_ids, timestamps_ms, prices, quantities, trade_ids
+        ):
+            epoch = timestamp_ms // self.bucket_ms
+            index = epoch % self.n_buckets
+
+            if epoch <= self._latest_epoch - self.n_buckets:
+                # older than the window, we cannot tell
+                self.n_unchecked += 1
+                keep.append(True)
+                continue
+
+            if epochs[index] != epoch:
+                # the ring moves forward: the bucket now holds this epoch
+                buckets[index].clear()
+                epochs[index] = epoch
+                self._latest_epoch = max(self._latest_epoch, epoch)
+
+            fingerprint = hash(
+                (product_id, trade_id) if trade_id else (product_id, timestamp_ms, price, quantity)
+            )
+            bucket = buckets[index]
+            if fingerprint in bucket:
+                self.n_duplicates += 1
+                keep.append(False)
+                continue
+
+            if len(bucket) < self.max_per_bucket:
+                bucket.add(fingerprint)
+            else:
+                # the bucket is full, the trade goes through but we do not remember it
+                self.n_unchecked += 1
+            keep.append(True)
+
+        self.n_trades += len(keep)
+        return keep
+
+    @property
+    def duplicate_rate(self) -> float:
+        """
+        Returns the fraction of the trades we have checked that were duplicates.
+        """
+        return self.n_duplicates / self.n_trades if self.n_trades else 0.0
+
+    def log_stats(self) -> None:
+        """
+        Logs how many duplicates we dropped so far.
+        """
+        logger.info(
+            f'Dropped {self.n_duplicates:,} duplicates out of {self.n_trades:,} trades '
+            f'({self.duplicate_rate:.2%}), {self.n_unchecked:,} trades could not be checked'
+        )
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import time
+
+from quixstreams.models import Topic
+
+from src.main import produce_from_stream
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class SlowProducer:
+    """
+    A stand-in for the Kafka producer that takes its time to flush, so the source reads
+    ahead and the queue fills up. A message is delivered once it is flushed.
+    """
+
+    def __init__(self) -> None:
+        self.pending = []
+        self.delivered_ms = set()
+
+    def produce(self, topic, value, key) -> None:
+        self.pending.append(json.loads(value)['timestamp_ms'])
+
+    def flush(self) -> int:
+        time.sleep(0.02)
+        self.delivered_ms.update(self.pending)
+        self.pending = []
+        return 0
+
+
+def test_the_checkpoint_never_runs_ahead_of_the_delivered_trades(tmp_path):
+    source = KrakenRestAPI(product_id='XBTEUR', last_n_days=10, n_workers=4, checkpoint_dir=str(tmp_path))
+    # two trades per day shard, without calling the API
+    source._fetch_shard = lambda from_ms, to_ms: TradeBatch.for_product(
+        'XBTEUR', price=[10.0, 11.0], quantity=[1.0, 1.0], timestamp_ms=[from_ms, to_ms - 1]
+    )
+    producer = SlowProducer()
+    produced_ms = [ms for shard in source._shards for ms in (shard[0], shard[1] - 1)]
+
+    checkpoints = []
+    save = source.checkpoint.save
+
+    def checked_save(last_trade_ms: int) -> None:
+        # every trade before the checkpoint is in Kafka
+        assert all(ms in producer.delivered_ms for ms in produced_ms if ms < last_trade_ms)
+        # and the source has already read further than that
+        checkpoints.append((last_trade_ms, source.last_trade_ms))
+        save(last_trade_ms)
+
+    source.checkpoint.save = checked_save
+
+    n_trades = asyncio.run(
+        produce_from_stream(producer, Topic(name='trade', value_serializer='json'), source, max_queued_batches=4)
+    )
+
+    assert n_trades == len(produced_ms) == 20
+    assert any(checkpoint_ms < source_ms for checkpoint_ms, source_ms in checkpoints)
+    assert source.checkpoint.load() == source.to_ms
+
+
+class ListSource(TradeSource):
+    """
+    Returns one trade per batch, with its index as the position, and records the commits.
+    """
+
+    def __init__(self, n_batches: int) -> None:
+        self.n_batches = n_batches
+        self.n_returned = 0
+        self.commits = []
+
+    def get_trades(self) -> TradeBatch:
+        self.n_returned += 1
+        return TradeBatch.for_product('XBTEUR', price=[10.0], quantity=[1.0], timestamp_ms=[self.n_returned])
+
+    def is_done(self) -> bool:
+        return self.n_returned >= self.n_batches
+
+    def position(self) -> int:
+        return self.n_returned
+
+    def commit(self, position: int) -> None:
+        self.commits.append(position)
+
+
+class LossyProducer(SlowProducer):
+    """
+    Fails to deliver the messages of the given flush (counting from 1).
+    """
+
+    def __init__(self, failing_flush: int) -> None:
+        super().__init__()
+        self.failing_flush = failing_flush
+        self.n_flushes = 0
+
+    def flush(self) -> int:
+        self.n_flushes += 1
+        if self.n_flushes == self.failing_flush:
+            n_undelivered, self.pending = len(self.pending), []
+            return n_undelivered
+        return super().flush()
+
+
+def test_the_checkpoint_stops_at_undelivered_trades():
+    source = ListSource(n_batches=4)
+    producer = LossyProducer(failing_flush=2)
+
+    asyncio.run(produce_from_stream(producer, Topic(name='trade', value_serializer='json'), source, max_queued_batches=1))
+
+    # the later batches were delivered, but committing them would skip the lost one
+    assert source.commits == [1]
+    assert producer.delivered_ms == {1, 3, 4}
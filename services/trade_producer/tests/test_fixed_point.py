@@ -0,0 +1,142 @@
+import pytest
+
+from kafka_serialization import (
+    CANDLE_NOTIONAL_FIELDS,
+    CANDLE_PRICE_FIELDS,
+    CANDLE_QUANTITY_FIELDS,
+    FIXED_POINT_CANDLE_CODEC,
+    FIXED_POINT_TRADE_CODEC,
+    AutoDeserializer,
+    FixedPointDecimals,
+)
+from src.main import to_fixed_point
+from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
+
+DECIMALS = FixedPointDecimals({'BTC/EUR': (1, 8), 'XRP/EUR': (5, 8)})
+# the Confluent wire format framing: magic byte, schema ID 1 and message index 0
+HEADER = b'\x00' + (1).to_bytes(4, 'big') + b'\x00'
+
+
+def make_trades(product_id, price, quantity) -> TradeBatch:
+    return TradeBatch.from_columns(
+        product_id=product_id,
+        price=price,
+        quantity=quantity,
+        timestamp_ms=list(range(1_000, 1_000 + len(price))),
+        side=[1, -1, 0][:len(price)],
+        trade_id=list(range(7, 7 + len(price))),
+    )
+
+
+def test_decimal_prices_and_quantities_become_their_exact_units():
+    # floats parsed from Kraken's decimal strings, none of them exact in binary
+    trades = make_trades(
+        ['BTC/EUR'] * 3,
+        [float('60123.4'), float('0.3'), float('59999.9')],
+        [float('0.00012345'), float('0.1'), float('1.23456789')],
+    )
+
+    fixed = to_fixed_point(trades, DECIMALS)
+
+    assert fixed.is_fixed_point
+    assert fixed.price.tolist() == [601234, 3, 599999]
+    assert fixed.quantity.tolist() == [12345, 10_000_000, 123456789]
+
+
+def test_each_product_is_scaled_with_its_own_decimals():
+    trades = make_trades(['BTC/EUR', 'XRP/EUR', 'BTC/EUR'], [60123.4, 0.52341, 60123.5], [0.5, 250.0, 0.25])
+
+    fixed = to_fixed_point(trades, DECIMALS)
+
+    assert fixed.price.tolist() == [601234, 52341, 601235]
+    assert fixed.quantity.tolist() == [50_000_000, 25_000_000_000, 25_000_000]
+
+
+def test_values_with_more_decimals_are_rounded_to_the_nearest_unit():
+    trades = make_trades(['BTC/EUR'] * 2, [60123.46, 60123.44], [0.000000014, 0.000000016])
+
+    fixed = to_fixed_point(trades, DECIMALS)
+
+    assert fixed.price.tolist() == [601235, 601234]
+    assert fixed.quantity.tolist() == [1, 2]
+
+
+def test_the_other_fields_are_kept():
+    trades = make_trades(['BTC/EUR', 'XRP/EUR', 'BTC/EUR'], [60123.4, 0.52341, 60123.5], [0.5, 250.0, 0.25])
+
+    fixed = to_fixed_point(trades, DECIMALS)
+
+    for name in ('product_id', 'timestamp_ms', 'side', 'trade_id'):
+        assert getattr(fixed, name).tolist() == getattr(trades, name).tolist()
+
+
+def test_pydantic_trades_are_converted_too():
+    trades = [Trade(product_id='BTC/EUR', price=60123.4, quantity=0.5, timestamp_ms=1_000)]
+
+    assert to_fixed_point(trades, DECIMALS).price.tolist() == [601234]
+
+
+def test_fixed_point_and_empty_batches_are_returned_as_they_are():
+    fixed = to_fixed_point(make_trades(['BTC/EUR'], [60123.4], [0.5]), DECIMALS)
+    empty = TradeBatch.empty()
+
+    assert to_fixed_point(fixed, DECIMALS) is fixed
+    assert to_fixed_point(empty, DECIMALS) is empty
+
+
+def test_a_product_without_decimals_is_an_error():
+    with pytest.raises(ValueError, match='ETH/EUR'):
+        to_fixed_point(make_trades(['ETH/EUR'], [2_500.0], [1.0]), DECIMALS)
+
+
+def test_a_price_that_rounds_to_zero_units_is_rejected():
+    with pytest.raises(ValueError, match='invalid trades'):
+        to_fixed_point(make_trades(['BTC/EUR'], [0.04], [1.0]), DECIMALS)
+
+
+def test_the_fixed_point_trades_decode_back_to_the_same_floats():
+    trades = make_trades(['BTC/EUR', 'XRP/EUR', 'BTC/EUR'], [60123.4, 0.52341, 0.1], [0.00012345, 250.0, 0.3])
+    fixed = to_fixed_point(trades, DECIMALS)
+
+    messages = FIXED_POINT_TRADE_CODEC.encode_columns({
+        'product_id': fixed.product_id.tolist(),
+        'quantity': fixed.quantity.tolist(),
+        'price': fixed.price.tolist(),
+        'timestamp_ms': fixed.timestamp_ms.tolist(),
+        'side': fixed.side.tolist(),
+        'trade_id': fixed.trade_id.tolist(),
+    }, HEADER)
+    columns = DECIMALS.to_float_columns(
+        AutoDeserializer(FIXED_POINT_TRADE_CODEC).deserialize_columns(messages), ['price'], ['quantity']
+    )
+
+    assert columns['price'] == trades.price.tolist()
+    assert columns['quantity'] == trades.quantity.tolist()
+
+
+def test_the_candles_of_fixed_point_trades_decode_to_the_exact_decimal_sums():
+    # 0.1 + 0.2 is not 0.3 in floats, but 10_000_000 + 20_000_000 lots are
+    trades = to_fixed_point(make_trades(['BTC/EUR'] * 2, [60123.4, 60123.6], [0.1, 0.2]), DECIMALS)
+    price, quantity = trades.price.tolist(), trades.quantity.tolist()
+    notional = sum(p * q for p, q in zip(price, quantity))
+    candle = FIXED_POINT_CANDLE_CODEC.encode({
+        'product_id': 'BTC/EUR', 'timestamp_ms': 2_000,
+        'open': price[0], 'high': max(price), 'low': min(price), 'close': price[-1],
+        'volume': sum(quantity), 'vwap': notional / sum(quantity), 'trade_count': 2,
+        'buy_volume': quantity[0], 'sell_volume': quantity[1], 'notional': float(notional),
+    }, HEADER)
+
+    # what topic_to_feature_store does before it pushes the candles to the feature store
+    columns = DECIMALS.to_float_columns(
+        AutoDeserializer(FIXED_POINT_CANDLE_CODEC).deserialize_columns([candle]),
+        CANDLE_PRICE_FIELDS,
+        CANDLE_QUANTITY_FIELDS,
+        CANDLE_NOTIONAL_FIELDS,
+    )
+
+    assert columns['open'] == [60123.4]
+    assert columns['high'] == [60123.6]
+    assert columns['volume'] == [0.3]
+    assert columns['vwap'] == [pytest.approx((60123.4 * 0.1 + 60123.6 * 0.2) / 0.3)]
+    assert columns['notional'] == [pytest.approx(60123.4 * 0.1 + 60123.6 * 0.2)]
@@ -0,0 +1,100 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.trade_data_source.kraken_decoder import _date_to_ms, classify_frame, rfc3339_to_ms
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def expected_ms(timestamp: str) -> int:
+    """
+    The reference conversion, with exact integer arithmetic and the fraction truncated
+    to milliseconds like Kraken's.
+    """
+    return (datetime.fromisoformat(timestamp.replace('Z', '+00:00')) - EPOCH) // timedelta(milliseconds=1)
+
+
+@pytest.mark.parametrize('date', [
+    '1970-01-01',
+    '1999-12-31',
+    '2000-01-01',
+    '2000-02-29',
+    '2000-03-01',
+    '2023-02-28',
+    '2023-03-01',
+    '2024-02-29',
+    '2024-03-01',
+    '2024-12-31',
+    '2025-01-01',
+    '2100-02-28',
+    '2100-03-01',
+])
+def test_dates_are_converted_like_datetime(date):
+    assert _date_to_ms(date) == expected_ms(f'{date}T00:00:00Z')
+
+
+def test_every_day_of_a_leap_and_a_common_year_is_converted_like_datetime():
+    day = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    while day.year < 2025:
+        assert _date_to_ms(day.strftime('%Y-%m-%d')) == (day - EPOCH) // timedelta(milliseconds=1)
+        day += timedelta(days=1)
+
+
+@pytest.mark.parametrize('timestamp', [
+    '2024-02-29T23:59:59Z',
+    '2024-02-29T23:59:59.999Z',
+    '2023-12-31T23:59:59.999999Z',
+    '2024-01-01T00:00:00.000000Z',
+    '2024-01-31T12:34:56.1Z',
+    '2024-04-30T12:34:56.12Z',
+    '2024-04-30T12:34:56.123Z',
+    '2024-10-01T12:00:00.1234Z',
+    '2024-10-01T12:00:00.12345Z',
+    '2024-10-01T12:00:00.123456Z',
+    '2024-10-01T12:00:00.000999Z',
+])
+def test_timestamps_are_converted_like_datetime(timestamp):
+    assert rfc3339_to_ms(timestamp) == expected_ms(timestamp)
+
+
+@pytest.mark.parametrize('timestamp', [
+    '2024-10-01T12:00:00.123+00:00',
+    '2024-10-01T14:00:00.123+02:00',
+    '2024-10-01 12:00:00.123Z',
+])
+def test_other_layouts_fall_back_to_datetime(timestamp):
+    assert rfc3339_to_ms(timestamp) == expected_ms('2024-10-01T12:00:00.123Z')
+
+
+@pytest.mark.parametrize('frame, channel', [
+    ('{"channel":"heartbeat"}', 'heartbeat'),
+    (
+        '{"channel":"status","type":"update","data":[{"version":"2.0.8","system":"online",'
+        '"api_version":"v2","connection_id":1}]}',
+        'status',
+    ),
+    (
+        '{"method":"subscribe","result":{"channel":"trade","snapshot":true,"symbol":"BTC/EUR"},'
+        '"success":true,"time_in":"2024-10-01T12:00:00.000000Z","time_out":"2024-10-01T12:00:00.000100Z"}',
+        'method',
+    ),
+    ('{"channel":"trade","type":"update","data":[]}', 'trade'),
+])
+def test_frames_are_classified_from_their_prefix(frame, channel):
+    def loads(frame: str):
+        raise AssertionError('the frame should not be decoded')
+
+    assert classify_frame(frame, loads) == channel
+
+
+@pytest.mark.parametrize('message, channel', [
+    ({'channel': 'heartbeat'}, 'heartbeat'),
+    ({'type': 'update', 'channel': 'trade', 'data': []}, 'trade'),
+    ({'success': True, 'method': 'pong'}, 'method'),
+    ({'error': 'Unsupported field'}, 'unknown'),
+])
+def test_frames_with_another_layout_are_decoded(message, channel):
+    # the standard library adds spaces after the separators
+    assert classify_frame(json.dumps(message)) == channel
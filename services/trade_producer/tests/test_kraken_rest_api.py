@@ -0,0 +1,115 @@
+import re
+import threading
+import time
+from typing import List
+
+from src.trade_data_source.backfill_checkpoint import BackfillCheckpoint
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+from src.trade_data_source.trade_archive import DAY_MS
+
+HOUR_MS = 3_600_000
+# Kraken returns up to 1000 trades per page, we page a lot sooner to test the paging
+PAGE_SIZE = 3
+
+
+def stub_requests(api: KrakenRestAPI, trades_us: List[int]) -> List[int]:
+    """
+    Answers the requests of the API from the given trade times (in microseconds, like
+    Kraken), PAGE_SIZE trades at a time after `since`. Returns the `since` of each request.
+    """
+    requests_since_ns = []
+
+    def request(url: str) -> dict:
+        since_ns = int(re.search(r'since=(\d+)', url).group(1))
+        requests_since_ns.append(since_ns)
+        rows = [
+            ['100.0', '1.0', f'{trade_us / 1e6:.6f}', 'b', 'l', '', i]
+            for i, trade_us in enumerate(trades_us)
+            if trade_us * 1000 > since_ns
+        ][:PAGE_SIZE]
+        return {'error': [], 'result': {api.product_id: rows}}
+
+    api._request = request
+    return requests_since_ns
+
+
+def test_day_shards_are_half_open_and_cut_at_midnight():
+    from_ms = 10 * DAY_MS + 5 * HOUR_MS
+    to_ms = 12 * DAY_MS + 3 * HOUR_MS
+
+    assert KrakenRestAPI._split_into_day_shards(from_ms, to_ms) == [
+        (from_ms, 11 * DAY_MS),
+        (11 * DAY_MS, 12 * DAY_MS),
+        (12 * DAY_MS, to_ms),
+    ]
+
+
+def test_whole_days_have_no_partial_or_empty_shards():
+    assert KrakenRestAPI._split_into_day_shards(10 * DAY_MS, 12 * DAY_MS) == [
+        (10 * DAY_MS, 11 * DAY_MS),
+        (11 * DAY_MS, 12 * DAY_MS),
+    ]
+    assert KrakenRestAPI._split_into_day_shards(10 * DAY_MS, 10 * DAY_MS) == []
+
+
+def test_each_trade_is_returned_once_in_the_shard_of_its_day():
+    api = KrakenRestAPI(product_id='XBTEUR', last_n_days=2)
+    midnight_ms = api.from_ms + DAY_MS
+    trades_us = [
+        (api.from_ms + HOUR_MS) * 1000,
+        (api.from_ms + 2 * HOUR_MS) * 1000,
+        # 0.4 ms before and after midnight
+        midnight_ms * 1000 - 400,
+        midnight_ms * 1000 + 400,
+        (midnight_ms + HOUR_MS) * 1000,
+        # the first trade after the range
+        api.to_ms * 1000 + 400,
+    ]
+    stub_requests(api, trades_us)
+
+    first_day = api.get_trades()
+    second_day = api.get_trades()
+
+    assert first_day.timestamp_ms.tolist() == [api.from_ms + HOUR_MS, api.from_ms + 2 * HOUR_MS, midnight_ms - 1]
+    assert second_day.timestamp_ms.tolist() == [midnight_ms, midnight_ms + HOUR_MS]
+    assert api.is_done()
+
+
+def test_the_backfill_resumes_mid_shard_from_the_checkpoint(tmp_path):
+    from_ms, to_ms = KrakenRestAPI._init_from_to_ms(2)
+    BackfillCheckpoint(str(tmp_path), 'XBTEUR').save(from_ms + 30 * HOUR_MS)
+
+    api = KrakenRestAPI(product_id='XBTEUR', last_n_days=2, checkpoint_dir=str(tmp_path))
+    requests_since_ns = stub_requests(api, [(from_ms + 29 * HOUR_MS) * 1000, (from_ms + 31 * HOUR_MS) * 1000])
+
+    assert list(api._shards) == [(from_ms + 30 * HOUR_MS, to_ms)]
+    assert api.get_trades().timestamp_ms.tolist() == [from_ms + 31 * HOUR_MS]
+    assert requests_since_ns[0] == (from_ms + 30 * HOUR_MS) * 1_000_000
+
+
+def test_resume_from_ms_wins_over_an_older_checkpoint(tmp_path):
+    from_ms, to_ms = KrakenRestAPI._init_from_to_ms(2)
+    BackfillCheckpoint(str(tmp_path), 'XBTEUR').save(from_ms + 6 * HOUR_MS)
+
+    api = KrakenRestAPI(
+        product_id='XBTEUR', last_n_days=2, checkpoint_dir=str(tmp_path), resume_from_ms=from_ms + 12 * HOUR_MS
+    )
+
+    assert list(api._shards) == [(from_ms + 12 * HOUR_MS, from_ms + DAY_MS), (from_ms + DAY_MS, to_ms)]
+
+
+def test_the_prefetch_thread_stops_when_the_caller_stops():
+    api = KrakenRestAPI(product_id='XBTEUR', last_n_days=2, prefetch_pages=1)
+    # a trade every second, far more pages than the caller reads
+    requests_since_ns = stub_requests(api, [(api.from_ms + i * 1000) * 1000 for i in range(1, 10_000)])
+
+    pages = api._prefetch_pages(api.from_ms, api.to_ms)
+    next(pages)
+    pages.close()
+
+    deadline = time.monotonic() + 5
+    while any(thread.name == 'prefetch-XBTEUR' for thread in threading.enumerate()):
+        assert time.monotonic() < deadline, 'the prefetch thread is still running'
+        time.sleep(0.01)
+    # the page we read, the one in the queue and the one that was waiting for room
+    assert len(requests_since_ns) <= 3
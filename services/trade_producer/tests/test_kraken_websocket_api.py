@@ -0,0 +1,119 @@
+import asyncio
+import json
+import threading
+from typing import List, Optional
+
+import pytest
+from websocket import WebSocketConnectionClosedException
+
+import src.trade_data_source.kraken_websocket_api
+from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+
+
+class FakeSocket:
+    """
+    Returns its frames from recv(), and then raises its error, or blocks until the test
+    is over like a quiet connection.
+    """
+
+    def __init__(self, frames: List[str], error: Optional[Exception] = None) -> None:
+        self.frames = list(frames)
+        self.error = error
+        self.sent: List[dict] = []
+        self.closed = threading.Event()
+
+    def send(self, message: str) -> None:
+        self.sent.append(json.loads(message))
+
+    def recv(self) -> str:
+        if self.frames:
+            return self.frames.pop(0)
+        if self.error is None:
+            self.closed.wait()
+            self.error = WebSocketConnectionClosedException('closed by the test')
+        raise self.error
+
+
+def trade_frame(symbol: str, trade_id: int) -> str:
+    return json.dumps({
+        'channel': 'trade',
+        'type': 'update',
+        'data': [{
+            'symbol': symbol, 'side': 'buy', 'price': 100.0, 'qty': 1.0, 'ord_type': 'market',
+            'trade_id': trade_id, 'timestamp': '2024-10-01T12:00:00.000000Z',
+        }],
+    })
+
+
+@pytest.fixture
+def sockets(monkeypatch) -> List[FakeSocket]:
+    """
+    The sockets KrakenWebsocketAPI connects to, in order. The tests add them before
+    they create the API.
+    """
+    sockets: List[FakeSocket] = []
+    connected = iter(sockets)
+    monkeypatch.setattr(
+        src.trade_data_source.kraken_websocket_api, 'create_connection', lambda url: next(connected)
+    )
+    yield sockets
+    for socket in sockets:
+        socket.closed.set()
+
+
+def stop(api: KrakenWebsocketAPI) -> None:
+    """
+    Waits for the readers of the API to stop, once the test has closed the sockets.
+    """
+    api._loop.run_until_complete(asyncio.gather(*api._readers, return_exceptions=True))
+
+
+def test_product_ids_are_sharded_round_robin():
+    assert KrakenWebsocketAPI._shard_product_ids(['A', 'B', 'C', 'D', 'E'], 2) == [['A', 'C', 'E'], ['B', 'D']]
+    assert KrakenWebsocketAPI._shard_product_ids(['A', 'B'], 3) == [['A'], ['B'], []]
+
+
+def test_no_more_sockets_than_products(sockets):
+    sockets.extend([FakeSocket([]), FakeSocket([])])
+
+    api = KrakenWebsocketAPI(['A', 'B'], n_sockets=5)
+
+    assert api.n_sockets == 2
+    assert [socket.sent[0]['params']['symbol'] for socket in sockets] == [['A'], ['B']]
+
+
+def test_the_frames_of_all_the_sockets_are_merged(sockets):
+    sockets.extend([
+        FakeSocket(['{"channel":"heartbeat"}', trade_frame('A', 1), trade_frame('A', 2)]),
+        FakeSocket([trade_frame('B', 3)]),
+        FakeSocket([trade_frame('C', 4), '{"channel":"heartbeat"}', trade_frame('C', 5)]),
+    ])
+    api = KrakenWebsocketAPI(['A', 'B', 'C'], n_sockets=3)
+
+    trades = []
+    while len(trades) < 5:
+        trades.extend(api.get_trades().to_dicts())
+    for socket in sockets:
+        socket.closed.set()
+    stop(api)
+
+    assert sorted((trade['product_id'], trade['trade_id']) for trade in trades) == [
+        ('A', 1), ('A', 2), ('B', 3), ('C', 4), ('C', 5),
+    ]
+
+
+def test_a_failing_socket_is_raised_after_its_frames(sockets):
+    sockets.extend([
+        FakeSocket([trade_frame('A', 1)]),
+        FakeSocket([trade_frame('B', 2), trade_frame('B', 3)], error=WebSocketConnectionClosedException('gone')),
+    ])
+    api = KrakenWebsocketAPI(['A', 'B'], n_sockets=2)
+
+    trades = []
+    with pytest.raises(WebSocketConnectionClosedException, match='gone'):
+        while True:
+            trades.extend(api.get_trades().to_dicts())
+    sockets[0].closed.set()
+    stop(api)
+
+    assert sorted((trade['product_id'], trade['trade_id']) for trade in trades) == [('A', 1), ('B', 2), ('B', 3)]
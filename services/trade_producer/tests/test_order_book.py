@@ -0,0 +1,94 @@
+import random
+from zlib import crc32
+
+import pytest
+
+from src.trade_data_source.order_book import OrderBook
+
+
+def make_book(depth: int = 10) -> OrderBook:
+    book = OrderBook('BTC/EUR', depth=depth, price_precision=1, qty_precision=8)
+    book.apply(
+        bids=[{'price': 100.0, 'qty': 1.0}, {'price': 99.5, 'qty': 2.0}, {'price': 99.0, 'qty': 3.0}],
+        asks=[{'price': 101.0, 'qty': 0.5}, {'price': 102.0, 'qty': 1.5}, {'price': 101.5, 'qty': 1.0}],
+    )
+    return book
+
+
+def test_levels_are_sorted_best_first():
+    book = make_book()
+
+    assert book.bids.prices(10) == [100.0, 99.5, 99.0]
+    assert book.asks.prices(10) == [101.0, 101.5, 102.0]
+    assert book.asks.quantities(2) == [0.5, 1.0]
+
+
+def test_updates_replace_and_remove_levels():
+    book = make_book()
+
+    book.apply(bids=[{'price': 99.5, 'qty': 0.0}, {'price': 99.7, 'qty': 4.0}], asks=[{'price': 101.0, 'qty': 0.25}])
+
+    assert book.bids.prices(10) == [100.0, 99.7, 99.0]
+    assert book.bids.quantities(10) == [1.0, 4.0, 3.0]
+    assert book.asks.best() == (101.0, 0.25)
+
+
+def test_levels_beyond_the_depth_are_dropped():
+    book = make_book(depth=2)
+
+    assert book.bids.prices(10) == [100.0, 99.5]
+    assert book.asks.prices(10) == [101.0, 101.5]
+
+
+def test_a_deep_book_matches_a_plain_dict_after_many_updates():
+    rng = random.Random(0)
+    book = OrderBook('BTC/EUR', depth=1000, price_precision=1, qty_precision=8)
+    bids = {}
+
+    for _ in range(200):
+        levels = [
+            {'price': 50_000.0 + rng.randrange(2_000) / 2, 'qty': rng.choice([0.0, 0.5, 1.0, 2.0])}
+            for _ in range(rng.randint(1, 50))
+        ]
+        book.apply(bids=levels, asks=[])
+        for level in levels:
+            if level['qty'] == 0:
+                bids.pop(level['price'], None)
+            else:
+                bids[level['price']] = level['qty']
+        # the book keeps the best 1000 levels
+        bids = dict(sorted(bids.items(), reverse=True)[:1000])
+
+        assert book.bids.prices(1000) == list(bids)
+        assert book.bids.quantities(1000) == list(bids.values())
+
+
+def test_checksum_follows_the_kraken_format():
+    book = OrderBook('MATIC/USD', depth=10, price_precision=4, qty_precision=8)
+    book.apply(
+        bids=[{'price': 0.5657, 'qty': 1098.3947558}],
+        asks=[{'price': 0.5666, 'qty': 4831.75496356}, {'price': 0.5667, 'qty': 1}],
+    )
+
+    # asks lowest first, then bids highest first; no decimal point, no leading zeros
+    expected = '5666' + '483175496356' + '5667' + '100000000' + '5657' + '109839475580'
+    assert book.checksum() == crc32(expected.encode())
+
+
+def test_snapshot_metrics():
+    snapshot = make_book().snapshot(timestamp_ms=1, n_levels=2)
+
+    assert snapshot.bid_prices == [100.0, 99.5]
+    assert snapshot.ask_quantities == [0.5, 1.0]
+    assert snapshot.spread == 1.0
+    assert snapshot.mid_price == 100.5
+    # more quantity on the best bid pulls the microprice towards the ask
+    assert snapshot.microprice == pytest.approx((100.0 * 0.5 + 101.0 * 1.0) / 1.5)
+    assert snapshot.imbalance == pytest.approx((3.0 - 1.5) / 4.5)
+
+
+def test_no_snapshot_of_a_one_sided_book():
+    book = OrderBook('BTC/EUR', depth=10, price_precision=1, qty_precision=8)
+    book.apply(bids=[{'price': 100.0, 'qty': 1.0}], asks=[])
+
+    assert book.snapshot(timestamp_ms=1, n_levels=10) is None
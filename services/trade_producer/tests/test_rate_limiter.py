@@ -0,0 +1,133 @@
+import pytest
+
+from src.trade_data_source.rate_limiter import (
+    ExponentialBackoff,
+    RetryableError,
+    TokenBucket,
+)
+
+
+class FakeClock:
+    """
+    A clock that only moves when someone sleeps on it.
+    """
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_sustains_the_full_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=1.0, clock=clock, sleep=clock.sleep)
+
+    for _ in range(101):
+        bucket.acquire()
+
+    # the first request uses the initial token, the other 100 come at exactly 2 per second
+    assert clock.now == pytest.approx(50.0)
+
+
+def test_token_bucket_allows_a_burst_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=5.0, clock=clock, sleep=clock.sleep)
+
+    waits = [bucket.acquire() for _ in range(6)]
+
+    assert waits[:5] == [0.0] * 5
+    assert waits[5] == pytest.approx(1.0)
+
+
+def test_token_bucket_refills_while_idle_but_not_above_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=3.0, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        bucket.acquire()
+
+    clock.now += 100.0
+
+    waits = [bucket.acquire() for _ in range(4)]
+    assert waits[:3] == [0.0] * 3
+    assert waits[3] == pytest.approx(1.0)
+
+
+def test_token_bucket_slows_down_when_rate_limited_and_recovers():
+    clock = FakeClock()
+    bucket = TokenBucket(
+        rate=1.0, capacity=1.0, increase_step=0.25, clock=clock, sleep=clock.sleep
+    )
+    bucket.acquire()
+
+    bucket.on_rate_limited()
+    assert bucket.rate == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(2.0)
+
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == pytest.approx(1.0)
+
+
+def test_token_bucket_never_goes_below_min_rate():
+    bucket = TokenBucket(rate=1.0, capacity=1.0, min_rate=0.2)
+
+    for _ in range(10):
+        bucket.on_rate_limited()
+
+    assert bucket.rate == pytest.approx(0.2)
+
+
+def test_backoff_delays_grow_exponentially_and_are_capped():
+    backoff = ExponentialBackoff(base_delay_sec=1.0, max_delay_sec=10.0, random=lambda: 0.999)
+
+    delays = [backoff.delay(attempt) for attempt in range(6)]
+
+    assert delays == pytest.approx([0.999, 1.998, 3.996, 7.992, 9.99, 9.99])
+
+
+def test_backoff_retries_until_success():
+    clock = FakeClock()
+    backoff = ExponentialBackoff(random=lambda: 0.5, sleep=clock.sleep)
+    outcomes = iter([RetryableError('busy'), RetryableError('busy'), 'ok'])
+
+    def call():
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert backoff.run(call) == 'ok'
+    assert clock.sleeps == pytest.approx([0.5, 1.0])
+
+
+def test_backoff_gives_up_after_max_retries():
+    clock = FakeClock()
+    backoff = ExponentialBackoff(max_retries=3, random=lambda: 0.0, sleep=clock.sleep)
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise RetryableError('busy')
+
+    with pytest.raises(RetryableError):
+        backoff.run(call)
+    assert len(calls) == 4
+
+
+def test_backoff_does_not_retry_other_errors():
+    backoff = ExponentialBackoff(sleep=lambda _: None)
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise ValueError('bad request')
+
+    with pytest.raises(ValueError):
+        backoff.run(call)
+    assert len(calls) == 1
@@ -0,0 +1,157 @@
+from typing import Dict, List
+
+import pytest
+
+from src.trade_data_source.replay_trade_source import ReplayTradeSource
+from src.trade_data_source.trade_archive import DAY_MS, TradeArchive
+from src.trade_data_source.trade_batch import TradeBatch
+
+DAY = 20_000 * DAY_MS
+
+
+class FakeClock:
+    """
+    A clock that only moves when the replay sleeps, and records the sleeps.
+    """
+
+    def __init__(self) -> None:
+        self.now = 1_000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_replay(tmp_path, trades_ms: Dict[str, List[int]], from_ms: int, to_ms: int, **kwargs) -> ReplayTradeSource:
+    """
+    Archives the given trade times of each product (with the product's index plus the
+    time as the trade ID) and returns a replay of them.
+    """
+    archive = TradeArchive(str(tmp_path))
+    for i, (product_id, timestamp_ms) in enumerate(trades_ms.items()):
+        archive.write(
+            product_id,
+            TradeBatch.for_product(
+                product_id,
+                price=[100.0] * len(timestamp_ms),
+                quantity=[1.0] * len(timestamp_ms),
+                timestamp_ms=timestamp_ms,
+                trade_id=[i + ms - DAY for ms in timestamp_ms],
+            ),
+            from_ms,
+            to_ms,
+        )
+    return ReplayTradeSource(str(tmp_path), list(trades_ms), from_ms, to_ms, **kwargs)
+
+
+def replay_all(replay: ReplayTradeSource) -> List[TradeBatch]:
+    batches = []
+    while not replay.is_done():
+        batches.append(replay.get_trades())
+    return [batch for batch in batches if len(batch)]
+
+
+def test_the_products_are_merged_in_timestamp_order(tmp_path):
+    replay = make_replay(
+        tmp_path,
+        {'BTC/EUR': [DAY + 1, DAY + 4, DAY + 6], 'ETH/EUR': [DAY + 2, DAY + 3, DAY + 4, DAY + 7]},
+        DAY,
+        DAY + DAY_MS,
+    )
+
+    trades = TradeBatch.concat(replay_all(replay))
+
+    assert trades.timestamp_ms.tolist() == [DAY + ms for ms in (1, 2, 3, 4, 4, 6, 7)]
+    # ties keep the order of the products
+    assert trades.product_id.tolist() == ['BTC/EUR', 'ETH/EUR', 'ETH/EUR', 'BTC/EUR', 'ETH/EUR', 'BTC/EUR', 'ETH/EUR']
+    assert trades.trade_id.tolist() == [1, 3, 4, 4, 5, 6, 8]
+
+
+def test_at_maximum_speed_the_batches_are_full_and_nothing_sleeps(tmp_path):
+    clock = FakeClock()
+    replay = make_replay(
+        tmp_path, {'BTC/EUR': [DAY + i * 1_000 for i in range(7)]}, DAY, DAY + DAY_MS,
+        batch_size=3, clock=clock, sleep=clock.sleep,
+    )
+
+    assert [len(batch) for batch in replay_all(replay)] == [3, 3, 1]
+    assert clock.sleeps == []
+
+
+@pytest.mark.parametrize('speed', [1.0, 10.0])
+def test_the_replay_sleeps_for_the_gaps_between_the_trades_over_the_speed(tmp_path, speed):
+    clock = FakeClock()
+    replay = make_replay(
+        tmp_path, {'BTC/EUR': [DAY, DAY + 1_000, DAY + 3_000, DAY + 3_500]}, DAY, DAY + DAY_MS,
+        batch_size=10, speed=speed, clock=clock, sleep=clock.sleep,
+    )
+
+    assert [len(batch) for batch in replay_all(replay)] == [1, 1, 1, 1]
+    assert clock.sleeps == pytest.approx([1.0 / speed, 2.0 / speed, 0.5 / speed])
+
+
+def test_the_trades_that_are_due_together_come_in_one_batch(tmp_path):
+    clock = FakeClock()
+    replay = make_replay(
+        tmp_path,
+        {'BTC/EUR': [DAY, DAY, DAY + 2_000, DAY + 2_000], 'ETH/EUR': [DAY, DAY + 2_000]},
+        DAY,
+        DAY + DAY_MS,
+        batch_size=10, speed=2.0, clock=clock, sleep=clock.sleep,
+    )
+
+    assert [len(batch) for batch in replay_all(replay)] == [3, 3]
+    assert clock.sleeps == pytest.approx([1.0])
+
+
+def test_a_replay_falls_behind_instead_of_sleeping_when_the_caller_is_slow(tmp_path):
+    clock = FakeClock()
+    replay = make_replay(
+        tmp_path, {'BTC/EUR': [DAY, DAY + 1_000, DAY + 2_000, DAY + 5_000]}, DAY, DAY + DAY_MS,
+        batch_size=10, speed=1.0, clock=clock, sleep=clock.sleep,
+    )
+
+    assert len(replay.get_trades()) == 1
+    # the caller took 2.5 s with the first batch, the next two trades are overdue
+    clock.now += 2.5
+    assert len(replay.get_trades()) == 2
+    assert clock.sleeps == []
+    assert len(replay.get_trades()) == 1
+    assert clock.sleeps == pytest.approx([2.5])
+
+
+def test_the_replay_reads_one_day_at_a_time_within_its_range(tmp_path):
+    clock = FakeClock()
+    # trades before, in and after the range, which runs from noon to noon two days later
+    trades_ms = [
+        DAY + DAY_MS // 2 - 1,
+        DAY + DAY_MS // 2,
+        DAY + DAY_MS - 1,
+        DAY + DAY_MS,
+        DAY + 2 * DAY_MS + DAY_MS // 2 - 1,
+        DAY + 2 * DAY_MS + DAY_MS // 2,
+    ]
+    archive = TradeArchive(str(tmp_path))
+    archive.write(
+        'BTC/EUR',
+        TradeBatch.for_product('BTC/EUR', price=[100.0] * 6, quantity=[1.0] * 6, timestamp_ms=trades_ms),
+        DAY,
+        DAY + 3 * DAY_MS,
+    )
+    replay = ReplayTradeSource(
+        str(tmp_path), ['BTC/EUR'], DAY + DAY_MS // 2, DAY + 2 * DAY_MS + DAY_MS // 2,
+        batch_size=10, speed=1_000.0, clock=clock, sleep=clock.sleep,
+    )
+
+    batches = [batch.timestamp_ms.tolist() for batch in replay_all(replay)]
+
+    # the trades outside the range are left out, and no batch spans midnight
+    assert batches == [trades_ms[1:2], trades_ms[2:3], trades_ms[3:4], trades_ms[4:5]]
+    # and the pacing carries on across the days
+    assert clock.sleeps == pytest.approx([
+        (trades_ms[i + 1] - trades_ms[i]) / 1_000 / 1_000.0 for i in range(1, 4)
+    ])
@@ -0,0 +1,101 @@
+import json
+
+import numpy as np
+
+from src.trade_data_source.trade_archive import DAY_MS, TradeArchive
+from src.trade_data_source.trade_batch import TradeBatch
+
+DAY = 20_000 * DAY_MS
+
+
+def make_trades(timestamp_ms: list) -> TradeBatch:
+    """
+    Trades with the timestamp as the trade ID, and prices and sides that follow it, so
+    we can tell that the columns stayed aligned.
+    """
+    return TradeBatch.for_product(
+        'BTC/EUR',
+        price=[100.0 + ms % 1_000 for ms in timestamp_ms],
+        quantity=[1.0] * len(timestamp_ms),
+        timestamp_ms=timestamp_ms,
+        side=[1 if ms % 2 else -1 for ms in timestamp_ms],
+        trade_id=timestamp_ms,
+    )
+
+
+def manifest(tmp_path) -> list:
+    with open(tmp_path / 'BTC-EUR' / 'manifest.json') as f:
+        return json.load(f)['covered_ranges']
+
+
+def test_an_empty_archive_misses_the_whole_range(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+
+    assert archive.missing_ranges('BTC/EUR', DAY, DAY + 100) == [(DAY, DAY + 100)]
+
+
+def test_only_the_gaps_between_the_covered_ranges_are_missing(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    archive.write('BTC/EUR', make_trades([]), DAY + 10, DAY + 20)
+    archive.write('BTC/EUR', make_trades([]), DAY + 40, DAY + 50)
+
+    assert archive.missing_ranges('BTC/EUR', DAY, DAY + 100) == [
+        (DAY, DAY + 10), (DAY + 20, DAY + 40), (DAY + 50, DAY + 100),
+    ]
+    # ranges that start or end inside a covered range
+    assert archive.missing_ranges('BTC/EUR', DAY + 15, DAY + 45) == [(DAY + 20, DAY + 40)]
+    assert archive.missing_ranges('BTC/EUR', DAY + 12, DAY + 18) == []
+
+
+def test_adjacent_and_overlapping_ranges_are_merged_in_the_manifest(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+
+    archive.write('BTC/EUR', make_trades([]), DAY + 0, DAY + 10)
+    archive.write('BTC/EUR', make_trades([]), DAY + 30, DAY + 40)
+    assert manifest(tmp_path) == [[DAY + 0, DAY + 10], [DAY + 30, DAY + 40]]
+
+    # adjacent: [0, 10) and [10, 20) touch
+    archive.write('BTC/EUR', make_trades([]), DAY + 10, DAY + 20)
+    assert manifest(tmp_path) == [[DAY + 0, DAY + 20], [DAY + 30, DAY + 40]]
+
+    # overlapping both of them
+    archive.write('BTC/EUR', make_trades([]), DAY + 15, DAY + 35)
+    assert manifest(tmp_path) == [[DAY + 0, DAY + 40]]
+    assert archive.missing_ranges('BTC/EUR', DAY, DAY + 40) == []
+
+
+def test_writes_are_merged_into_the_day_in_timestamp_order(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+
+    archive.write('BTC/EUR', make_trades([DAY + 1, DAY + 5]), DAY, DAY + 6)
+    archive.write('BTC/EUR', make_trades([DAY + 3, DAY + 7, DAY + 12]), DAY + 2, DAY + 20)
+
+    trades = archive.read('BTC/EUR', DAY, DAY + DAY_MS)
+    assert trades.timestamp_ms.tolist() == [DAY + 1, DAY + 3, DAY + 5, DAY + 7, DAY + 12]
+    assert trades.trade_id.tolist() == trades.timestamp_ms.tolist()
+    assert trades.price.tolist() == [100.0 + ms % 1_000 for ms in trades.timestamp_ms.tolist()]
+    assert trades.side.tolist() == [1 if ms % 2 else -1 for ms in trades.timestamp_ms.tolist()]
+
+
+def test_a_read_round_trips_the_trades_across_days(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    timestamp_ms = [DAY + 1, DAY + DAY_MS - 1, DAY + DAY_MS, DAY + DAY_MS + 2, DAY + 2 * DAY_MS + 3]
+    archive.write('BTC/EUR', make_trades(timestamp_ms), DAY, DAY + 3 * DAY_MS)
+
+    # [from, to) is half-open
+    trades = archive.read('BTC/EUR', DAY + 1, DAY + 2 * DAY_MS + 3)
+    assert trades.timestamp_ms.tolist() == timestamp_ms[:4]
+    assert trades.to_dicts() == make_trades(timestamp_ms[:4]).to_dicts()
+
+
+def test_a_read_inside_one_day_is_a_view_of_the_memory_mapped_files(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    archive.write('BTC/EUR', make_trades([DAY + 1, DAY + 2, DAY + 3]), DAY, DAY + DAY_MS)
+
+    trades = archive.read('BTC/EUR', DAY + 2, DAY + 4)
+
+    assert trades.timestamp_ms.tolist() == [DAY + 2, DAY + 3]
+    # the files are mapped read-only, a copy would be writeable
+    assert not trades.price.flags.writeable
+    assert not trades.timestamp_ms.flags.writeable
+    assert isinstance(archive._read_day('BTC/EUR', DAY)['price'], np.memmap)
@@ -0,0 +1,75 @@
+import math
+
+import pytest
+
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+def make_batch(**columns) -> TradeBatch:
+    """
+    A valid batch of three trades of two products, with the given columns replaced.
+    """
+    return TradeBatch.from_columns(**{
+        'product_id': ['BTC/EUR', 'ETH/EUR', 'BTC/EUR'],
+        'price': [100.0, 10.0, 101.0],
+        'quantity': [1.0, 2.0, 0.5],
+        'timestamp_ms': [1_000, 1_001, 1_002],
+        'side': [1, -1, 0],
+        'trade_id': [7, 8, 9],
+        **columns,
+    })
+
+
+def test_a_valid_batch_passes():
+    assert len(make_batch()) == 3
+
+
+@pytest.mark.parametrize('columns', [
+    {'price': [100.0, math.nan, 101.0]},
+    {'price': [100.0, math.inf, 101.0]},
+    {'price': [100.0, -10.0, 101.0]},
+    {'price': [100.0, 0.0, 101.0]},
+    {'quantity': [1.0, math.nan, 0.5]},
+    {'quantity': [1.0, -2.0, 0.5]},
+    {'timestamp_ms': [1_000, -1, 1_002]},
+    {'side': [1, 2, 0]},
+    {'trade_id': [7, -8, 9]},
+])
+def test_invalid_trades_are_rejected(columns):
+    with pytest.raises(ValueError, match='1 invalid trades'):
+        make_batch(**columns)
+
+
+def test_columns_of_different_lengths_are_rejected():
+    with pytest.raises(ValueError, match='same length'):
+        make_batch(price=[100.0, 10.0])
+
+
+def test_the_trades_of_a_product_must_be_in_timestamp_order():
+    with pytest.raises(ValueError, match='timestamp order'):
+        make_batch(timestamp_ms=[1_002, 1_001, 1_000])
+
+
+def test_the_products_may_interleave_out_of_timestamp_order():
+    # e.g. ETH/EUR from another websocket lags behind BTC/EUR
+    batch = make_batch(timestamp_ms=[1_000, 900, 1_002])
+
+    assert batch.timestamp_ms.tolist() == [1_000, 900, 1_002]
+
+
+def test_concat_and_to_dicts_round_trip_all_the_fields():
+    first, second = make_batch(), make_batch(timestamp_ms=[2_000, 2_001, 2_002], trade_id=[10, 11, 12])
+
+    trades = TradeBatch.concat([first, second]).to_dicts()
+
+    assert trades == first.to_dicts() + second.to_dicts()
+    assert [(t['product_id'], t['side'], t['trade_id']) for t in trades[:3]] == [
+        ('BTC/EUR', 1, 7), ('ETH/EUR', -1, 8), ('BTC/EUR', 0, 9),
+    ]
+    assert TradeBatch.from_trades(TradeBatch.concat([first, second]).to_trades()).to_dicts() == trades
+
+
+def test_the_product_ids_are_interned():
+    batch = make_batch(product_id=['BTC/' + 'EUR', 'ETH/EUR', ''.join(['BTC/', 'EUR'])])
+
+    assert batch.product_id[0] is batch.product_id[2]
@@ -0,0 +1,43 @@
+from src.trade_data_source.kraken_decoder import KrakenTradeDecoder
+from src.trade_data_source.trade_batch import TradeBatch
+from src.trade_deduplicator import TradeDeduplicator
+
+
+def sweep(trade_ids: list) -> TradeBatch:
+    """
+    A market order that fills several times at the same millisecond, price and size.
+    """
+    n_trades = len(trade_ids)
+    return TradeBatch.for_product(
+        'BTC/EUR', price=[60_000.0] * n_trades, quantity=[0.01] * n_trades,
+        timestamp_ms=[1_700_000_000_000] * n_trades, trade_id=trade_ids,
+    )
+
+
+def test_identical_looking_trades_with_different_ids_are_kept():
+    deduplicator = TradeDeduplicator(window_ms=60_000)
+
+    assert len(deduplicator.filter(sweep([101, 102, 103]))) == 3
+    # the same fills again, e.g. after a reconnect
+    assert len(deduplicator.filter(sweep([102, 103, 104]))) == 1
+    assert deduplicator.n_duplicates == 2
+
+
+def test_the_trades_without_ids_fall_back_to_their_contents():
+    deduplicator = TradeDeduplicator(window_ms=60_000)
+
+    assert len(deduplicator.filter(sweep([0, 0]))) == 1
+
+
+def test_the_websocket_trades_keep_their_ids():
+    frame = (
+        '{"channel":"trade","type":"update","data":['
+        '{"symbol":"BTC/EUR","side":"buy","price":60000.0,"qty":0.01,"ord_type":"market","trade_id":101,"timestamp":"2024-10-01T12:00:00.123456Z"},'
+        '{"symbol":"BTC/EUR","side":"buy","price":60000.0,"qty":0.01,"ord_type":"market","trade_id":102,"timestamp":"2024-10-01T12:00:00.123456Z"}'
+        ']}'
+    )
+
+    trades = KrakenTradeDecoder(json_backend='json').decode(frame)
+
+    assert trades.trade_id.tolist() == [101, 102]
+    assert len(TradeDeduplicator(window_ms=60_000).filter(trades)) == 2
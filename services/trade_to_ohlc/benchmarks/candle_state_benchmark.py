@@ -0,0 +1,167 @@
+"""
+Compares the candle state and projection we used to have (a dict per window that repeats
+the product_id, then seven column projections and a column selection per candle) with
+the fixed-layout list state and the single `to_candle_record` step of src.main.
+
+It runs the Quix tumbling window and the projection offline (a RocksDB window store, no
+Kafka), and prints the bytes each window takes in the store, the trades/sec through the
+window, and the candles/sec through the projection. Run it from the service directory
+(with a .env, e.g. `cp live.dev.env .env`) with
+
+    PYTHONPATH=$(pwd) poetry run python benchmarks/candle_state_benchmark.py
+"""
+import random
+import tempfile
+import time
+from contextvars import copy_context
+from typing import Callable, Dict, List
+
+from quixstreams import Application
+from quixstreams.context import set_message_context
+from quixstreams.dataframe import StreamingDataFrame
+from quixstreams.dataframe.windows import TumblingWindowDefinition
+from quixstreams.models import MessageContext
+from quixstreams.state.rocksdb.windowed.partition import WindowedRocksDBStorePartition
+from quixstreams.utils.json import dumps
+
+from src.main import init_ohlcv_candle, to_candle_records, update_ohlvc_candle
+
+N_TRADES = 200_000
+N_CANDLES = 50_000
+# the trades of a checkpoint share one state transaction
+CHECKPOINT_TRADES = 1_000
+WINDOW_MS = 60_000
+PRODUCT_IDS = ['BTC/EUR', 'ETH/EUR', 'SOL/EUR', 'XRP/EUR']
+
+
+def legacy_init_ohlcv_candle(trade: dict) -> dict:
+    """
+    The candle state as it was: a dict with the field names and the product_id.
+    """
+    return {
+        'open': trade['price'],
+        'high': trade['price'],
+        'low': trade['price'],
+        'close': trade['price'],
+        'volume': trade['quantity'],
+        'product_id': trade['product_id'],
+    }
+
+
+def legacy_update_ohlvc_candle(candle: dict, trade: dict) -> dict:
+    candle['high'] = max(candle['high'], trade['price'])
+    candle['low'] = min(candle['low'], trade['price'])
+    candle['close'] = trade['price']
+    candle['volume'] += trade['quantity']
+    candle['product_id'] = trade['product_id']
+    return candle
+
+
+def legacy_to_candle_records(sdf: StreamingDataFrame) -> StreamingDataFrame:
+    """
+    The projection as it was: one step per column, then a column selection.
+    """
+    sdf["open"] = sdf["value"]["open"]
+    sdf["high"] = sdf["value"]["high"]
+    sdf["low"] = sdf["value"]["low"]
+    sdf["close"] = sdf["value"]["close"]
+    sdf["volume"] = sdf["value"]["volume"]
+    sdf["timestamp_ms"] = sdf["end"]
+    sdf["product_id"] = sdf["value"]["product_id"]
+    return sdf[["product_id", "timestamp_ms", "open", "high", "low", "close", "volume"]]
+
+
+def make_trades(n: int) -> List[Dict]:
+    """
+    Returns `n` random trades of a few products, a few per second.
+    """
+    rng = random.Random(0)
+    timestamp_ms = 1_700_000_000_000
+    trades = []
+    for _ in range(n):
+        timestamp_ms += rng.randint(0, 500)
+        trades.append({
+            'product_id': rng.choice(PRODUCT_IDS),
+            'price': round(60_000 + rng.gauss(0, 100), 1),
+            'quantity': round(rng.expovariate(20), 8),
+            'timestamp_ms': timestamp_ms,
+        })
+    return trades
+
+
+def benchmark_window(name: str, initializer: Callable, reducer: Callable, trades: List[Dict]) -> float:
+    """
+    Runs the trades through a tumbling window with a RocksDB store, and prints the
+    trades/sec and the bytes of a window in the store.
+    """
+    window = TumblingWindowDefinition(duration_ms=WINDOW_MS, grace_ms=0, dataframe=None).reduce(
+        reducer=reducer, initializer=initializer
+    )
+    partition = WindowedRocksDBStorePartition(tempfile.mkdtemp())
+    states = []
+
+    def run():
+        for offset in range(0, len(trades), CHECKPOINT_TRADES):
+            transaction = partition.begin()
+            for trade in trades[offset:offset + CHECKPOINT_TRADES]:
+                set_message_context(MessageContext(topic='trade', partition=0, offset=offset, size=0))
+                state = transaction.as_state(prefix=trade['product_id'].encode())
+                _, expired = window.process_window(trade, trade['timestamp_ms'], state)
+                states.extend(expired)
+            transaction.flush(processed_offset=offset)
+
+    start = time.perf_counter()
+    copy_context().run(run)
+    elapsed = time.perf_counter() - start
+    partition.close()
+
+    # the store keeps each window as its JSON value
+    state_bytes = sum(len(dumps(window['value'])) for window in states) / len(states)
+    print(f'{name:<8} {len(trades) / elapsed:>10,.0f} trades/sec {state_bytes:>8.1f} bytes/window')
+    return elapsed
+
+
+def benchmark_projection(name: str, to_records: Callable, windows: List[tuple]) -> float:
+    """
+    Runs closed windows through the projection of the pipeline, and prints the candles/sec.
+    """
+    app = Application(
+        broker_address='localhost:9092',
+        consumer_group='candle_state_benchmark',
+        state_dir=tempfile.mkdtemp(),
+        use_changelog_topics=False,
+    )
+    sdf = to_records(app.dataframe(app.topic('ohlcv_windows')))
+    composed = sdf.compose()['ohlcv_windows']
+
+    start = time.perf_counter()
+    for window, key in windows:
+        composed(window, key, window['start'], None)
+    elapsed = time.perf_counter() - start
+
+    print(f'{name:<8} {len(windows) / elapsed:>10,.0f} candles/sec')
+    return elapsed
+
+
+if __name__ == '__main__':
+    trades = make_trades(N_TRADES)
+
+    print(f'{N_TRADES:,} trades through a {WINDOW_MS // 1000}s window')
+    before = benchmark_window('before', legacy_init_ohlcv_candle, legacy_update_ohlvc_candle, trades)
+    after = benchmark_window('after', init_ohlcv_candle, update_ohlvc_candle, trades)
+    print(f'speedup  {before / after:>10.2f}x')
+
+    # the closed windows of both states, with a fresh dict per call as the window makes
+    rng = random.Random(1)
+    legacy_windows, windows = [], []
+    for i in range(N_CANDLES):
+        product_id = rng.choice(PRODUCT_IDS)
+        trade = {'product_id': product_id, 'price': 60_000.0 + i, 'quantity': 0.5}
+        bounds = {'start': i * WINDOW_MS, 'end': (i + 1) * WINDOW_MS}
+        legacy_windows.append(({**bounds, 'value': legacy_init_ohlcv_candle(trade)}, product_id.encode()))
+        windows.append(({**bounds, 'value': init_ohlcv_candle(trade)}, product_id.encode()))
+
+    print(f'\n{N_CANDLES:,} closed windows through the projection')
+    before = benchmark_projection('before', legacy_to_candle_records, legacy_windows)
+    after = benchmark_projection('after', to_candle_records, windows)
+    print(f'speedup  {before / after:>10.2f}x')
@@ -0,0 +1,362 @@
+"""
+Batch OHLCV for historical backfills.
+
+The streaming pipeline pushes every trade through the tumbling-window reducer one
+message at a time. For a backfill we already have the whole time range, so we read the
+trades at once (from the trade topic, or from the trade archive of the trade producer),
+compute the candles with a vectorized group-by on the window-aligned timestamps, and
+write them to the output topics in bulk.
+
+The candles are the ones the streaming reducer writes for the same messages, in the same
+order. That means following the rules of the Quix windows, and not only the window
+boundaries:
+- the latest timestamp is shared by all the keys of a partition, and a message whose
+  window ended at or before it is dropped;
+- the windows of a key are only closed when a message of that key comes in, so a closed
+  candle is written after the first message of its key that has seen its end;
+- the next resolution of the cascade reads the closed candles in that order, timestamped
+  with the start of their window, and its windows are closed by the candles of their own
+  key only (see src.candle_window): none of them is dropped as late.
+"""
+import operator
+from functools import reduce
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from confluent_kafka import TopicPartition
+from kafka_serialization import AutoDeserializer, ProtobufRecordCodec, get_value_serializer
+from loguru import logger
+from quixstreams import Application
+from quixstreams.utils.json import dumps
+from trade_archive_layout import COLUMNS, day_starts, read_day
+
+from src.gap_fill import empty_candles
+
+# The fields of the candles we write, in order
+CANDLE_RECORD_FIELDS = [
+    'product_id', 'timestamp_ms', 'open', 'high', 'low', 'close', 'volume',
+    'vwap', 'trade_count', 'buy_volume', 'sell_volume', 'notional',
+]
+
+# The fields of the records each resolution aggregates (a trade has one price for all
+# four, and counts as one trade), and the ones of them that are sums
+_AGGREGATED_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'notional', 'trade_count', 'buy_volume', 'sell_volume')
+_SUMMED_FIELDS = ('volume', 'notional', 'trade_count', 'buy_volume', 'sell_volume')
+
+
+def aggregate_windows(
+    keys: np.ndarray,
+    timestamp_ms: np.ndarray,
+    records: Dict[str, np.ndarray],
+    window_ms: int,
+    closed_before_ms: Optional[int] = None,
+    closed_by_key: bool = False,
+) -> Dict[str, np.ndarray]:
+    """
+    Aggregates the records of one partition into the candles of `window_ms`, the way
+    the tumbling-window reducer of the streaming pipeline does.
+
+    Args:
+        keys (np.ndarray): The key of each record (an integer code per product), in arrival order.
+        timestamp_ms (np.ndarray): The timestamp of each record.
+        records (Dict[str, np.ndarray]): The open, high, low, close, volume, notional,
+            trade count and buy and sell volumes of each record (a trade has its price as
+            open, high, low and close).
+        window_ms (int): The length of the candles.
+        closed_before_ms (Optional[int]): If given, the windows that end at or before this
+            time but that no message has closed yet are closed after the last record, the
+            way the next messages of their keys would. If None, they are left out.
+        closed_by_key (bool): Whether the windows of a key are closed by the records of
+            that key only, and no record is dropped as late, like the windows of the
+            cascade. For records that come in timestamp order for each key.
+
+    Returns:
+        Dict[str, np.ndarray]: The closed candles in the order the streaming pipeline
+            writes them: 'key', 'start', 'end' and the aggregated fields.
+    """
+    n = len(timestamp_ms)
+    if n == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return {'key': empty, 'start': empty, 'end': empty, **{name: records[name][:0] for name in _AGGREGATED_FIELDS}}
+
+    window_start = timestamp_ms - timestamp_ms % window_ms
+
+    # The latest timestamp of the partition after each record. A dropped record never
+    # moves it, because its timestamp is before the end of its window.
+    latest = np.maximum.accumulate(timestamp_ms)
+    if closed_by_key:
+        kept = np.ones(n, dtype=bool)
+    else:
+        latest_before = np.r_[0, latest[:-1]]
+        kept = window_start + window_ms > latest_before
+
+    # The kept records of a key come in window order, so after a stable sort by key each
+    # window is one contiguous run, still in arrival order
+    order = np.flatnonzero(kept)
+    order = order[np.argsort(keys[order], kind='stable')]
+    sorted_keys, sorted_start = keys[order], window_start[order]
+    firsts = np.flatnonzero(np.r_[True, (sorted_keys[1:] != sorted_keys[:-1]) | (sorted_start[1:] != sorted_start[:-1])])
+    lasts = np.r_[firsts[1:], len(order)] - 1
+
+    candle_key, start = sorted_keys[firsts], sorted_start[firsts]
+    end = start + window_ms
+    candles = {
+        'open': records['open'][order[firsts]],
+        'high': np.maximum.reduceat(records['high'][order], firsts),
+        'low': np.minimum.reduceat(records['low'][order], firsts),
+        'close': records['close'][order[lasts]],
+    }
+    for name in _SUMMED_FIELDS:
+        values = records[name][order]
+        if values.dtype.kind == 'i':
+            # Integers (fixed-point volumes, trade counts) sum exactly in any order
+            candles[name] = np.add.reduceat(values, firsts)
+        else:
+            # Float sums depend on the order, so we add them one by one like the reducer
+            # does (and Python ints, like the fixed-point notional, do not overflow)
+            summed = values.tolist()
+            candles[name] = np.array([
+                reduce(operator.add, summed[first:last + 1])
+                for first, last in zip(firsts.tolist(), lasts.tolist())
+            ], dtype=values.dtype)
+
+    # A window is closed by the first message of its key once the latest timestamp (of
+    # the partition, or of the key) has reached its end (dropped messages close windows too)
+    closed_at = np.full(len(start), n, dtype=np.int64)
+    for key in np.unique(candle_key):
+        positions = np.flatnonzero(keys == key)
+        in_key = candle_key == key
+        key_latest = np.maximum.accumulate(timestamp_ms[positions]) if closed_by_key else latest[positions]
+        i = np.searchsorted(key_latest, end[in_key], side='left')
+        closed_at[in_key] = np.where(i < len(positions), positions[np.minimum(i, len(positions) - 1)], n)
+
+    is_closed = closed_at < n
+    if closed_before_ms is not None:
+        is_closed |= end <= closed_before_ms
+
+    # The windows closed by one message come out by start, the ones we close at the end by key
+    emitted = np.flatnonzero(is_closed)
+    emitted = emitted[np.lexsort((start[emitted], candle_key[emitted], closed_at[emitted]))]
+    return {
+        'key': candle_key[emitted],
+        'start': start[emitted],
+        'end': end[emitted],
+        **{name: values[emitted] for name, values in candles.items()},
+    }
+
+
+def fill_empty_windows(candles: Dict[str, list], window_ms: int, closed_before_ms: Optional[int] = None) -> Dict[str, list]:
+    """
+    Adds the empty candles of the windows without trades (see src.gap_fill) to the
+    candles of one resolution: before the next candle of each product, as the streaming
+    pipeline writes them, and after the last one up to `closed_before_ms`.
+
+    Args:
+        candles (Dict[str, list]): The candles, one list per field of CANDLE_RECORD_FIELDS.
+        window_ms (int): The length of the candles.
+        closed_before_ms (Optional[int]): If given, the windows that end at or before this
+            time are all closed.
+
+    Returns:
+        Dict[str, list]: The candles with the empty ones, in the same layout.
+    """
+    filled = {name: [] for name in CANDLE_RECORD_FIELDS}
+    # The last candle of each product
+    last_candles: Dict[str, dict] = {}
+
+    def append(records: List[dict]):
+        for record in records:
+            for name in CANDLE_RECORD_FIELDS:
+                filled[name].append(record[name])
+
+    for values in zip(*(candles[name] for name in CANDLE_RECORD_FIELDS)):
+        record = dict(zip(CANDLE_RECORD_FIELDS, values))
+        product_id = record['product_id']
+        if product_id in last_candles:
+            append(empty_candles(last_candles[product_id], record['timestamp_ms'] - window_ms, window_ms))
+        append([record])
+        last_candles[product_id] = record
+
+    if closed_before_ms is not None:
+        closed_until_ms = closed_before_ms - closed_before_ms % window_ms
+        for product_id in sorted(last_candles):
+            append(empty_candles(last_candles[product_id], closed_until_ms, window_ms))
+
+    return filled
+
+
+def compute_ohlcv(
+    product_ids: Sequence[str],
+    timestamp_ms: np.ndarray,
+    price: np.ndarray,
+    quantity: np.ndarray,
+    window_seconds: List[int],
+    closed_before_ms: Optional[int] = None,
+    fill_empty: bool = False,
+    side: Optional[np.ndarray] = None,
+) -> List[Dict[str, list]]:
+    """
+    Returns the candles of every resolution of `window_seconds` (the finest first, each
+    one a multiple of the previous one) for the trades of one partition.
+
+    Args:
+        product_ids (Sequence[str]): The product of each trade (the key of its message), in arrival order.
+        timestamp_ms (np.ndarray): The timestamp of each trade.
+        price (np.ndarray): The price of each trade.
+        quantity (np.ndarray): The quantity of each trade.
+        window_seconds (List[int]): The candle lengths, from the finest to the coarsest.
+        closed_before_ms (Optional[int]): Also close the windows that end at or before this
+            time (see `aggregate_windows`).
+        fill_empty (bool): Whether to add the empty candles of the windows without trades
+            (see `fill_empty_windows`).
+        side (Optional[np.ndarray]): The taker side of each trade (1 buy, -1 sell, 0
+            unknown). Unknown for all the trades if None.
+
+    Returns:
+        List[Dict[str, list]]: The candles of each resolution, one list per field of
+            CANDLE_RECORD_FIELDS, in the order the streaming pipeline writes them.
+    """
+    products, keys = np.unique(np.asarray(product_ids, dtype=object), return_inverse=True)
+    if side is None:
+        side = np.zeros(len(timestamp_ms), dtype=np.int8)
+    if price.dtype.kind == 'i':
+        # The fixed-point notional is an exact Python int, like in the reducer, because it
+        # can go past int64
+        notional = price.astype(object) * quantity.astype(object)
+    else:
+        notional = price * quantity
+    records = {
+        'open': price, 'high': price, 'low': price, 'close': price, 'volume': quantity,
+        'notional': notional,
+        'trade_count': np.ones(len(timestamp_ms), dtype=np.int64),
+        # the quantity for the trades of the side, and a zero of its type for the others
+        'buy_volume': quantity * (side == 1),
+        'sell_volume': quantity * (side == -1),
+    }
+
+    results = []
+    for level, seconds in enumerate(window_seconds):
+        window_ms = seconds * 1000
+        # The trades are closed by the partition, the candles of the cascade by their key
+        candles = aggregate_windows(keys, timestamp_ms, records, window_ms, closed_before_ms, closed_by_key=level > 0)
+
+        columns = {name: candles[name].tolist() for name in _AGGREGATED_FIELDS}
+        result = {
+            'product_id': products[candles['key']].tolist(),
+            'timestamp_ms': candles['end'].tolist(),
+            **{name: columns[name] for name in ('open', 'high', 'low', 'close', 'volume')},
+            # divided in Python like the reducer does, so the VWAP is the same to the last bit
+            'vwap': [
+                notional / volume if volume else close
+                for notional, volume, close in zip(columns['notional'], columns['volume'], columns['close'])
+            ],
+            **{name: columns[name] for name in ('trade_count', 'buy_volume', 'sell_volume', 'notional')},
+        }
+        results.append(fill_empty_windows(result, window_ms, closed_before_ms) if fill_empty else result)
+
+        # The next resolution reads these candles (not the empty ones), timestamped with the start of their window
+        keys, timestamp_ms = candles['key'], candles['start']
+        records = {name: candles[name] for name in _AGGREGATED_FIELDS}
+
+    return results
+
+
+def read_archived_trades(
+    archive_dir: str, product_id: str, from_ms: int, to_ms: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reads the trades of `[from_ms, to_ms)` from the day-partitioned trade archive the
+    trade producer writes (see `trade_archive_layout`).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: The timestamps, prices,
+            quantities and sides, in timestamp order.
+    """
+    names = ('timestamp_ms', 'price', 'quantity', 'side')
+    chunks = {name: [] for name in names}
+
+    for day_from_ms in day_starts(from_ms, to_ms):
+        day = read_day(archive_dir, product_id, day_from_ms)
+        if day is None:
+            continue
+
+        # The days are sorted by timestamp, so we can binary search the range
+        start, end = np.searchsorted(day['timestamp_ms'], [from_ms, to_ms])
+        for name in names:
+            chunks[name].append(day[name][start:end])
+
+    return tuple(
+        np.concatenate(chunks[name]) if chunks[name] else np.empty(0, dtype=COLUMNS[name])
+        for name in names
+    )
+
+
+def read_topic_trades(app: Application, topic_name: str, codec: ProtobufRecordCodec) -> List[Dict[str, list]]:
+    """
+    Reads all the trades in the trade topic, from the first offset to the end.
+
+    Args:
+        app (Application): The application whose consumer settings we use.
+        topic_name (str): The name of the trade topic.
+        codec (ProtobufRecordCodec): The codec of the Protobuf trades (JSON is read too).
+
+    Returns:
+        List[Dict[str, list]]: The trades of each partition, one list per field, in offset order.
+    """
+    deserializer = AutoDeserializer(codec)
+    partitions = []
+
+    with app.get_consumer(auto_commit_enable=False) as consumer:
+        metadata = consumer.list_topics(topic_name, timeout=10)
+        for partition in sorted(metadata.topics[topic_name].partitions):
+            low, high = consumer.get_watermark_offsets(TopicPartition(topic_name, partition), timeout=10)
+            if high <= low:
+                continue
+
+            consumer.assign([TopicPartition(topic_name, partition, low)])
+            values = []
+            while True:
+                msg = consumer.poll(1.0)
+                if msg is None:
+                    continue
+                if msg.error():
+                    logger.error(f'Kafka error: {msg.error()}')
+                    continue
+                values.append(msg.value())
+                if msg.offset() >= high - 1:
+                    break
+
+            logger.info(f'Read {len(values):,} trades from partition {partition} of {topic_name}')
+            partitions.append(deserializer.deserialize_columns(values))
+
+    return partitions
+
+
+def produce_candles(
+    app: Application,
+    topic_name: str,
+    candles: Dict[str, list],
+    kafka_value_encoding: str,
+    schema_registry_url: Optional[str],
+    codec: ProtobufRecordCodec,
+) -> None:
+    """
+    Writes a batch of candles to the given topic, keyed by product_id like the trades.
+    """
+    value_serializer = get_value_serializer(kafka_value_encoding, codec, schema_registry_url, topic_name)
+    topic = app.topic(name=topic_name, value_serializer=value_serializer)
+
+    # Serialize the whole batch at once
+    if kafka_value_encoding == 'protobuf':
+        values = value_serializer.serialize_columns(candles)
+    else:
+        values = [dumps(dict(zip(candles, record))) for record in zip(*candles.values())]
+
+    keys = {}
+    with app.get_producer() as producer:
+        for product_id, value in zip(candles['product_id'], values):
+            if product_id not in keys:
+                keys[product_id] = topic.serialize(key=product_id).key
+            producer.produce(topic=topic.name, value=value, key=keys[product_id])
+
+    logger.info(f'Wrote {len(values):,} candles to {topic_name}')
@@ -0,0 +1,172 @@
+"""
+The tumbling window of the candles.
+
+`CandleWindow` reduces the records of each window into a candle, like
+`sdf.tumbling_window(...).reduce(...).final()`. It is also closed by the ticks of the
+wall clock (see src.wall_clock), and it can emit its open windows as provisional
+candles (see src.provisional).
+
+A Quix window drops a record whose window ended before the latest timestamp of the
+partition, which all the keys of the partition share. That is right for the trades, but
+not for the closed candles of a finer window: the candle of a quiet product is closed by
+its next trade, long after the other products have moved the latest timestamp past the
+coarser window it falls in. The windows of the cascade are closed by the timestamps of
+their own key instead (`closed_by_key`): the closed candles of a key come in order, so a
+coarser window is complete once a candle of its key that starts after it comes in (or a
+tick), and no candle of a key is late.
+"""
+from typing import Any, Callable, List, Optional, Tuple
+
+from quixstreams.dataframe import StreamingDataFrame
+from quixstreams.dataframe.windows.time_based import FixedTimeWindow
+from quixstreams.state import WindowedState
+
+from src.provisional import PROVISIONAL_HEADERS, ProvisionalThrottle
+from src.wall_clock import is_tick
+
+# The state of a window that a tick opened to move the watermark, with no trade in it yet
+EMPTY_WINDOW: list = []
+
+
+class CandleWindow(FixedTimeWindow):
+    """
+    A tumbling window that reduces the records into a candle, like
+    `sdf.tumbling_window(...).reduce(...)`, and that is also closed by `WallClockTick`s.
+    """
+
+    def __init__(
+        self,
+        duration_ms: int,
+        name: str,
+        reducer: Callable[[Any, Any], Any],
+        initializer: Callable[[Any], Any],
+        dataframe: Optional[StreamingDataFrame],
+        provisional_interval_ms: Optional[int] = None,
+        closed_by_key: bool = False,
+    ):
+        """
+        Args:
+            duration_ms (int): The length of the windows.
+            name (str): The name of the window store.
+            reducer (Callable): Updates the state of a window with the next record.
+            initializer (Callable): Returns the state of a window from its first record.
+            dataframe (Optional[StreamingDataFrame]): The dataframe the window is applied to.
+            provisional_interval_ms (Optional[int]): If set, `final()` also emits the open
+                windows as provisional candles, at most once every `provisional_interval_ms`
+                per window. No provisional candles if None.
+            closed_by_key (bool): Whether the windows of a key are closed by the records of
+                that key only, and no record is dropped as late (see the module docstring).
+                For records that come in timestamp order for each key.
+        """
+
+        def aggregate(start_ms: int, end_ms: int, timestamp_ms: int, value: Any, state: WindowedState):
+            current = state.get_window(start_ms=start_ms, end_ms=end_ms)
+            if current is None or current == EMPTY_WINDOW:
+                updated = initializer(value)
+            else:
+                updated = reducer(current, value)
+            state.update_window(start_ms, end_ms, timestamp_ms=timestamp_ms, value=updated)
+            return updated
+
+        super().__init__(
+            duration_ms=duration_ms, grace_ms=0, name=name, aggregate_func=aggregate, dataframe=dataframe
+        )
+        self._throttle = None if provisional_interval_ms is None else ProvisionalThrottle(provisional_interval_ms)
+        self._closed_by_key = closed_by_key
+
+    def process_window(self, value: Any, timestamp_ms: int, state: WindowedState) -> Tuple[List[dict], List[dict]]:
+        if is_tick(value):
+            self._move_watermark(value.watermark_ms, state)
+            updated = []
+            expired = self._expire_windows(state, value.watermark_ms if self._closed_by_key else None)
+        elif self._closed_by_key:
+            start_ms = timestamp_ms - timestamp_ms % self._duration_ms
+            end_ms = start_ms + self._duration_ms
+            aggregated = self._aggregate_func(start_ms, end_ms, timestamp_ms, value, state)
+            updated = [{'start': start_ms, 'end': end_ms, 'value': self._merge_func(aggregated)}]
+            # The windows of the key before this record are complete
+            expired = self._expire_windows(state, timestamp_ms)
+        else:
+            updated, expired = super().process_window(value=value, timestamp_ms=timestamp_ms, state=state)
+
+        # The windows the ticks opened and no trade came in are not candles
+        return updated, [window for window in expired if window['value'] != EMPTY_WINDOW]
+
+    def _expire_windows(self, state: WindowedState, closed_before_ms: Optional[int] = None) -> List[dict]:
+        """
+        Closes the windows of the key that end at or before `closed_before_ms`, or at or
+        before the latest timestamp of the partition if None.
+        """
+        grace_ms = self._grace_ms
+        if closed_before_ms is not None:
+            # The store closes the windows that end at or before its latest timestamp minus the grace
+            grace_ms = max(grace_ms, state.get_latest_timestamp() - closed_before_ms)
+        return [
+            {'start': start, 'end': end, 'value': self._merge_func(aggregated)}
+            for (start, end), aggregated in state.expire_windows(duration_ms=self._duration_ms, grace_ms=grace_ms)
+        ]
+
+    def _move_watermark(self, watermark_ms: int, state: WindowedState) -> None:
+        """
+        Moves the latest timestamp of the partition up to the watermark. The store only
+        moves it when a window is updated, so we update the window of the watermark (and
+        open an empty one if there is none).
+        """
+        if watermark_ms <= state.get_latest_timestamp():
+            return
+        start_ms = watermark_ms - watermark_ms % self._duration_ms
+        end_ms = start_ms + self._duration_ms
+        current = state.get_window(start_ms=start_ms, end_ms=end_ms)
+        state.update_window(
+            start_ms, end_ms, timestamp_ms=watermark_ms, value=EMPTY_WINDOW if current is None else current
+        )
+
+    def _held_back_windows(self, key: Any, state: WindowedState) -> List[Tuple[dict, Any, int, Any]]:
+        """
+        Returns the provisional candles of the open windows of `key` with an update that
+        the throttle held back and that are due now (the trailing edge).
+        """
+        results = []
+        for start_ms in self._throttle.held_back_due(key):
+            end_ms = start_ms + self._duration_ms
+            current = state.get_window(start_ms=start_ms, end_ms=end_ms)
+            if current is not None and current != EMPTY_WINDOW:
+                window = {'start': start_ms, 'end': end_ms, 'value': self._merge_func(current)}
+                results.append((window, key, start_ms, PROVISIONAL_HEADERS))
+        return results
+
+    def final(self) -> StreamingDataFrame:
+        """
+        Returns the closed windows, like `.final()`, and passes the ticks on (its own ones
+        after the windows they have closed). With provisional candles, the open window a
+        record has updated follows the windows it has closed, with the `PROVISIONAL_HEADERS`.
+        """
+
+        def window_callback(value: Any, key: Any, timestamp_ms: int, _headers: Any, state: WindowedState):
+            if is_tick(value) and value.duration_ms != self._duration_ms:
+                # The tick of another resolution, further down the pipeline
+                return [(value, key, timestamp_ms, None)]
+
+            updated, expired = self.process_window(value=value, timestamp_ms=timestamp_ms, state=state)
+            # A closed window keeps its start as the timestamp, as with `.final()`
+            results = [(window, key, window['start'], None) for window in expired]
+
+            if self._throttle is not None:
+                for window in expired:
+                    self._throttle.forget(key, window['start'])
+
+            if is_tick(value):
+                if self._throttle is not None:
+                    # The open windows with an update that the throttle held back
+                    results.extend(self._held_back_windows(key, state))
+                # After the windows it has closed, for the steps that follow the window
+                results.append((value, key, timestamp_ms, None))
+            elif self._throttle is not None:
+                results.extend(
+                    (window, key, window['start'], PROVISIONAL_HEADERS)
+                    for window in updated
+                    if self._throttle.is_due(key, window['start'])
+                )
+            return results
+
+        return self._apply_window(func=window_callback, name=self._name)
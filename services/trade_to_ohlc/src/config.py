@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import Dict, List, Optional
 
 class AppConfig(BaseSettings):
     kafka_broker_address: str
@@ -6,6 +7,56 @@ class AppConfig(BaseSettings):
     kafka_output_topic: str
     kafka_consumer_group: str
     ohlcv_window_seconds: int
+    # The coarser candles aggregated from the OHLCV_WINDOW_SECONDS ones, as {seconds: output topic},
+    # e.g. {"300": "ohlcv_5m", "3600": "ohlcv_1h"}; each length must be a multiple of the previous one
+    ohlcv_cascade: Dict[int, str] = {}
+    # The encoding of the candles: 'json', or 'protobuf' for compact schema-registered
+    # messages (needs schema_registry_url). The trades are read in either encoding.
+    kafka_value_encoding: str = 'json'
+    schema_registry_url: Optional[str] = None
+    # Whether the trades have fixed-point integer prices and quantities (FIXED_POINT_DECIMALS
+    # in the trade producer); the candles are then fixed-point too
+    fixed_point: bool = False
+
+    # The directory of the window stores, kept across restarts so the windows resume where
+    # they were. Bump STATE_VERSION to start the windows over (e.g. after a change of the
+    # candle state): it is part of the names of the stores and their changelog topics.
+    state_dir: str = 'state'
+    # 2: the candle state has the notional, the trade count and the buy and sell volumes
+    state_version: int = 2
+
+    # If set, a window is also closed WALL_CLOCK_GRACE_MS after its end on the wall clock,
+    # without waiting for the next trade of its product. For live trades only: the
+    # historical ones are far behind the wall clock.
+    wall_clock_grace_ms: Optional[int] = None
+    punctuation_interval_ms: int = 1000
+
+    # If set, the open candles are also written to KAFKA_PROVISIONAL_TOPIC as provisional
+    # candles (at most once every PROVISIONAL_INTERVAL_MS per candle), followed by their
+    # final candle, for the consumers that cannot wait for a candle to close
+    kafka_provisional_topic: Optional[str] = None
+    provisional_interval_ms: int = 250
+
+    # Whether to write an empty candle (no volume, the previous close) for the windows of a
+    # product without trades, so the candle series of each product is dense
+    fill_empty_windows: bool = False
+
+    # The information bars written alongside the candles, which close once a product has
+    # traded a threshold rather than on time, as {type: output topic} with the types
+    # 'tick', 'volume' and 'dollar', e.g. {"volume": "volume_bars"}, and the threshold of
+    # each type by product in the units of the trades, e.g. {"volume": {"BTC/EUR": 10}}
+    kafka_bar_topics: Dict[str, str] = {}
+    bar_thresholds: Dict[str, Dict[str, float]] = {}
+
+    # 'stream' to aggregate the trades as they come, or 'batch' to backfill the candles of
+    # historical trades at once (see backfill_trade_to_ohlcv)
+    ohlcv_mode: str = 'stream'
+    # The number of days of trades the batch mode aggregates (the whole input topic if None)
+    backfill_last_n_days: Optional[int] = None
+    # If set, the batch mode reads the trades of PRODUCT_IDS from the trade archive of the
+    # trade producer instead of the input topic
+    trade_archive_dir: Optional[str] = None
+    product_ids: List[str] = []
 
     # This is the first time Paulo has used this construct to load the environment variables
     # He usually uses the model_config to load the environment variables
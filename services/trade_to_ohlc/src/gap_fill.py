@@ -0,0 +1,108 @@
+"""
+Empty candles for the windows without trades.
+
+A window without trades has no candle, so the candle series of a product has holes
+where the market was quiet. With gap filling, each window of a product between two
+candles gets an empty candle: no trades and no volume, and the close of the previous
+candle as its open, high, low, close and VWAP. The series of a product is then dense from its first candle
+on, and the consumers can index it by position.
+
+The empty candles of a product are written just before its next candle. With the
+wall-clock ticks (see src.wall_clock) they are also written when the tick of their
+resolution closes their window, so a quiet product does not wait for its next trade.
+They only go to the candle topics: the coarser resolutions are aggregated from the
+candles with trades, and fill their own empty windows.
+"""
+from typing import Any, Dict, List, Optional
+
+from quixstreams.context import message_context
+from quixstreams.dataframe import StreamingDataFrame
+from quixstreams.models import Row, Topic
+from quixstreams.state import State
+
+from src.wall_clock import is_tick
+from src.window_state import get_store_name
+
+
+def empty_candles(last_candle: Dict[str, Any], to_ms: int, window_ms: int) -> List[Dict[str, Any]]:
+    """
+    Returns the empty candles of the windows between `last_candle` and `to_ms`,
+    forward-filled with its close.
+
+    Args:
+        last_candle (Dict[str, Any]): The last candle record of the product before them.
+        to_ms (int): The end of the last empty window (a window boundary).
+        window_ms (int): The length of the candles.
+
+    Returns:
+        List[Dict[str, Any]]: The candle records, in time order.
+    """
+    close = last_candle['close']
+    # Zeros of the types of the volumes and of the notional (floats, or fixed-point integers)
+    volume = type(last_candle['volume'])(0)
+    notional = type(last_candle['notional'])(0)
+    return [
+        {
+            'product_id': last_candle['product_id'],
+            'timestamp_ms': end_ms,
+            'open': close,
+            'high': close,
+            'low': close,
+            'close': close,
+            'volume': volume,
+            'vwap': close,
+            'trade_count': 0,
+            'buy_volume': volume,
+            'sell_volume': volume,
+            'notional': notional,
+        }
+        for end_ms in range(last_candle['timestamp_ms'] + window_ms, to_ms + 1, window_ms)
+    ]
+
+
+def write_empty_candles(sdf: StreamingDataFrame, topic: Topic, window_seconds: int, state_version: int) -> StreamingDataFrame:
+    """
+    Writes the empty candles of each product to the topic, before its next candle or
+    when a tick of the resolution closes their window. It goes right before the candles
+    are written to the same topic.
+
+    Args:
+        sdf (StreamingDataFrame): The candle records of one resolution (and the ticks).
+        topic (Topic): The candle topic of the resolution.
+        window_seconds (int): The length of the candles.
+        state_version (int): The version of the window state (the first candles of a new
+            version start the series over).
+
+    Returns:
+        StreamingDataFrame: The same records.
+    """
+    producer = sdf.processing_context.producer
+    window_ms = window_seconds * 1000
+    # The last candle we wrote for the key, with or without trades
+    last_candle_key = get_store_name(f'last_candle_{window_seconds}s', state_version)
+
+    def produce(candles: List[Dict[str, Any]], key: Any, headers: Any, state: State):
+        for candle in candles:
+            # A candle keeps the start of its window as the timestamp, like the others
+            timestamp = candle['timestamp_ms'] - window_ms
+            row = Row(value=candle, key=key, timestamp=timestamp, context=message_context(), headers=headers)
+            producer.produce_row(row=row, topic=topic, key=key, timestamp=timestamp)
+        if candles:
+            state.set(last_candle_key, candles[-1])
+
+    def fill(value: Any, key: Any, timestamp: int, headers: Any, state: State):
+        last_candle: Optional[Dict[str, Any]] = state.get(last_candle_key)
+
+        if is_tick(value):
+            if value.duration_ms == window_ms and last_candle is not None:
+                # The windows that end at or before the watermark are closed
+                closed_until_ms = value.watermark_ms - value.watermark_ms % window_ms
+                produce(empty_candles(last_candle, closed_until_ms, window_ms), key, None, state)
+            return
+
+        if last_candle is not None:
+            produce(empty_candles(last_candle, value['timestamp_ms'] - window_ms, window_ms), key, headers, state)
+        # The candle itself is written by the next step
+        state.set(last_candle_key, value)
+
+    return sdf.update(fill, stateful=True, metadata=True)
@@ -0,0 +1,156 @@
+"""
+Information bars: candles sampled on the activity of the market instead of the clock.
+
+A time candle closes every OHLCV_WINDOW_SECONDS, whatever happened in it, so the quiet
+hours give nearly empty candles and a burst is squeezed into one. An information bar
+closes once its product has traded a given amount since the previous bar:
+
+- tick bars: a number of trades,
+- volume bars: a quantity of the base currency,
+- dollar bars: a notional (price times quantity) in the quote currency.
+
+Each product has its own threshold, since a BTC/EUR volume bar would take forever with
+the threshold of a small coin. The trade that reaches the threshold closes the bar (the
+trades are not split across bars). The bars have the same fields as the candles, with
+the time of their last trade as the timestamp, and are written to a topic of their own.
+
+The open bar of each product is kept in the state of the application, like the windows,
+so a restart resumes it.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from quixstreams.context import message_context
+from quixstreams.dataframe import StreamingDataFrame
+from quixstreams.models import Row, Topic
+from quixstreams.state import State
+
+from src.wall_clock import is_tick
+from src.window_state import get_store_name
+
+BAR_TYPES = ('tick', 'volume', 'dollar')
+
+
+def check_bars(
+    bar_topics: Dict[str, str], bar_thresholds: Dict[str, Dict[str, float]]
+) -> List[Tuple[str, str, Dict[str, float]]]:
+    """
+    Returns the information bars to write, as (bar type, topic, thresholds by product),
+    after checking them.
+
+    Raises:
+        ValueError: If a bar type is unknown, or has no thresholds or a non-positive one.
+    """
+    bars = []
+    for bar_type, topic_name in sorted(bar_topics.items()):
+        if bar_type not in BAR_TYPES:
+            raise ValueError(f'Unknown bar type {bar_type}, it must be one of {", ".join(BAR_TYPES)}')
+        thresholds = bar_thresholds.get(bar_type)
+        if not thresholds:
+            raise ValueError(f'The {bar_type} bars need a threshold for at least one product')
+        for product_id, threshold in thresholds.items():
+            if threshold <= 0:
+                raise ValueError(f'The {bar_type} bar threshold of {product_id} must be positive, not {threshold}')
+        bars.append((bar_type, topic_name, thresholds))
+    return bars
+
+
+def add_trade_to_bar(
+    bar: Optional[dict],
+    trade: Any,
+    timestamp_ms: int,
+    threshold: float,
+    measure: int,
+    initializer: Callable[[Any], list],
+    reducer: Callable[[list, Any], list],
+) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Adds a trade to the open bar of its product.
+
+    Args:
+        bar (Optional[dict]): The open bar ({'start', 'end', 'value'}, like a window, with
+            the times of its first and last trades), or None to start a new one.
+        trade (Any): The trade.
+        timestamp_ms (int): The timestamp of the trade.
+        threshold (float): The threshold of the product.
+        measure (int): The field of the candle state compared to the threshold.
+        initializer (Callable): Returns the candle state of a bar from its first trade.
+        reducer (Callable): Updates the candle state of a bar with the next trade.
+
+    Returns:
+        Tuple[Optional[dict], Optional[dict]]: The open bar and the bar the trade has
+            closed. One of them is None.
+    """
+    if bar is None:
+        bar = {'start': timestamp_ms, 'end': timestamp_ms, 'value': initializer(trade)}
+    else:
+        bar['value'] = reducer(bar['value'], trade)
+        # the trades can be a bit out of order
+        bar['start'], bar['end'] = min(bar['start'], timestamp_ms), max(bar['end'], timestamp_ms)
+
+    if bar['value'][measure] < threshold:
+        return bar, None
+    return None, bar
+
+
+def write_information_bars(
+    sdf: StreamingDataFrame,
+    topic: Topic,
+    bar_type: str,
+    thresholds: Dict[str, float],
+    measure: int,
+    initializer: Callable[[Any], list],
+    reducer: Callable[[list, Any], list],
+    to_record: Callable[[dict, Any, int, Any], dict],
+    state_version: int,
+) -> StreamingDataFrame:
+    """
+    Aggregates the trades of each product into information bars, and writes each bar to
+    the topic when it closes. It goes before the time windows, and passes the trades (and
+    the ticks) on unchanged.
+
+    Args:
+        sdf (StreamingDataFrame): The trades (and the ticks).
+        topic (Topic): The topic of the bars.
+        bar_type (str): 'tick', 'volume' or 'dollar', for the name of the state.
+        thresholds (Dict[str, float]): The amount each product trades in a bar, in the
+            units of the trades (fixed-point units with fixed-point trades). The products
+            without one have no bars.
+        measure (int): The field of the candle state compared to the threshold (the trade
+            count, the volume or the notional).
+        initializer (Callable): Returns the candle state of a bar from its first trade.
+        reducer (Callable): Updates the candle state of a bar with the next trade.
+        to_record (Callable): Turns a closed bar ({'start', 'end', 'value'}, like a closed
+            window) into the record we write.
+        state_version (int): The version of the state (a new one starts the bars over).
+
+    Returns:
+        StreamingDataFrame: The same records.
+    """
+    producer = sdf.processing_context.producer
+    # The open bar of the key: its candle state, and the times of its first and last trades
+    bar_key = get_store_name(f'{bar_type}_bar', state_version)
+
+    def aggregate(value: Any, key: Any, timestamp: int, headers: Any, state: State):
+        if is_tick(value):
+            # The bars do not close on time
+            return
+        threshold = thresholds.get(value['product_id'])
+        if threshold is None:
+            return
+
+        bar, closed_bar = add_trade_to_bar(
+            state.get(bar_key), value, timestamp, threshold, measure, initializer, reducer
+        )
+        if closed_bar is None:
+            state.set(bar_key, bar)
+            return
+
+        # The bar keeps the time of its first trade as the timestamp, like a closed window
+        # keeps its start, and the time of its last trade as its timestamp_ms
+        record = to_record(closed_bar, key, closed_bar['start'], headers)
+        timestamp = closed_bar['start']
+        row = Row(value=record, key=key, timestamp=timestamp, context=message_context(), headers=headers)
+        producer.produce_row(row=row, topic=topic, key=key, timestamp=timestamp)
+        state.delete(bar_key)
+
+    return sdf.update(aggregate, stateful=True, metadata=True)
@@ -1,37 +1,180 @@
 from quixstreams import Application
-from datetime import timedelta
+from quixstreams.dataframe import StreamingDataFrame
+from quixstreams.state import State
+from datetime import datetime, timezone
 from loguru import logger
+import numpy as np
+from kafka_serialization import (
+    CANDLE_CODEC,
+    FIXED_POINT_CANDLE_CODEC,
+    FIXED_POINT_TRADE_CODEC,
+    TRADE_CODEC,
+    AutoDeserializer,
+    get_value_serializer,
+)
+from trade_archive_layout import DAY_MS
+from src.batch_ohlcv import (
+    CANDLE_RECORD_FIELDS,
+    compute_ohlcv,
+    produce_candles,
+    read_archived_trades,
+    read_topic_trades,
+)
 from src.config import config
-from typing import Any, List, Optional, Tuple
+from src.candle_window import CandleWindow
+from src.gap_fill import write_empty_candles
+from src.information_bars import check_bars, write_information_bars
+from src.provisional import is_provisional, to_provisional_topic
+from src.wall_clock import WallClockApplication, is_tick, to_topic
+from src.window_state import clear_other_state_versions, get_store_name
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-def init_ohlcv_candle(trade: dict):
+# The state of a candle is a fixed-layout list, [open, high, low, close, volume, notional,
+# trade_count, buy_volume, sell_volume]: the window store keeps one per window and
+# rewrites it on every trade, so it holds no field names and no product_id (the product
+# is the key of the messages). The VWAP is the notional over the volume, computed once
+# when the window closes.
+OPEN, HIGH, LOW, CLOSE, VOLUME, NOTIONAL, TRADE_COUNT, BUY_VOLUME, SELL_VOLUME = range(9)
+
+# The taker side of a trade (the trades without one count in neither side's volume)
+BUY, SELL = 1, -1
+
+# The field of the candle state that each type of information bar is sampled on
+BAR_MEASURES = {'tick': TRADE_COUNT, 'volume': VOLUME, 'dollar': NOTIONAL}
+
+def init_ohlcv_candle(trade: dict) -> list:
     """
     Returns the initial state of the OHLCV candle.
     """
-    return {
-        'open': trade['price'],
-        'high': trade['price'],
-        'low': trade['price'],
-        'close': trade['price'],
-        'volume': trade['quantity'],
-        'product_id': trade['product_id'],
-        #'timestamp_ms': trade['timestamp_ms'],
-    }
+    price, quantity = trade['price'], trade['quantity']
+    side = trade.get('side', 0)
+    # A zero of the type of the quantities (floats, or fixed-point integers)
+    zero = quantity * 0
+    return [
+        price, price, price, price, quantity, price * quantity, 1,
+        quantity if side == BUY else zero,
+        quantity if side == SELL else zero,
+    ]
 
-def update_ohlvc_candle(candle: dict, trade: dict):
+def update_ohlvc_candle(candle: list, trade: dict) -> list:
     """
     Updates the OHLCV candle with the new trade data.
     """
     # Open price is the price of the first trade in the window
-    candle['high'] = max(candle['high'], trade['price'])
-    candle['low'] = min(candle['low'], trade['price'])
-    candle['close'] = trade['price']
-    candle['volume'] += trade['quantity']
-    #candle['timestamp_ms'] = trade['timestamp_ms']
-    candle['product_id'] = trade['product_id']
+    price = trade['price']
+    if price > candle[HIGH]:
+        candle[HIGH] = price
+    elif price < candle[LOW]:
+        candle[LOW] = price
+    candle[CLOSE] = price
+    quantity = trade['quantity']
+    candle[VOLUME] += quantity
+    candle[NOTIONAL] += price * quantity
+    candle[TRADE_COUNT] += 1
+    side = trade.get('side', 0)
+    if side == BUY:
+        candle[BUY_VOLUME] += quantity
+    elif side == SELL:
+        candle[SELL_VOLUME] += quantity
 
     return candle
 
+def init_ohlcv_candle_from_candle(candle: dict) -> list:
+    """
+    Returns the initial state of a coarser OHLCV candle, from the first finer candle in it.
+    """
+    return [
+        candle['open'], candle['high'], candle['low'], candle['close'], candle['volume'],
+        candle['notional'], candle['trade_count'], candle['buy_volume'], candle['sell_volume'],
+    ]
+
+def merge_ohlcv_candles(candle: list, finer_candle: dict) -> list:
+    """
+    Updates a coarser OHLCV candle with the next finer candle in it.
+    """
+    if finer_candle['high'] > candle[HIGH]:
+        candle[HIGH] = finer_candle['high']
+    if finer_candle['low'] < candle[LOW]:
+        candle[LOW] = finer_candle['low']
+    candle[CLOSE] = finer_candle['close']
+    candle[VOLUME] += finer_candle['volume']
+    candle[NOTIONAL] += finer_candle['notional']
+    candle[TRADE_COUNT] += finer_candle['trade_count']
+    candle[BUY_VOLUME] += finer_candle['buy_volume']
+    candle[SELL_VOLUME] += finer_candle['sell_volume']
+
+    return candle
+
+def to_candle_record(window: dict, key: Any, timestamp: int, headers: Any) -> dict:
+    """
+    Turns a closed window ({'start', 'end', 'value'}) into the candle record we write, in
+    one step. The product_id is the key of the message.
+    """
+    if is_tick(window):
+        return window
+    candle = window['value']
+    return {
+        'product_id': key.decode() if isinstance(key, bytes) else key,
+        'timestamp_ms': window['end'],
+        'open': candle[OPEN],
+        'high': candle[HIGH],
+        'low': candle[LOW],
+        'close': candle[CLOSE],
+        'volume': candle[VOLUME],
+        # the candles of trades without quantity have no VWAP, and fall back to the close
+        'vwap': candle[NOTIONAL] / candle[VOLUME] if candle[VOLUME] else candle[CLOSE],
+        'trade_count': candle[TRADE_COUNT],
+        'buy_volume': candle[BUY_VOLUME],
+        'sell_volume': candle[SELL_VOLUME],
+        'notional': candle[NOTIONAL],
+    }
+
+def to_candle_records(sdf: StreamingDataFrame) -> StreamingDataFrame:
+    """
+    Turns the closed windows into the candle records we write.
+    """
+    return sdf.apply(to_candle_record, metadata=True)
+
+def skip_first_candle(window_seconds: int, state_version: int) -> Callable[[dict, Any, int, Any, State], bool]:
+    """
+    Returns a stateful filter that drops the first closed window of each key in a new
+    version of the window state. That window started before the state did, so it is
+    missing the trades before the start or the reset. On a plain restart the windows are
+    resumed, and every window is kept. The provisional candles of the first window are
+    dropped too.
+    """
+    started_key = get_store_name(f'started_{window_seconds}s', state_version)
+
+    def is_complete(window: dict, key: Any, timestamp: int, headers: Any, state: State) -> bool:
+        if is_tick(window) or state.get(started_key):
+            return True
+        if is_provisional(headers):
+            return False
+        state.set(started_key, True)
+        return False
+
+    return is_complete
+
+def check_cascade(ohlcv_window_seconds: int, cascade: Dict[int, str]) -> List[Tuple[int, str]]:
+    """
+    Returns the coarser resolutions from the finest to the coarsest, after checking that
+    each one is a whole number of the previous one, so every finer candle falls in
+    exactly one coarser candle.
+
+    Raises:
+        ValueError: If a resolution is not a multiple of the previous one.
+    """
+    resolutions = sorted(cascade.items())
+    previous = ohlcv_window_seconds
+    for window_seconds, _ in resolutions:
+        if window_seconds <= previous or window_seconds % previous != 0:
+            raise ValueError(
+                f'A {window_seconds}s candle cannot be built from {previous}s candles, '
+                f'it must be a multiple of {previous}s'
+            )
+        previous = window_seconds
+    return resolutions
+
 def custom_ts_extractor(
         value: Any,
         headers: Optional[List[Tuple[str, bytes]]],
@@ -49,79 +192,340 @@ def transform_trade_to_ohlcv(
         kafka_input_topic: str,
         kafka_output_topic: str,
         kafka_consumer_group: str,
-        ohlcv_window_seconds: int
+        ohlcv_window_seconds: int,
+        kafka_value_encoding: str = 'json',
+        schema_registry_url: Optional[str] = None,
+        fixed_point: bool = False,
+        ohlcv_cascade: Optional[Dict[int, str]] = None,
+        state_dir: str = 'state',
+        state_version: int = 2,
+        wall_clock_grace_ms: Optional[int] = None,
+        punctuation_interval_ms: int = 1000,
+        kafka_provisional_topic: Optional[str] = None,
+        provisional_interval_ms: int = 250,
+        fill_empty_windows: bool = False,
+        kafka_bar_topics: Optional[Dict[str, str]] = None,
+        bar_thresholds: Optional[Dict[str, Dict[str, float]]] = None,
 ):
     """
     Reads incoming traged from the given Kafka topic, transforms them into OHLC data and writes them to the output Kafka topic.
 
+    The trades are aggregated into candles of `ohlcv_window_seconds` only. Each coarser
+    resolution of `ohlcv_cascade` is aggregated from the closed candles of the previous
+    one, in the same process, so the trades are consumed and deserialized once whatever
+    the number of resolutions.
+
     Args:
         kafka_broker_address (str): The address of the Kafka broker.
         kafka_input_topic (str): The name of the Kafka topic to read the trades from.
         kafka_output_topic (str): The name of the Kafka topic to write the OHLC data to.
         kafka_consumer_group (str): The name of the Kafka consumer group.
+        ohlcv_window_seconds (int): The length of the candles in seconds.
+        kafka_value_encoding (str): The encoding of the candles we write: 'json', or 'protobuf' for schema-registered Protobuf messages.
+        schema_registry_url (Optional[str]): The URL of the schema registry (protobuf only).
+        fixed_point (bool): Whether the prices and quantities are fixed-point integers. The
+            candles are then integers in the same units, and their volume is an exact sum.
+        ohlcv_cascade (Optional[Dict[int, str]]): The coarser candle lengths in seconds, and the
+            Kafka topic each of them is written to. Each length must be a multiple of the previous one.
+        state_dir (str): The directory of the window stores, which must outlive the process
+            (a volume in Docker) for a restart to resume the windows.
+        state_version (int): The version of the window state, part of the names of the stores.
+            Changing it resets the state.
+        wall_clock_grace_ms (Optional[int]): If set, a window is also closed this long after its
+            end on the wall clock, without waiting for the next trade of its product (live only).
+        punctuation_interval_ms (int): How often we check the wall clock for windows to close.
+        kafka_provisional_topic (Optional[str]): If set, the open OHLCV_WINDOW_SECONDS candles are
+            also written to this topic as provisional candles, followed by their final candle
+            (told apart by their `candle_status` header).
+        provisional_interval_ms (int): The least time between two provisional candles of a window.
+        fill_empty_windows (bool): Whether to write an empty candle (no volume, the previous close)
+            for each window of a product without trades, so the candles of a product are dense.
+        kafka_bar_topics (Optional[Dict[str, str]]): The information bars to write alongside the
+            candles ('tick', 'volume' or 'dollar', see src.information_bars), and the Kafka topic
+            of each type.
+        bar_thresholds (Optional[Dict[str, Dict[str, float]]]): The threshold of each type of
+            bar, by product, in the units of the trades.
     Returns:
         None
     """
 
     # Create an application with Kafka configuration
-    app = Application(broker_address=kafka_broker_address,
-                      # We need to set the consumer group to read the data from the topic
-                      consumer_group=kafka_consumer_group,
-                      # auto_offset_reset="latest" # this line is not in the original code
-                      )
-    try:
-        app.clear_state() # Clear the state of the application
-    except (FileNotFoundError):
-        pass
-
-    # Define the Kafka topic with JSON serialization
-    input_topic = app.topic(name=kafka_input_topic, value_serializer='json', timestamp_extractor=custom_ts_extractor)
-    output_topic = app.topic(name=kafka_output_topic, value_serializer='json')
+    app = WallClockApplication(broker_address=kafka_broker_address,
+                               # We need to set the consumer group to read the data from the topic
+                               consumer_group=kafka_consumer_group,
+                               # auto_offset_reset="latest" # this line is not in the original code
+                               state_dir=state_dir,
+                               # Close the windows on time in quiet markets
+                               wall_clock_grace_ms=wall_clock_grace_ms,
+                               punctuation_interval_ms=punctuation_interval_ms,
+                               )
+
+    # The windows are checkpointed with the committed offsets, so a restart resumes them
+    # instead of writing truncated candles. The state is only reset on purpose, by bumping
+    # the state version, which is part of the names of the stores, so the changelog topics
+    # of the old ones do not bring the old state back.
+    clear_other_state_versions(state_dir, kafka_consumer_group, state_version)
+
+    # The reducer works the same on floats and on fixed-point integers, only the Protobuf
+    # schemas are different
+    trade_codec = FIXED_POINT_TRADE_CODEC if fixed_point else TRADE_CODEC
+    candle_codec = FIXED_POINT_CANDLE_CODEC if fixed_point else CANDLE_CODEC
+
+    # Define the Kafka topics. The trades can be JSON or Protobuf (we look at each message),
+    # and the candles are written in the configured encoding
+    input_topic = app.topic(name=kafka_input_topic, value_deserializer=AutoDeserializer(trade_codec), timestamp_extractor=custom_ts_extractor)
+    output_topic = app.topic(
+        name=kafka_output_topic,
+        value_serializer=get_value_serializer(kafka_value_encoding, candle_codec, schema_registry_url, kafka_output_topic),
+    )
+    # The coarser resolutions, from the finest to the coarsest, each with its own topic
+    cascade = check_cascade(ohlcv_window_seconds, ohlcv_cascade or {})
+    cascade_topics = [
+        (
+            window_seconds,
+            app.topic(
+                name=topic_name,
+                value_serializer=get_value_serializer(kafka_value_encoding, candle_codec, schema_registry_url, topic_name),
+            ),
+        )
+        for window_seconds, topic_name in cascade
+    ]
+    # The information bars, each type with its own topic
+    bars = [
+        (
+            bar_type,
+            app.topic(
+                name=topic_name,
+                value_serializer=get_value_serializer(kafka_value_encoding, candle_codec, schema_registry_url, topic_name),
+            ),
+            thresholds,
+        )
+        for bar_type, topic_name, thresholds in check_bars(kafka_bar_topics or {}, bar_thresholds or {})
+    ]
+    # The in-progress candles, if anyone wants them
+    provisional_topic = None
+    if kafka_provisional_topic is not None:
+        provisional_topic = app.topic(
+            name=kafka_provisional_topic,
+            value_serializer=get_value_serializer(kafka_value_encoding, candle_codec, schema_registry_url, kafka_provisional_topic),
+        )
 
     # Create a Quix Steam Dataframe
     sdf = app.dataframe(input_topic)
 
+    # Keep track of the products of each partition, to close their windows on time
+    sdf = app.track_keys(sdf, [ohlcv_window_seconds * 1000] + [window_seconds * 1000 for window_seconds, _ in cascade])
+
     # Check if we are actually reading the trades
     sdf.update(logger.debug)
 
-    # Aggregates trades into OHLCV candles
-    sdf = (
-        sdf.tumbling_window(duration_ms=timedelta(seconds=ohlcv_window_seconds))
-        .reduce(reducer=update_ohlvc_candle, initializer=init_ohlcv_candle)
-        # .current() # would be used if we wanted to get the current state of the window
-        .final() # is used to get the final state of the window (we wait for the window to close)
-    )
+    # Aggregates the trades into information bars, which close on the activity of each
+    # product rather than on time. The trades go on to the time windows.
+    for bar_type, bar_topic, thresholds in bars:
+        sdf = write_information_bars(
+            sdf,
+            bar_topic,
+            bar_type,
+            thresholds,
+            measure=BAR_MEASURES[bar_type],
+            initializer=init_ohlcv_candle,
+            reducer=update_ohlvc_candle,
+            to_record=to_candle_record,
+            state_version=state_version,
+        )
+
+    # Aggregates trades into OHLCV candles. The tumbling window reduces the trades like
+    # `sdf.tumbling_window(...).reduce(...)`, and is also closed by the wall clock.
+    sdf = CandleWindow(
+        duration_ms=ohlcv_window_seconds * 1000,
+        name=get_store_name(f'ohlcv_{ohlcv_window_seconds}s', state_version),
+        reducer=update_ohlvc_candle,
+        initializer=init_ohlcv_candle,
+        dataframe=sdf,
+        # The open windows too, as provisional candles
+        provisional_interval_ms=provisional_interval_ms if provisional_topic is not None else None,
+    ).final() # is used to get the final state of the window (we wait for the window to close)
+    sdf = sdf.filter(skip_first_candle(ohlcv_window_seconds, state_version), stateful=True, metadata=True)
 
     # Print the output to the console
     # sdf.update(logger.debug)
 
-    # Unpack the dictionary to separate columns
-    sdf["open"] = sdf["value"]["open"]
-    sdf["high"] = sdf["value"]["high"]
-    sdf["low"] = sdf["value"]["low"]
-    sdf["close"] = sdf["value"]["close"]
-    sdf["volume"] = sdf["value"]["volume"]
-    sdf["timestamp_ms"] = sdf["end"]
-    sdf["product_id"] = sdf["value"]["product_id"]
-
-    #Keep only the columns we need
-    sdf = sdf[["product_id","timestamp_ms", "open", "high", "low", "close", "volume"]]
+    sdf = to_candle_records(sdf)
 
     # Print the output to the console
     sdf.update(logger.debug)
 
-    # Write the output to the Kafka topic
-    sdf = sdf.to_topic(output_topic)
+    # Write the provisional candles and a copy of the final ones to their own topic. Only
+    # the final candles go on.
+    if provisional_topic is not None:
+        sdf = to_provisional_topic(sdf, provisional_topic)
+
+    # Fill the windows without trades with empty candles
+    if fill_empty_windows:
+        sdf = write_empty_candles(sdf, output_topic, ohlcv_window_seconds, state_version)
+
+    # Write the output to the Kafka topic (the ticks that close the windows go on)
+    sdf = to_topic(sdf, output_topic)
+
+    # Each closed candle goes on to the next resolution. A closed window keeps the start
+    # of the window as its timestamp, so it lands in the coarser window that contains it.
+    for window_seconds, cascade_topic in cascade_topics:
+        sdf = CandleWindow(
+            duration_ms=window_seconds * 1000,
+            name=get_store_name(f'ohlcv_{window_seconds}s', state_version),
+            reducer=merge_ohlcv_candles,
+            initializer=init_ohlcv_candle_from_candle,
+            dataframe=sdf,
+            # The candles of a quiet product are closed late for the partition, but in
+            # order for their product
+            closed_by_key=True,
+        ).final()
+        sdf = sdf.filter(skip_first_candle(window_seconds, state_version), stateful=True, metadata=True)
+        sdf = to_candle_records(sdf)
+        if fill_empty_windows:
+            sdf = write_empty_candles(sdf, cascade_topic, window_seconds, state_version)
+        sdf = to_topic(sdf, cascade_topic)
 
     # Write the output to the Kafka topic
     app.run(sdf)
 
+def backfill_trade_to_ohlcv(
+        kafka_broker_address: str,
+        kafka_input_topic: str,
+        kafka_output_topic: str,
+        kafka_consumer_group: str,
+        ohlcv_window_seconds: int,
+        kafka_value_encoding: str = 'json',
+        schema_registry_url: Optional[str] = None,
+        fixed_point: bool = False,
+        ohlcv_cascade: Optional[Dict[int, str]] = None,
+        last_n_days: Optional[int] = None,
+        trade_archive_dir: Optional[str] = None,
+        product_ids: Optional[List[str]] = None,
+        fill_empty_windows: bool = False,
+):
+    """
+    Computes the candles of a batch of historical trades at once, and writes them to the
+    same topics as `transform_trade_to_ohlcv`.
+
+    The trades are read from the trade archive if `trade_archive_dir` is given, one product
+    of `product_ids` at a time, and from the whole input topic otherwise, one partition at a
+    time. The candles are the ones the streaming pipeline would write for the same messages.
+    With `last_n_days`, only the trades of the last days (up to the last complete candle of
+    the coarsest resolution) are read, and all the candles of that range are closed.
+
+    Args:
+        kafka_broker_address (str): The address of the Kafka broker.
+        kafka_input_topic (str): The name of the Kafka topic to read the trades from.
+        kafka_output_topic (str): The name of the Kafka topic to write the OHLC data to.
+        kafka_consumer_group (str): The name of the Kafka consumer group.
+        ohlcv_window_seconds (int): The length of the candles in seconds.
+        kafka_value_encoding (str): The encoding of the candles we write: 'json' or 'protobuf'.
+        schema_registry_url (Optional[str]): The URL of the schema registry (protobuf only).
+        fixed_point (bool): Whether the prices and quantities are fixed-point integers.
+        ohlcv_cascade (Optional[Dict[int, str]]): The coarser candle lengths in seconds, and their topics.
+        last_n_days (Optional[int]): The number of days of trades to aggregate (the whole topic if None).
+        trade_archive_dir (Optional[str]): The directory of the trade archive (we read the topic if None).
+        product_ids (Optional[List[str]]): The products to read from the trade archive.
+        fill_empty_windows (bool): Whether to write empty candles for the windows without trades.
+    Returns:
+        None
+    """
+    cascade = check_cascade(ohlcv_window_seconds, ohlcv_cascade or {})
+    window_seconds = [ohlcv_window_seconds] + [seconds for seconds, _ in cascade]
+    topic_names = [kafka_output_topic] + [topic_name for _, topic_name in cascade]
+
+    if trade_archive_dir is not None and fixed_point:
+        raise ValueError('The trade archive has float prices and quantities, it cannot be read as fixed-point')
+
+    # The time range ends on a boundary of the coarsest candles, so the last ones are complete
+    if last_n_days is not None:
+        coarsest_ms = window_seconds[-1] * 1000
+        now_ms = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+        to_ms = now_ms - now_ms % coarsest_ms
+        from_ms = to_ms - last_n_days * DAY_MS
+        from_ms -= from_ms % coarsest_ms
+    elif trade_archive_dir is not None:
+        raise ValueError('Reading the trade archive needs the number of days to read')
+    else:
+        from_ms, to_ms = None, None
+
+    app = Application(broker_address=kafka_broker_address, consumer_group=kafka_consumer_group)
+    trade_codec = FIXED_POINT_TRADE_CODEC if fixed_point else TRADE_CODEC
+    candle_codec = FIXED_POINT_CANDLE_CODEC if fixed_point else CANDLE_CODEC
+
+    # One sequence of trades per partition of the topic, or per product of the archive
+    if trade_archive_dir is not None:
+        partitions = []
+        for product_id in product_ids or []:
+            timestamp_ms, price, quantity, side = read_archived_trades(trade_archive_dir, product_id, from_ms, to_ms)
+            logger.info(f'Read {len(timestamp_ms):,} trades of {product_id} from the archive')
+            partitions.append(([product_id] * len(timestamp_ms), timestamp_ms, price, quantity, side))
+    else:
+        partitions = []
+        for trades in read_topic_trades(app, kafka_input_topic, trade_codec):
+            product_id = np.asarray(trades['product_id'], dtype=object)
+            timestamp_ms = np.asarray(trades['timestamp_ms'], dtype=np.int64)
+            price, quantity = np.asarray(trades['price']), np.asarray(trades['quantity'])
+            # The trades written before we kept the side decode with none (0, unknown)
+            side = np.asarray([s or 0 for s in trades.get('side', [0] * len(timestamp_ms))], dtype=np.int8)
+            if from_ms is not None:
+                in_range = (timestamp_ms >= from_ms) & (timestamp_ms < to_ms)
+                product_id, timestamp_ms = product_id[in_range], timestamp_ms[in_range]
+                price, quantity, side = price[in_range], quantity[in_range], side[in_range]
+            partitions.append((product_id.tolist(), timestamp_ms, price, quantity, side))
+
+    # Aggregate each partition, and gather the candles of each resolution
+    candles = [{name: [] for name in CANDLE_RECORD_FIELDS} for _ in window_seconds]
+    for product_id, timestamp_ms, price, quantity, side in partitions:
+        results = compute_ohlcv(
+            product_id, timestamp_ms, price, quantity, window_seconds,
+            closed_before_ms=to_ms, fill_empty=fill_empty_windows, side=side,
+        )
+        for all_candles, result in zip(candles, results):
+            for name, values in result.items():
+                all_candles[name].extend(values)
+
+    # Write the candles in bulk
+    for topic_name, topic_candles in zip(topic_names, candles):
+        produce_candles(app, topic_name, topic_candles, kafka_value_encoding, schema_registry_url, candle_codec)
+
 if __name__ == '__main__':
-    transform_trade_to_ohlcv(
-        kafka_broker_address = config.kafka_broker_address,
-        kafka_input_topic = config.kafka_input_topic,
-        kafka_output_topic = config.kafka_output_topic,
-        kafka_consumer_group = config.kafka_consumer_group,
-        ohlcv_window_seconds = config.ohlcv_window_seconds
-    )
+    if config.ohlcv_mode == 'batch':
+        backfill_trade_to_ohlcv(
+            kafka_broker_address = config.kafka_broker_address,
+            kafka_input_topic = config.kafka_input_topic,
+            kafka_output_topic = config.kafka_output_topic,
+            kafka_consumer_group = config.kafka_consumer_group,
+            ohlcv_window_seconds = config.ohlcv_window_seconds,
+            kafka_value_encoding = config.kafka_value_encoding,
+            schema_registry_url = config.schema_registry_url,
+            fixed_point = config.fixed_point,
+            ohlcv_cascade = config.ohlcv_cascade,
+            last_n_days = config.backfill_last_n_days,
+            trade_archive_dir = config.trade_archive_dir,
+            product_ids = config.product_ids,
+            fill_empty_windows = config.fill_empty_windows,
+        )
+    else:
+        transform_trade_to_ohlcv(
+            kafka_broker_address = config.kafka_broker_address,
+            kafka_input_topic = config.kafka_input_topic,
+            kafka_output_topic = config.kafka_output_topic,
+            kafka_consumer_group = config.kafka_consumer_group,
+            ohlcv_window_seconds = config.ohlcv_window_seconds,
+            kafka_value_encoding = config.kafka_value_encoding,
+            schema_registry_url = config.schema_registry_url,
+            fixed_point = config.fixed_point,
+            ohlcv_cascade = config.ohlcv_cascade,
+            state_dir = config.state_dir,
+            state_version = config.state_version,
+            wall_clock_grace_ms = config.wall_clock_grace_ms,
+            punctuation_interval_ms = config.punctuation_interval_ms,
+            kafka_provisional_topic = config.kafka_provisional_topic,
+            provisional_interval_ms = config.provisional_interval_ms,
+            fill_empty_windows = config.fill_empty_windows,
+            kafka_bar_topics = config.kafka_bar_topics,
+            bar_thresholds = config.bar_thresholds,
+        )
 
@@ -0,0 +1,134 @@
+"""
+Provisional candles.
+
+The candle topics only get a candle once its window is closed. For the consumers that
+want to act on a candle while it is still open, a `CandleWindow` can also emit its open
+windows as provisional candles, at most once every `interval_ms` of wall-clock time per
+window (not once per trade). They are written to a topic of their own, with a
+`candle_status: provisional` header, followed by the final candle with a
+`candle_status: final` header when the window closes. The final candle is the
+authoritative one: the last provisional candle of a window can miss its last trades.
+
+A window is emitted on its first update (the leading edge), and an update that comes in
+less than `interval_ms` after the last emit is held back. The next wall-clock tick (see
+src.wall_clock) after the interval emits the held back window (the trailing edge), so
+with wall-clock closing a provisional candle lags its window by at most `interval_ms`
+plus the punctuation interval, even when no other trade of the product comes in. Without
+wall-clock closing (historical trades) there are no ticks, and a held back update waits
+for the next trade of the window or for the final candle.
+
+Inside the pipeline the provisional candles carry the same header, so the steps that
+only deal with closed windows (the candle topic and the coarser resolutions) can leave
+them out.
+"""
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from quixstreams.context import message_context
+from quixstreams.dataframe import StreamingDataFrame
+from quixstreams.models import Row, Topic
+
+from src.wall_clock import is_tick
+
+CANDLE_STATUS_HEADER = 'candle_status'
+PROVISIONAL_HEADERS = [(CANDLE_STATUS_HEADER, b'provisional')]
+FINAL_HEADERS = [(CANDLE_STATUS_HEADER, b'final')]
+
+
+def is_provisional(headers: Any) -> bool:
+    """
+    Returns whether a record of the pipeline is a provisional candle, from its headers.
+    """
+    return headers == PROVISIONAL_HEADERS
+
+
+class ProvisionalThrottle:
+    """
+    Decides when an open window is due for a provisional candle: on its first update, then
+    at most once every `interval_ms` (wall-clock), and once more after the interval for an
+    update that was held back. It is kept in memory only, and after a restart a window
+    simply starts over with a provisional candle.
+    """
+
+    def __init__(self, interval_ms: int, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            interval_ms (int): The least time between two provisional candles of a window.
+            clock (Callable[[], float]): Returns the current time in seconds.
+        """
+        self.interval_ms = interval_ms
+        self._clock = clock
+        # The wall-clock time (in seconds) after which each open window can be emitted again
+        self._next_emit: Dict[Tuple[Any, int], float] = {}
+        # The starts of the windows of each key with an update that was held back
+        self._held_back: Dict[Any, Set[int]] = {}
+
+    def is_due(self, key: Any, start_ms: int, now: Optional[float] = None) -> bool:
+        """
+        Returns True (and starts the next interval) if the window of `key` that starts at
+        `start_ms` can be emitted now. If not, the update is held back for `held_back_due`.
+        """
+        now = self._clock() if now is None else now
+        if now < self._next_emit.get((key, start_ms), 0.0):
+            self._held_back.setdefault(key, set()).add(start_ms)
+            return False
+        self._next_emit[(key, start_ms)] = now + self.interval_ms / 1000
+        self._release(key, start_ms)
+        return True
+
+    def held_back_due(self, key: Any, now: Optional[float] = None) -> List[int]:
+        """
+        Returns the starts of the windows of `key` with an update that was held back and
+        whose interval is over (and starts their next interval). The wall-clock ticks call
+        it, so the last update of a window is emitted without waiting for another trade.
+        """
+        starts = self._held_back.get(key)
+        if not starts:
+            return []
+        now = self._clock() if now is None else now
+        due = sorted(start_ms for start_ms in starts if now >= self._next_emit.get((key, start_ms), 0.0))
+        for start_ms in due:
+            self._next_emit[(key, start_ms)] = now + self.interval_ms / 1000
+            self._release(key, start_ms)
+        return due
+
+    def forget(self, key: Any, start_ms: int) -> None:
+        """
+        Drops a window that is closed.
+        """
+        self._next_emit.pop((key, start_ms), None)
+        self._release(key, start_ms)
+
+    def _release(self, key: Any, start_ms: int) -> None:
+        """
+        Drops the held back update of a window, if any.
+        """
+        starts = self._held_back.get(key)
+        if starts is not None:
+            starts.discard(start_ms)
+            if not starts:
+                del self._held_back[key]
+
+
+def to_provisional_topic(sdf: StreamingDataFrame, topic: Topic) -> StreamingDataFrame:
+    """
+    Writes the provisional candles, and a copy of the final ones, to the provisional topic
+    (each with its `candle_status` header), and leaves the provisional candles out of the
+    rest of the pipeline.
+    """
+    producer = sdf.processing_context.producer
+
+    def produce(value: Any, key: Any, timestamp: int, headers: Any):
+        if is_tick(value):
+            return
+        row = Row(
+            value=value,
+            key=key,
+            timestamp=timestamp,
+            context=message_context(),
+            headers=PROVISIONAL_HEADERS if is_provisional(headers) else FINAL_HEADERS,
+        )
+        producer.produce_row(row=row, topic=topic, key=key, timestamp=timestamp)
+
+    sdf = sdf.update(produce, metadata=True)
+    return sdf.filter(lambda value, key, timestamp, headers: not is_provisional(headers), metadata=True)
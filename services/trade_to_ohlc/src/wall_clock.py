@@ -0,0 +1,201 @@
+"""
+Wall-clock closing of the candle windows.
+
+A Quix window is closed by event time only: when a later message of the same key comes
+in. In a quiet market the last candle of a product can then wait a long time for the next
+trade. Quix 2.11 has no punctuation, so `WallClockApplication` injects a `WallClockTick`
+for every key it has seen into the pipeline, every `punctuation_interval_ms`, between two
+polls of the consumer. The tick carries a watermark (the wall-clock time minus a grace
+period), and the `CandleWindow` (see src.candle_window) it is for closes the windows that
+ended before it, like a later trade would. The other windows and the steps between them
+let it through without writing it.
+
+The latest timestamp of a window store is shared by all the keys of a partition, so we
+tick one resolution at a time, from the finest: every candle a round closes reaches the
+next resolution before the tick that closes the coarser windows it falls in.
+
+The keys of a partition are the ones of its first message since it was assigned, and the
+keys with an open window in the window stores at that point (restored from the local
+state or the changelog topics), so a restart does not leave the last window of a quiet
+product open until its next trade. A key with no open window (a product whose candles
+are only filled with empty ones) is ticked again from its next trade on, which then
+writes the empty candles it missed.
+
+The watermark is wall-clock time, so a partition only gets ticks once the consumer has
+caught up with it. A consumer that lags behind (after a restart, a rebalance or a slow
+spell) has its windows closed by the trades of the backlog, like historical trades, and
+the ticks would make it drop the whole backlog as late. The ticks are for live trades
+only: on a topic of historical trades the consumer is caught up at the end, and they
+would close every remaining window at once.
+"""
+import time
+from contextvars import copy_context
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from confluent_kafka import TopicPartition
+from quixstreams import Application
+from quixstreams.checkpointing.exceptions import InvalidStoredOffset
+from quixstreams.context import message_context, set_message_context
+from quixstreams.dataframe import StreamingDataFrame
+from quixstreams.models import MessageContext, Row, Topic
+from quixstreams.state.rocksdb.windowed.serialization import parse_window_key
+from quixstreams.state.rocksdb.windowed.store import WindowedRocksDBStore
+from rocksdict import ReadOptions
+
+class WallClockTick(NamedTuple):
+    """
+    A punctuation record: the windows of `duration_ms` that ended at or before
+    `watermark_ms` are closed.
+    """
+    watermark_ms: int
+    duration_ms: int
+
+
+def is_tick(value: Any) -> bool:
+    return isinstance(value, WallClockTick)
+
+
+def to_topic(sdf: StreamingDataFrame, topic: Topic) -> StreamingDataFrame:
+    """
+    Writes the records to the topic like `sdf.to_topic(topic)`, but not the ticks, which
+    go on to the rest of the pipeline.
+    """
+    producer = sdf.processing_context.producer
+
+    def produce(value: Any, key: Any, timestamp: int, headers: Any):
+        if is_tick(value):
+            return
+        row = Row(value=value, key=key, timestamp=timestamp, context=message_context(), headers=headers)
+        producer.produce_row(row=row, topic=topic, key=key, timestamp=timestamp)
+
+    return sdf.update(produce, metadata=True)
+
+
+class WallClockApplication(Application):
+    """
+    A Quix Application that closes the windows of `CandleWindow`s on wall-clock time, even
+    when no trade comes in (see the module docstring).
+    """
+
+    def __init__(
+        self,
+        *args,
+        wall_clock_grace_ms: Optional[int] = None,
+        punctuation_interval_ms: int = 1000,
+        **kwargs,
+    ):
+        """
+        Args:
+            wall_clock_grace_ms (Optional[int]): How long after its end (wall-clock) a window is
+                closed, to leave time for its last trades to arrive. No wall-clock closing if None.
+            punctuation_interval_ms (int): How often we send the ticks.
+            *args, **kwargs: The arguments of `Application`.
+        """
+        super().__init__(*args, **kwargs)
+        self.wall_clock_grace_ms = wall_clock_grace_ms
+        self.punctuation_interval_ms = punctuation_interval_ms
+        # The keys seen on each partition (in a dict to keep them in order), and the offset
+        # of the last message processed there
+        self._keys: Dict[Tuple[str, int], Dict[Any, None]] = {}
+        self._last_offsets: Dict[Tuple[str, int], int] = {}
+        self._window_durations_ms: List[int] = []
+        self._next_punctuation = 0.0
+
+    def track_keys(self, sdf: StreamingDataFrame, window_durations_ms: List[int]) -> StreamingDataFrame:
+        """
+        Adds the step that records the keys the ticks are sent to. It goes first in the pipeline.
+
+        Args:
+            sdf (StreamingDataFrame): The dataframe of the input topic.
+            window_durations_ms (List[int]): The lengths of the `CandleWindow`s of the
+                pipeline, in pipeline order.
+        """
+        if self.wall_clock_grace_ms is None:
+            return sdf
+        self._window_durations_ms = list(window_durations_ms)
+
+        def track(value: Any, key: Any, timestamp: int, headers: Any):
+            if key is None or is_tick(value):
+                return
+            ctx = message_context()
+            tp = (ctx.topic, ctx.partition)
+            if tp not in self._keys:
+                # The first message since the partition was assigned: its stores are recovered by now
+                self._keys[tp] = self._restored_keys(ctx.topic, ctx.partition)
+            self._keys[tp][key] = None
+            self._last_offsets[tp] = ctx.offset
+
+        return sdf.update(track, metadata=True)
+
+    def _restored_keys(self, topic: str, partition: int) -> Dict[Any, None]:
+        """
+        Returns the keys with an open window in the window stores of a partition.
+        """
+        keys = {}
+        for store in self._state_manager.stores.get(topic, {}).values():
+            if not isinstance(store, WindowedRocksDBStore) or partition not in store.partitions:
+                continue
+            # The window keys are <message key>|<start>|<end>
+            for window_key, _ in store.partitions[partition].iter_items(from_key=b'', read_opt=ReadOptions()):
+                keys[parse_window_key(window_key)[0]] = None
+        return keys
+
+    def _process_message(self, dataframe_composed):
+        super()._process_message(dataframe_composed)
+
+        if self.wall_clock_grace_ms is None:
+            return
+        now = time.time()
+        if now < self._next_punctuation:
+            return
+        self._next_punctuation = now + self.punctuation_interval_ms / 1000
+        self._punctuate(dataframe_composed, watermark_ms=int(now * 1000) - self.wall_clock_grace_ms)
+
+    def _is_caught_up(self, topic: str, partition: int) -> bool:
+        """
+        Returns whether we have processed the last message of the partition, as far as the
+        consumer knows from its last fetch (no request to the broker).
+        """
+        _, high = self._consumer.get_watermark_offsets(TopicPartition(topic, partition), cached=True)
+        # The high watermark is the offset of the last message + 1 (negative if unknown yet)
+        return high >= 0 and self._last_offsets[(topic, partition)] >= high - 1
+
+    def _punctuate(self, dataframe_composed, watermark_ms: int) -> None:
+        """
+        Sends a tick with the watermark to every key of every partition we have seen and
+        caught up with, for each resolution in turn.
+        """
+        for (topic, partition), keys in self._keys.items():
+            if not self._is_caught_up(topic, partition):
+                # The backlog closes the windows on event time, the ticks wait for the end of it
+                continue
+            offset = self._last_offsets[(topic, partition)]
+            for duration_ms in self._window_durations_ms:
+                tick = WallClockTick(watermark_ms, duration_ms)
+                for key in keys:
+                    context = copy_context()
+                    context.run(set_message_context, MessageContext(topic=topic, partition=partition, offset=offset, size=0))
+                    context.run(dataframe_composed[topic], tick, key, watermark_ms, None)
+
+            # The checkpoint only commits the stores of the partitions it has an offset
+            # for, so we store the last one again if no message came in since the last commit
+            try:
+                self._processing_context.store_offset(topic=topic, partition=partition, offset=offset)
+            except InvalidStoredOffset:
+                pass
+
+    def _forget(self, topic_partitions: List[TopicPartition]) -> None:
+        """
+        Stops sending ticks to the partitions we do not have anymore.
+        """
+        for tp in topic_partitions:
+            self._keys.pop((tp.topic, tp.partition), None)
+            self._last_offsets.pop((tp.topic, tp.partition), None)
+
+    def _on_revoke(self, consumer, topic_partitions: List[TopicPartition]):
+        super()._on_revoke(consumer, topic_partitions)
+        self._forget(topic_partitions)
+
+    def _on_lost(self, consumer, topic_partitions: List[TopicPartition]):
+        super()._on_lost(consumer, topic_partitions)
+        self._forget(topic_partitions)
@@ -0,0 +1,69 @@
+import re
+import shutil
+from pathlib import Path
+from typing import List
+
+from loguru import logger
+
+# The suffix of the names of our stores: the state version they were built with (and the
+# generation of the stores we named before, which we clear the same way)
+STORE_VERSION_SUFFIX = re.compile(r'_[gv](\d+)$')
+
+
+def get_store_name(name: str, state_version: int) -> str:
+    """
+    Returns the name of a store (or of a key in the default store) for a state version,
+    e.g. 'ohlcv_60s_v2'.
+
+    The window stores are checkpointed with the consumer offsets and backed up to their
+    changelog topics, so a restart resumes the windows where they were, even on a new
+    machine with an empty state directory. The state is only reset on purpose, by bumping
+    `state_version` (e.g. after a change of the candle state layout): the stores then
+    have new names, so the old ones are not restored from their changelog topics either.
+
+    The names only depend on the configured version, so nothing has to outlive the state
+    directory for the application to find its stores again.
+
+    Args:
+        name (str): The name of the store without the version.
+        state_version (int): The version of the state the application expects.
+
+    Returns:
+        str: The name of the store.
+    """
+    return f'{name}_v{state_version}'
+
+
+def clear_other_state_versions(state_dir: str, consumer_group: str, state_version: int) -> List[str]:
+    """
+    Deletes the local stores of the other state versions, which we no longer read.
+
+    quixstreams keeps each store in <state_dir>/<consumer_group>/<store name>. The stores
+    of the current version, and the stores without a version (e.g. the default store),
+    are kept.
+
+    Args:
+        state_dir (str): The state directory of the application.
+        consumer_group (str): The consumer group of the application.
+        state_version (int): The version of the state the application expects.
+
+    Returns:
+        List[str]: The names of the stores we deleted.
+    """
+    group_dir = Path(state_dir) / consumer_group
+    if not group_dir.is_dir():
+        logger.info(f'No local window state, the version {state_version} stores start from their changelog topics')
+        return []
+
+    cleared = []
+    for store_dir in sorted(group_dir.iterdir()):
+        match = STORE_VERSION_SUFFIX.search(store_dir.name)
+        if store_dir.is_dir() and match and store_dir.name[match.start():] != f'_v{state_version}':
+            shutil.rmtree(store_dir)
+            cleared.append(store_dir.name)
+
+    if cleared:
+        logger.info(f'Resetting the window state to version {state_version}, cleared the stores {cleared}')
+    else:
+        logger.info(f'Resuming the window state (version {state_version})')
+    return cleared
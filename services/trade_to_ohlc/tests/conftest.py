@@ -0,0 +1,11 @@
+import os
+
+# src.config reads the settings when it is imported, and the tests do not run the service
+for name, value in {
+    'KAFKA_BROKER_ADDRESS': 'localhost:19092',
+    'KAFKA_INPUT_TOPIC': 'trade',
+    'KAFKA_OUTPUT_TOPIC': 'ohlcv',
+    'KAFKA_CONSUMER_GROUP': 'trade_to_ohlcv_test',
+    'OHLCV_WINDOW_SECONDS': '1',
+}.items():
+    os.environ.setdefault(name, value)
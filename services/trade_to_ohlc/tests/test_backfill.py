@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from trade_archive_layout import DAY_MS, get_day_dir
+
+import src.main
+from src.main import backfill_trade_to_ohlcv
+
+MINUTE_MS = 60_000
+
+
+@pytest.fixture
+def written(monkeypatch) -> dict:
+    """
+    The candles the backfill writes, by topic, instead of writing them to Kafka.
+    """
+    written = {}
+    monkeypatch.setattr(
+        src.main, 'produce_candles', lambda app, topic_name, candles, *args: written.update({topic_name: candles})
+    )
+    return written
+
+
+def recent_minutes() -> list:
+    """
+    The starts of the 5 whole minutes before the last one, well inside the last day.
+    """
+    now_ms = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+    last_minute_ms = now_ms - now_ms % MINUTE_MS
+    return [last_minute_ms - i * MINUTE_MS for i in range(6, 1, -1)]
+
+
+def write_archive(archive_dir, product_id: str, timestamp_ms: list, price: list, quantity: list, side: list):
+    """
+    Writes the trades to a trade archive, one directory per day like the trade producer
+    (without the trade IDs, like the days archived before we kept them).
+    """
+    timestamp_ms = np.asarray(timestamp_ms, dtype=np.int64)
+    days = timestamp_ms // DAY_MS
+    for day in np.unique(days):
+        in_day = days == day
+        day_dir = get_day_dir(archive_dir, product_id, int(day) * DAY_MS)
+        day_dir.mkdir(parents=True)
+        np.save(day_dir / 'timestamp_ms.npy', timestamp_ms[in_day])
+        np.save(day_dir / 'price.npy', np.asarray(price, dtype=np.float64)[in_day])
+        np.save(day_dir / 'quantity.npy', np.asarray(quantity, dtype=np.float64)[in_day])
+        np.save(day_dir / 'side.npy', np.asarray(side, dtype=np.int8)[in_day])
+
+
+def backfill(**kwargs):
+    backfill_trade_to_ohlcv(
+        kafka_broker_address='localhost:19092',
+        kafka_input_topic='trade',
+        kafka_output_topic='ohlcv',
+        kafka_consumer_group='trade_to_ohlcv_test',
+        ohlcv_window_seconds=60,
+        **kwargs,
+    )
+
+
+def test_backfill_from_the_archive(tmp_path, written):
+    minutes = recent_minutes()
+    # two trades in each minute, and one too old for the last day
+    timestamp_ms = [minutes[0] - 2 * DAY_MS] + [start + offset for start in minutes for offset in (1_000, 30_000)]
+    n_trades = len(timestamp_ms)
+    write_archive(
+        tmp_path, 'BTC/EUR', timestamp_ms, [10.0 + i for i in range(n_trades)], [1.0] * n_trades, [1, -1] * (n_trades // 2) + [0]
+    )
+
+    backfill(last_n_days=1, trade_archive_dir=str(tmp_path), product_ids=['BTC/EUR'])
+
+    candles = written['ohlcv']
+    # every window of the range is closed, and the old trade is left out
+    assert candles['timestamp_ms'] == [start + MINUTE_MS for start in minutes]
+    assert candles['open'] == [11.0 + 2 * i for i in range(len(minutes))]
+    assert candles['trade_count'] == [2] * len(minutes)
+
+
+def test_backfill_from_the_topic_keeps_the_last_days_only(monkeypatch, written):
+    minutes = recent_minutes()
+    trades = {
+        'product_id': ['BTC/EUR'] * 3,
+        'timestamp_ms': [minutes[0] - 2 * DAY_MS, minutes[0] + 1_000, minutes[1] + 1_000],
+        'price': [5.0, 10.0, 11.0],
+        'quantity': [1.0, 1.0, 1.0],
+    }
+    monkeypatch.setattr(src.main, 'read_topic_trades', lambda app, topic_name, codec: [trades])
+
+    backfill(last_n_days=1)
+
+    assert written['ohlcv']['timestamp_ms'] == [minutes[0] + MINUTE_MS, minutes[1] + MINUTE_MS]
+    assert written['ohlcv']['open'] == [10.0, 11.0]
+
+
+def test_reading_the_archive_as_fixed_point_is_refused(tmp_path, written):
+    with pytest.raises(ValueError):
+        backfill(last_n_days=1, trade_archive_dir=str(tmp_path), product_ids=['BTC/EUR'], fixed_point=True)
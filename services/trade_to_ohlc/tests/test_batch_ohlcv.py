@@ -0,0 +1,195 @@
+import random
+from contextvars import copy_context
+
+import numpy as np
+import pytest
+from quixstreams.context import set_message_context
+from quixstreams.models import MessageContext
+from quixstreams.state.rocksdb.windowed.partition import WindowedRocksDBStorePartition
+
+from src.batch_ohlcv import CANDLE_RECORD_FIELDS, compute_ohlcv
+from src.candle_window import CandleWindow
+from src.main import (
+    init_ohlcv_candle,
+    init_ohlcv_candle_from_candle,
+    merge_ohlcv_candles,
+    to_candle_record,
+    update_ohlvc_candle,
+)
+
+WINDOW_SECONDS = [1, 3, 6]
+
+
+def make_trades(n: int, fixed_point: bool, seed: int = 0) -> list:
+    """
+    Trades of three products in one partition, mostly in order, with some trades a bit
+    out of order and some late enough to be dropped.
+    """
+    rng = random.Random(seed)
+    trades, timestamp_ms = [], 1_000
+    for _ in range(n):
+        timestamp_ms += rng.randint(0, 400)
+        # one trade in ten comes from up to 2s in the past
+        late_ms = rng.randint(0, 2_000) if rng.random() < 0.1 else 0
+        price, quantity = rng.uniform(100, 110), rng.uniform(0.001, 2)
+        if fixed_point:
+            price, quantity = round(price * 100), round(quantity * 10**8)
+        trades.append({
+            # BTC/EUR trades a lot more than the others
+            'product_id': rng.choice(['BTC/EUR', 'BTC/EUR', 'BTC/EUR', 'ETH/EUR', 'SOL/EUR']),
+            'timestamp_ms': max(timestamp_ms - late_ms, 0),
+            'price': price,
+            'quantity': quantity,
+            'side': rng.choice([1, -1, 0]),
+        })
+    return trades
+
+
+def stream_ohlcv(trades: list, tmp_path) -> list:
+    """
+    Runs the trades through the candle windows of the streaming pipeline (the
+    reducers and the projection of src.main, and one window store per resolution), and returns the closed
+    candles of each resolution in the order they are written.
+    """
+    windows = [
+        CandleWindow(
+            duration_ms=WINDOW_SECONDS[0] * 1000, name='w0', reducer=update_ohlvc_candle,
+            initializer=init_ohlcv_candle, dataframe=None,
+        )
+    ] + [
+        CandleWindow(
+            duration_ms=seconds * 1000, name=f'w{i}', reducer=merge_ohlcv_candles,
+            initializer=init_ohlcv_candle_from_candle, dataframe=None, closed_by_key=True,
+        )
+        for i, seconds in enumerate(WINDOW_SECONDS[1:], start=1)
+    ]
+    transactions = [
+        WindowedRocksDBStorePartition(str(tmp_path / f'window_{i}')).begin() for i in range(len(windows))
+    ]
+    outputs = [[] for _ in windows]
+
+    def process(level: int, value: dict, timestamp_ms: int):
+        key = value['product_id'].encode()
+        _, expired = windows[level].process_window(value, timestamp_ms, transactions[level].as_state(prefix=key))
+        for window in expired:
+            candle = to_candle_record(window, key, window['start'], None)
+            outputs[level].append(candle)
+            # the closed window keeps its start as the timestamp of the message
+            if level + 1 < len(windows):
+                process(level + 1, dict(candle), window['start'])
+
+    def run():
+        for offset, trade in enumerate(trades):
+            set_message_context(MessageContext(topic='trade', partition=0, offset=offset, size=0))
+            process(0, dict(trade), trade['timestamp_ms'])
+
+    copy_context().run(run)
+    return outputs
+
+
+def batch_ohlcv(trades: list, closed_before_ms=None) -> list:
+    results = compute_ohlcv(
+        [trade['product_id'] for trade in trades],
+        np.array([trade['timestamp_ms'] for trade in trades], dtype=np.int64),
+        np.array([trade['price'] for trade in trades]),
+        np.array([trade['quantity'] for trade in trades]),
+        WINDOW_SECONDS,
+        closed_before_ms=closed_before_ms,
+        side=np.array([trade.get('side', 0) for trade in trades], dtype=np.int8),
+    )
+    return [[dict(zip(CANDLE_RECORD_FIELDS, record)) for record in zip(*result.values())] for result in results]
+
+
+@pytest.mark.parametrize('fixed_point', [False, True])
+def test_batch_matches_the_streaming_reducer(tmp_path, fixed_point):
+    trades = make_trades(2_000, fixed_point)
+
+    streamed = stream_ohlcv(trades, tmp_path)
+    batched = batch_ohlcv(trades)
+
+    # same candles, same order, and the float volumes and VWAPs computed the same way to the last bit
+    for stream_candles, batch_candles in zip(streamed, batched):
+        assert len(stream_candles) > 0
+        assert batch_candles == stream_candles
+
+
+def test_late_trades_are_dropped_like_the_stream(tmp_path):
+    trades = [
+        {'product_id': 'BTC/EUR', 'timestamp_ms': 1_500, 'price': 10.0, 'quantity': 1.0},
+        {'product_id': 'ETH/EUR', 'timestamp_ms': 2_100, 'price': 20.0, 'quantity': 1.0},
+        # its window [1000, 2000) has ended for the partition, even if not for BTC/EUR
+        {'product_id': 'BTC/EUR', 'timestamp_ms': 1_900, 'price': 99.0, 'quantity': 5.0},
+        {'product_id': 'BTC/EUR', 'timestamp_ms': 3_000, 'price': 11.0, 'quantity': 1.0},
+    ]
+
+    batched = batch_ohlcv(trades)
+
+    assert batched == stream_ohlcv(trades, tmp_path)
+    assert batched[0] == [
+        {
+            'product_id': 'BTC/EUR', 'timestamp_ms': 2_000, 'open': 10.0, 'high': 10.0, 'low': 10.0, 'close': 10.0,
+            'volume': 1.0, 'vwap': 10.0, 'trade_count': 1, 'buy_volume': 0.0, 'sell_volume': 0.0, 'notional': 10.0,
+        },
+    ]
+
+
+def test_every_product_of_a_partition_gets_its_coarser_candles(tmp_path):
+    # BTC/EUR trades all the time, ETH/EUR once at the start and then much later: its
+    # first 1s candle is closed after BTC/EUR has moved the partition past its 3s and 6s
+    # windows, and so is each coarser candle it falls in
+    trades = [
+        {'product_id': 'BTC/EUR', 'timestamp_ms': timestamp_ms, 'price': 10.0, 'quantity': 1.0}
+        for timestamp_ms in range(0, 13_000, 300)
+    ]
+    trades.insert(2, {'product_id': 'ETH/EUR', 'timestamp_ms': 700, 'price': 20.0, 'quantity': 2.0})
+    trades += [
+        {'product_id': 'ETH/EUR', 'timestamp_ms': timestamp_ms, 'price': 21.0, 'quantity': 3.0}
+        for timestamp_ms in (13_100, 20_100, 21_100)
+    ]
+
+    streamed = stream_ohlcv(trades, tmp_path)
+
+    assert batch_ohlcv(trades) == streamed
+    assert [
+        [(candle['timestamp_ms'], candle['volume']) for candle in candles if candle['product_id'] == 'ETH/EUR']
+        for candles in streamed
+    ] == [
+        [(1_000, 2.0), (14_000, 3.0), (21_000, 3.0)],
+        [(3_000, 2.0), (15_000, 3.0)],
+        [(6_000, 2.0)],
+    ]
+    # and BTC/EUR has all of its candles (its last trades are still open)
+    assert [
+        [candle['timestamp_ms'] for candle in candles if candle['product_id'] == 'BTC/EUR']
+        for candles in streamed
+    ] == [list(range(1_000, 12_001, 1_000)), [3_000, 6_000, 9_000], [6_000]]
+
+
+def test_closed_before_closes_the_windows_no_message_has_closed():
+    trades = [
+        {'product_id': 'BTC/EUR', 'timestamp_ms': 500, 'price': 10.0, 'quantity': 1.0},
+        {'product_id': 'ETH/EUR', 'timestamp_ms': 1_200, 'price': 20.0, 'quantity': 2.0},
+        {'product_id': 'ETH/EUR', 'timestamp_ms': 2_500, 'price': 21.0, 'quantity': 3.0},
+    ]
+
+    # the BTC/EUR window waits for the next BTC/EUR trade, the last ETH/EUR one is still open
+    assert [candle['product_id'] for candle in batch_ohlcv(trades)[0]] == ['ETH/EUR']
+    assert [
+        (candle['product_id'], candle['timestamp_ms']) for candle in batch_ohlcv(trades, closed_before_ms=2_000)[0]
+    ] == [('ETH/EUR', 2_000), ('BTC/EUR', 1_000)]
+
+
+def test_vwap_and_the_volume_of_each_side():
+    trades = [
+        {'product_id': 'BTC/EUR', 'timestamp_ms': 100, 'price': 10.0, 'quantity': 1.0, 'side': 1},
+        {'product_id': 'BTC/EUR', 'timestamp_ms': 200, 'price': 20.0, 'quantity': 3.0, 'side': -1},
+        {'product_id': 'BTC/EUR', 'timestamp_ms': 300, 'price': 12.0, 'quantity': 0.5, 'side': 0},
+        {'product_id': 'BTC/EUR', 'timestamp_ms': 1_100, 'price': 11.0, 'quantity': 1.0, 'side': 1},
+    ]
+
+    [candle] = batch_ohlcv(trades)[0]
+
+    assert candle['trade_count'] == 3
+    assert (candle['volume'], candle['buy_volume'], candle['sell_volume']) == (4.5, 1.0, 3.0)
+    assert candle['notional'] == 76.0
+    assert candle['vwap'] == 76.0 / 4.5
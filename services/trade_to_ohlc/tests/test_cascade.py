@@ -0,0 +1,30 @@
+import pytest
+
+from src.main import check_cascade
+
+
+def test_the_resolutions_come_from_the_finest_to_the_coarsest():
+    cascade = {3_600: 'ohlcv_1h', 60: 'ohlcv_1m', 300: 'ohlcv_5m'}
+
+    assert check_cascade(1, cascade) == [(60, 'ohlcv_1m'), (300, 'ohlcv_5m'), (3_600, 'ohlcv_1h')]
+
+
+def test_no_cascade():
+    assert check_cascade(60, {}) == []
+
+
+@pytest.mark.parametrize(
+    'cascade',
+    [
+        # not a multiple of the trade candles
+        {90: 'ohlcv_90s'},
+        # not a multiple of the previous resolution
+        {120: 'ohlcv_2m', 300: 'ohlcv_5m'},
+        # not coarser
+        {60: 'ohlcv_1m'},
+        {30: 'ohlcv_30s'},
+    ],
+)
+def test_a_resolution_must_be_a_multiple_of_the_previous_one(cascade):
+    with pytest.raises(ValueError, match='must be a multiple of'):
+        check_cascade(60, cascade)
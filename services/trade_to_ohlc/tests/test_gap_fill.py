@@ -0,0 +1,47 @@
+from src.batch_ohlcv import CANDLE_RECORD_FIELDS, fill_empty_windows
+from src.gap_fill import empty_candles
+
+
+def candle(product_id: str, timestamp_ms: int, close, volume) -> dict:
+    # all the volume bought at the close
+    return {
+        'product_id': product_id, 'timestamp_ms': timestamp_ms,
+        'open': close, 'high': close, 'low': close, 'close': close, 'volume': volume,
+        'vwap': close, 'trade_count': 1 if volume else 0, 'buy_volume': volume, 'sell_volume': volume * 0,
+        'notional': close * volume,
+    }
+
+
+def test_empty_candles_forward_fill_the_last_close():
+    last_candle = {**candle('BTC/EUR', 2_000, 10.5, 3.0), 'open': 9.0}
+
+    assert empty_candles(last_candle, 4_000, 1_000) == [
+        candle('BTC/EUR', 3_000, 10.5, 0.0),
+        candle('BTC/EUR', 4_000, 10.5, 0.0),
+    ]
+    # fixed-point candles get an integer volume, and there is nothing between neighbours
+    assert empty_candles(candle('BTC/EUR', 2_000, 1050, 300), 3_000, 1_000) == [candle('BTC/EUR', 3_000, 1050, 0)]
+    assert empty_candles(last_candle, 2_000, 1_000) == []
+
+
+def test_the_batch_candles_of_each_product_are_dense():
+    records = [
+        candle('BTC/EUR', 1_000, 10.0, 1.0),
+        candle('ETH/EUR', 1_000, 20.0, 1.0),
+        candle('BTC/EUR', 4_000, 11.0, 1.0),
+    ]
+    candles = {name: [record[name] for record in records] for name in CANDLE_RECORD_FIELDS}
+
+    filled = fill_empty_windows(candles, 1_000, closed_before_ms=3_500)
+
+    assert list(zip(filled['product_id'], filled['timestamp_ms'], filled['volume'])) == [
+        ('BTC/EUR', 1_000, 1.0),
+        ('ETH/EUR', 1_000, 1.0),
+        # before the next BTC/EUR candle
+        ('BTC/EUR', 2_000, 0.0),
+        ('BTC/EUR', 3_000, 0.0),
+        ('BTC/EUR', 4_000, 1.0),
+        # after the last ETH/EUR candle, up to the end of the range
+        ('ETH/EUR', 2_000, 0.0),
+        ('ETH/EUR', 3_000, 0.0),
+    ]
@@ -0,0 +1,56 @@
+import pytest
+
+from src.information_bars import add_trade_to_bar, check_bars
+from src.main import BAR_MEASURES, init_ohlcv_candle, to_candle_record, update_ohlvc_candle
+
+
+def run_bars(bar_type: str, threshold: float, trades: list) -> list:
+    """
+    Runs (timestamp_ms, price, quantity) trades of BTC/EUR through the bars, and returns
+    the records of the bars they close.
+    """
+    bar, records = None, []
+    for timestamp_ms, price, quantity in trades:
+        trade = {'product_id': 'BTC/EUR', 'price': price, 'quantity': quantity, 'side': 1}
+        bar, closed_bar = add_trade_to_bar(
+            bar, trade, timestamp_ms, threshold, BAR_MEASURES[bar_type], init_ohlcv_candle, update_ohlvc_candle
+        )
+        if closed_bar is not None:
+            records.append(to_candle_record(closed_bar, b'BTC/EUR', closed_bar['start'], None))
+    return records
+
+
+TRADES = [(1_000, 10.0, 1.0), (1_500, 12.0, 2.0), (9_000, 11.0, 0.5), (9_100, 20.0, 4.0), (9_200, 15.0, 1.0)]
+
+
+@pytest.mark.parametrize('bar_type, threshold, expected', [
+    # every 2 trades, and the last one stays open
+    ('tick', 2, [(1_500, 2, 3.0), (9_100, 2, 4.5)]),
+    # the trade that reaches the threshold closes the bar, with all its quantity
+    ('volume', 3.0, [(1_500, 2, 3.0), (9_100, 2, 4.5)]),
+    ('dollar', 30.0, [(1_500, 2, 3.0), (9_100, 2, 4.5)]),
+    ('dollar', 100.0, [(9_100, 4, 7.5)]),
+])
+def test_bars_close_on_the_threshold(bar_type, threshold, expected):
+    records = run_bars(bar_type, threshold, TRADES)
+
+    assert [(record['timestamp_ms'], record['trade_count'], record['volume']) for record in records] == expected
+
+
+def test_a_bar_is_a_candle_of_its_trades():
+    [record] = run_bars('volume', 3.0, TRADES[:2])
+
+    assert record == {
+        'product_id': 'BTC/EUR', 'timestamp_ms': 1_500, 'open': 10.0, 'high': 12.0, 'low': 10.0, 'close': 12.0,
+        'volume': 3.0, 'vwap': 34.0 / 3.0, 'trade_count': 2, 'buy_volume': 3.0, 'sell_volume': 0.0, 'notional': 34.0,
+    }
+
+
+def test_check_bars():
+    assert check_bars({'tick': 'tick_bars'}, {'tick': {'BTC/EUR': 100}}) == [('tick', 'tick_bars', {'BTC/EUR': 100})]
+    with pytest.raises(ValueError):
+        check_bars({'time': 'time_bars'}, {'time': {'BTC/EUR': 100}})
+    with pytest.raises(ValueError):
+        check_bars({'volume': 'volume_bars'}, {})
+    with pytest.raises(ValueError):
+        check_bars({'dollar': 'dollar_bars'}, {'dollar': {'BTC/EUR': 0}})
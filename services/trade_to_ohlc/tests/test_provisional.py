@@ -0,0 +1,100 @@
+from contextvars import copy_context
+
+from quixstreams.context import set_message_context
+from quixstreams.models import MessageContext
+
+from src.candle_window import CandleWindow
+from src.main import TRADE_COUNT, init_ohlcv_candle, update_ohlvc_candle
+from src.provisional import ProvisionalThrottle, is_provisional
+from src.wall_clock import WallClockApplication, is_tick
+
+
+def test_a_window_is_emitted_at_most_once_per_interval():
+    throttle = ProvisionalThrottle(interval_ms=250)
+
+    assert throttle.is_due(b'BTC/EUR', 0, now=10.0)
+    assert not throttle.is_due(b'BTC/EUR', 0, now=10.2)
+    assert throttle.is_due(b'BTC/EUR', 0, now=10.25)
+    # each window of each key has its own interval
+    assert throttle.is_due(b'ETH/EUR', 0, now=10.3)
+    assert throttle.is_due(b'BTC/EUR', 60_000, now=10.3)
+
+
+def test_a_closed_window_is_forgotten():
+    throttle = ProvisionalThrottle(interval_ms=250)
+    throttle.is_due(b'BTC/EUR', 0, now=10.0)
+
+    throttle.forget(b'BTC/EUR', 0)
+
+    assert throttle.is_due(b'BTC/EUR', 0, now=10.1)
+
+
+def test_a_held_back_update_is_due_once_its_interval_is_over():
+    throttle = ProvisionalThrottle(interval_ms=250)
+    throttle.is_due(b'BTC/EUR', 0, now=10.0)
+    assert throttle.held_back_due(b'BTC/EUR', now=10.3) == []
+
+    assert not throttle.is_due(b'BTC/EUR', 0, now=10.1)
+    assert throttle.held_back_due(b'BTC/EUR', now=10.2) == []
+    assert throttle.held_back_due(b'BTC/EUR', now=10.25) == [0]
+    # it is emitted once, and starts the next interval
+    assert throttle.held_back_due(b'BTC/EUR', now=10.3) == []
+    assert not throttle.is_due(b'BTC/EUR', 0, now=10.4)
+
+
+def test_a_held_back_update_is_dropped_with_its_window():
+    throttle = ProvisionalThrottle(interval_ms=250)
+    throttle.is_due(b'BTC/EUR', 0, now=10.0)
+    throttle.is_due(b'BTC/EUR', 0, now=10.1)
+
+    throttle.forget(b'BTC/EUR', 0)
+
+    assert throttle.held_back_due(b'BTC/EUR', now=11.0) == []
+
+
+def test_the_tick_after_the_interval_emits_the_held_back_window(tmp_path):
+    app = WallClockApplication(
+        broker_address='localhost:1',
+        consumer_group='trade_to_ohlcv_test',
+        state_dir=str(tmp_path),
+        use_changelog_topics=False,
+        wall_clock_grace_ms=0,
+    )
+    sdf = app.dataframe(app.topic('trade', value_deserializer='json'))
+    sdf = app.track_keys(sdf, [60_000])
+    window = CandleWindow(
+        duration_ms=60_000,
+        name='w',
+        reducer=update_ohlvc_candle,
+        initializer=init_ohlcv_candle,
+        dataframe=sdf,
+        provisional_interval_ms=250,
+    )
+    now = [10.0]
+    window._throttle = ProvisionalThrottle(250, clock=lambda: now[0])
+    emitted = []
+    sdf = window.final().update(
+        lambda candle, key, timestamp, headers: is_tick(candle)
+        or emitted.append((is_provisional(headers), candle['value'][TRADE_COUNT])),
+        metadata=True,
+    )
+    composed = sdf.compose()
+    app._state_manager.on_partition_assign(topic='trade', partition=0, committed_offset=-1001)
+    app._processing_context.init_checkpoint()
+    app._consumer.get_watermark_offsets = lambda tp, cached: (0, 2)
+
+    def run():
+        for offset, timestamp_ms in enumerate([1_000, 1_100]):
+            set_message_context(MessageContext(topic='trade', partition=0, offset=offset, size=0))
+            composed['trade']({'product_id': 'BTC/EUR', 'price': 10.0, 'quantity': 1.0}, b'BTC/EUR', timestamp_ms, None)
+            now[0] += 0.1
+        # the second trade was held back, and no other trade comes in
+        app._punctuate(composed, watermark_ms=1_200)
+        now[0] += 0.1
+        app._punctuate(composed, watermark_ms=1_300)
+        now[0] += 1.0
+        app._punctuate(composed, watermark_ms=2_300)
+
+    copy_context().run(run)
+
+    assert emitted == [(True, 1), (True, 2)]
@@ -0,0 +1,155 @@
+from contextvars import copy_context
+
+from quixstreams.context import set_message_context
+from quixstreams.models import MessageContext
+from quixstreams.state.rocksdb.windowed.partition import WindowedRocksDBStorePartition
+
+from src.candle_window import CandleWindow
+from src.main import TRADE_COUNT, init_ohlcv_candle, update_ohlvc_candle
+from src.wall_clock import WallClockApplication, WallClockTick, is_tick
+
+
+def run_window(messages: list, tmp_path) -> list:
+    """
+    Runs (key, value, timestamp_ms) messages through a 1s candle window with one store
+    partition, and returns the (key, start) of the windows it closes, in order.
+    """
+    window = CandleWindow(
+        duration_ms=1_000, name='w', reducer=update_ohlvc_candle, initializer=init_ohlcv_candle, dataframe=None
+    )
+    transaction = WindowedRocksDBStorePartition(str(tmp_path / 'window')).begin()
+    closed = []
+
+    def run():
+        for offset, (key, value, timestamp_ms) in enumerate(messages):
+            set_message_context(MessageContext(topic='trade', partition=0, offset=offset, size=0))
+            _, expired = window.process_window(value, timestamp_ms, transaction.as_state(prefix=key.encode()))
+            closed.extend((key, expired_window['start']) for expired_window in expired)
+
+    copy_context().run(run)
+    return closed
+
+
+def trade(product_id: str, timestamp_ms: int) -> tuple:
+    return product_id, {'product_id': product_id, 'price': 10.0, 'quantity': 1.0}, timestamp_ms
+
+
+def test_a_tick_closes_the_windows_without_a_new_trade(tmp_path):
+    messages = [
+        trade('BTC/EUR', 1_200),
+        trade('ETH/EUR', 1_500),
+        # not yet the end of the windows
+        ('BTC/EUR', WallClockTick(1_900, 1_000), 1_900),
+        ('BTC/EUR', WallClockTick(2_000, 1_000), 2_000),
+        ('ETH/EUR', WallClockTick(2_000, 1_000), 2_000),
+    ]
+
+    assert run_window(messages, tmp_path) == [('BTC/EUR', 1_000), ('ETH/EUR', 1_000)]
+
+
+def test_the_windows_of_the_ticks_alone_are_not_candles(tmp_path):
+    messages = [
+        trade('BTC/EUR', 1_200),
+        ('BTC/EUR', WallClockTick(2_500, 1_000), 2_500),
+        ('BTC/EUR', WallClockTick(5_000, 1_000), 5_000),
+        # a trade that comes after the tick of its window (the consumer was caught up) is
+        # late and dropped, and a trade in the window the tick opened is a candle
+        trade('BTC/EUR', 4_900),
+        trade('BTC/EUR', 5_100),
+        ('BTC/EUR', WallClockTick(6_000, 1_000), 6_000),
+    ]
+
+    assert run_window(messages, tmp_path) == [('BTC/EUR', 1_000), ('BTC/EUR', 5_000)]
+
+
+def test_a_lagging_backlog_is_not_dropped_by_the_ticks(tmp_path):
+    app = WallClockApplication(
+        broker_address='localhost:1',
+        consumer_group='trade_to_ohlcv_test',
+        state_dir=str(tmp_path),
+        use_changelog_topics=False,
+        wall_clock_grace_ms=0,
+    )
+    sdf = app.dataframe(app.topic('trade', value_deserializer='json'))
+    sdf = app.track_keys(sdf, [1_000])
+    sdf = CandleWindow(
+        duration_ms=1_000, name='w', reducer=update_ohlvc_candle, initializer=init_ohlcv_candle, dataframe=sdf
+    ).final()
+    closed = []
+    sdf = sdf.update(
+        lambda window, key, timestamp, headers: is_tick(window) or closed.append((window['start'], window['value'][TRADE_COUNT])),
+        metadata=True,
+    )
+    composed = sdf.compose()
+    app._state_manager.on_partition_assign(topic='trade', partition=0, committed_offset=-1001)
+    app._processing_context.init_checkpoint()
+
+    # the topic has 4 trades, the consumer learns of them with its first fetch
+    timestamps_ms = [1_200, 1_500, 1_800, 2_300]
+    app._consumer.get_watermark_offsets = lambda tp, cached: (0, len(timestamps_ms))
+
+    def run():
+        for offset, timestamp_ms in enumerate(timestamps_ms):
+            set_message_context(MessageContext(topic='trade', partition=0, offset=offset, size=0))
+            composed['trade']({'product_id': 'BTC/EUR', 'price': 10.0, 'quantity': 1.0}, b'BTC/EUR', timestamp_ms, None)
+            # the wall clock is far ahead of the backlog
+            app._punctuate(composed, watermark_ms=10_000)
+
+    copy_context().run(run)
+
+    # the backlog is all aggregated, and once we are caught up the tick closes the last window
+    assert closed == [(1_000, 3), (2_000, 1)]
+
+
+def run_app(tmp_path, timestamps_ms: list, keys: list, first_offset: int, watermark_ms: int) -> tuple:
+    """
+    Runs the trades of the given keys through a 1s candle window of a new application on
+    the state directory, ticks it once at the end, and stops it like a restart would (the
+    state is flushed to the stores). Returns the tracked keys and the closed windows.
+    """
+    app = WallClockApplication(
+        broker_address='localhost:1',
+        consumer_group='trade_to_ohlcv_test',
+        state_dir=str(tmp_path),
+        use_changelog_topics=False,
+        wall_clock_grace_ms=0,
+    )
+    sdf = app.dataframe(app.topic('trade', value_deserializer='json'))
+    sdf = app.track_keys(sdf, [1_000])
+    sdf = CandleWindow(
+        duration_ms=1_000, name='w', reducer=update_ohlvc_candle, initializer=init_ohlcv_candle, dataframe=sdf
+    ).final()
+    closed = []
+    sdf = sdf.update(lambda window, key, timestamp, headers: is_tick(window) or closed.append((key, window['start'])), metadata=True)
+    composed = sdf.compose()
+    app._state_manager.on_partition_assign(topic='trade', partition=0, committed_offset=-1001)
+    app._processing_context.init_checkpoint()
+    last_offset = first_offset + len(timestamps_ms) - 1
+    app._consumer.get_watermark_offsets = lambda tp, cached: (0, last_offset + 1)
+
+    def run():
+        for offset, (key, timestamp_ms) in enumerate(zip(keys, timestamps_ms), start=first_offset):
+            set_message_context(MessageContext(topic='trade', partition=0, offset=offset, size=0))
+            composed['trade']({'product_id': key.decode(), 'price': 10.0, 'quantity': 1.0}, key, timestamp_ms, None)
+        app._punctuate(composed, watermark_ms=watermark_ms)
+
+    copy_context().run(run)
+    tracked = list(app._keys[('trade', 0)])
+    checkpoint = app._processing_context._checkpoint
+    for transaction in checkpoint._store_transactions.values():
+        transaction.prepare(processed_offset=last_offset)
+        transaction.flush(processed_offset=last_offset)
+    app._state_manager.close()
+    return tracked, closed
+
+
+def test_the_keys_of_the_restored_windows_are_ticked_after_a_restart(tmp_path):
+    # ETH/EUR trades once and goes quiet, its window is still open when we stop
+    tracked, closed = run_app(tmp_path, [1_200, 1_500], [b'ETH/EUR', b'BTC/EUR'], first_offset=0, watermark_ms=1_900)
+    assert tracked == [b'ETH/EUR', b'BTC/EUR']
+    assert closed == []
+
+    # after the restart only BTC/EUR trades, and the tick closes the window of ETH/EUR too
+    tracked, closed = run_app(tmp_path, [1_700], [b'BTC/EUR'], first_offset=2, watermark_ms=2_000)
+    assert sorted(tracked) == [b'BTC/EUR', b'ETH/EUR']
+    assert sorted(closed) == [(b'BTC/EUR', 1_000), (b'ETH/EUR', 1_000)]
@@ -0,0 +1,43 @@
+from src.window_state import clear_other_state_versions, get_store_name
+
+
+def make_stores(tmp_path, *names: str) -> None:
+    for name in names:
+        (tmp_path / 'group' / name / 'trade').mkdir(parents=True)
+
+
+def stores(tmp_path) -> list:
+    return sorted(path.name for path in (tmp_path / 'group').iterdir())
+
+
+def test_the_store_names_only_depend_on_the_state_version():
+    assert get_store_name('ohlcv_60s', 2) == 'ohlcv_60s_v2'
+    assert get_store_name('ohlcv_60s', 3) != get_store_name('ohlcv_60s', 2)
+
+
+def test_the_stores_of_the_version_are_resumed(tmp_path):
+    make_stores(tmp_path, 'ohlcv_60s_v2', 'ohlcv_300s_v2', 'default')
+
+    assert clear_other_state_versions(str(tmp_path), 'group', state_version=2) == []
+    assert stores(tmp_path) == ['default', 'ohlcv_300s_v2', 'ohlcv_60s_v2']
+
+
+def test_a_version_bump_clears_the_stores_of_the_other_versions(tmp_path):
+    # including the stores named after a generation, before the names had the version
+    make_stores(tmp_path, 'ohlcv_60s_v1', 'ohlcv_60s_v2', 'ohlcv_60s_g3', 'default')
+
+    assert clear_other_state_versions(str(tmp_path), 'group', state_version=2) == ['ohlcv_60s_g3', 'ohlcv_60s_v1']
+    assert stores(tmp_path) == ['default', 'ohlcv_60s_v2']
+
+
+def test_an_empty_state_directory_is_not_an_error(tmp_path):
+    assert clear_other_state_versions(str(tmp_path / 'missing'), 'group', state_version=2) == []
+
+
+def test_each_consumer_group_has_its_own_stores(tmp_path):
+    (tmp_path / 'historical' / 'ohlcv_60s_v1').mkdir(parents=True)
+    make_stores(tmp_path, 'ohlcv_60s_v1')
+
+    clear_other_state_versions(str(tmp_path), 'historical', state_version=2)
+
+    assert stores(tmp_path) == ['ohlcv_60s_v1']